@@ -0,0 +1,107 @@
+"""
+低記憶體模式的記憶體用量測試
+
+以合成的網址清單跑一次批次流程（讀取 → 去重 → 重試佇列 → 結果輸出），
+不連網、不呼叫 FFmpeg，只量測流程本身的記憶體用量。
+每個項目數各在獨立的子程序中執行，比較峰值 RSS：
+低記憶體模式下 100 個與 100,000 個項目的峰值應該幾乎相同。
+
+用法：
+    python bench_memory.py                      # 預設 100、1,000、10,000、100,000
+    python bench_memory.py 1000 1000000         # 自訂項目數
+    python bench_memory.py --mode default       # 與一般模式比較
+"""
+import argparse
+import base64
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from dl_ingest import DEDUP_WINDOW, UrlIngester
+from dl_retry import RetryBatch, RetryPolicy
+from dl_transcode import PENDING_LIMIT
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 回傳位元組，Linux 回傳 KB
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def write_urls(path, count):
+    """產生 count 個不重複的影片網址，每 10 個夾雜一個重複項目"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(count):
+            video_id = base64.urlsafe_b64encode(i.to_bytes(9, 'big')).decode()[1:12]
+            f.write(f"https://www.youtube.com/watch?v={video_id}\n")
+            if i % 10 == 0:
+                f.write(f"https://youtu.be/{video_id}\n")
+
+
+def run_pipeline(urls_file, low_memory):
+    """子程序：跑一次批次流程並回報峰值 RSS"""
+    ingester = UrlIngester(window=DEDUP_WINDOW if low_memory else None)
+    batch = RetryBatch(
+        RetryPolicy(),
+        log=lambda message: None,
+        sleep=lambda seconds: None,
+        keep_results=not low_memory,
+        max_pending=PENDING_LIMIT if low_memory else None,
+    )
+    attempts = {}
+
+    def attempt(url):
+        # 約 1% 的項目第一次遇到暫時性網路錯誤
+        if hash(url) % 100 == 0 and url not in attempts:
+            attempts[url] = True
+            return ConnectionResetError("connection reset by peer")
+        attempts.pop(url, None)
+        return None
+
+    with open(os.devnull, 'w') as sink:
+        def on_done(url, success, done):
+            sink.write(f"{'OK' if success else 'FAIL'} {url}\n")
+
+        started = time.perf_counter()
+        batch.run(ingester.ingest_source(urls_file), attempt, on_done)
+        elapsed = time.perf_counter() - started
+
+    print(f"{ingester.unique} {batch.succeeded_count} {peak_rss_kb()} {elapsed:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='低記憶體模式的記憶體用量測試')
+    parser.add_argument('counts', nargs='*', type=int, default=[100, 1000, 10000, 100000])
+    parser.add_argument('--mode', choices=('low-memory', 'default'), default='low-memory')
+    parser.add_argument('--child', nargs=2, metavar=('URLS_FILE', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_pipeline(args.child[0], args.child[1] == 'low-memory')
+        return
+
+    print(f"模式: {args.mode}")
+    print(f"{'項目數':>10} {'成功':>10} {'峰值 RSS (MB)':>14} {'耗時 (秒)':>10}")
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in args.counts:
+            urls_file = os.path.join(tmp, f"urls_{count}.txt")
+            write_urls(urls_file, count)
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', urls_file, args.mode],
+                capture_output=True, text=True, check=True
+            ).stdout.split()
+            unique, succeeded, rss_kb, elapsed = int(output[0]), int(output[1]), int(output[2]), output[3]
+            results.append(rss_kb)
+            print(f"{unique:>10} {succeeded:>10} {rss_kb / 1024:>14.1f} {elapsed:>10}")
+            os.remove(urls_file)
+
+    growth = (results[-1] - results[0]) / 1024
+    print(f"\n峰值 RSS 差異（最大與最小項目數）: {growth:+.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import yt_dlp
+from yt_dlp.utils import DownloadCancelled
 import os
 import sys
 import re
@@ -8,9 +9,23 @@ import time
 import platform
 from datetime import datetime
 from pathlib import Path
+import dl_http
+from dl_disk import DEFAULT_RESERVE_BYTES, DiskBudget, estimate_job_bytes, remove_partials
+from dl_ffmpeg import get_capabilities, resolve_ffmpeg
+from dl_retry import ERROR_DISK, ERROR_LABELS, RetryBatch, RetryPolicy, classify_error
+from dl_ingest import DEDUP_WINDOW, UrlIngester, extract_video_id, parse_youtube_url
+from dl_loudness import LoudnessCache, LoudnessNormalizer, loudnorm_filter
+from dl_metrics import METRICS
+from dl_priority import DEFAULT_BEACON_DIR, PRIORITY_BULK, PRIORITY_INTERACTIVE, PriorityScheduler
+from dl_store import MediaStore
+from dl_stream import stream_to_mp3, streamable
+from dl_transcode import PENDING_LIMIT, TranscodePool, mp3_encoder_for, parse_qualities, quality_outputs
+from dl_verify import IntegrityError, verify_media
 
 class YouTubeAudioDownloader:
-    def __init__(self, output_dir="downloads", ffmpeg_path=None):
+    def __init__(self, output_dir="downloads", ffmpeg_path=None, transcode_workers=None,
+                 store_dir=None, use_store=True, low_memory=False, min_free_bytes=DEFAULT_RESERVE_BYTES,
+                 normalize=False, stream=False, planner=None, scheduler=None, priority=PRIORITY_INTERACTIVE):
         self.output_dir = output_dir
         self.ffmpeg_path = ffmpeg_path or self.find_ffmpeg()
         self.setup_output_dir()
@@ -18,6 +33,43 @@ class YouTubeAudioDownloader:
         self.conversion_progress = 0
         self.total_duration = 0
         self.is_converting = False
+        self.last_error = None
+        self.retry_policy = RetryPolicy()
+        # 低記憶體模式：批次處理時不保存每個項目的結果，各種佇列都有上限
+        self.low_memory = low_memory
+        # 轉檔池：transcode_workers=0 時改回由 yt-dlp 在下載執行緒中直接轉換
+        self.transcode_pool = None
+        if transcode_workers != 0:
+            self.transcode_pool = TranscodePool(
+                self.ffmpeg_path, workers=transcode_workers,
+                max_pending=PENDING_LIMIT if low_memory else None
+            )
+        # 本機媒體儲存庫：預設放在輸出目錄下，讓硬連結可以使用
+        self.use_store = use_store
+        self.store_dir = store_dir
+        # EBU R128 響度標準化：量測結果依影片 ID 快取，在轉檔池中執行
+        self.loudness = None
+        if normalize:
+            cache_dir = os.path.join(store_dir or os.path.join(output_dir, ".store"), "loudness")
+            self.loudness = LoudnessNormalizer(LoudnessCache(cache_dir), self.ffmpeg_path)
+        # 依剩餘磁碟空間決定下一個下載何時開始；失敗後留下的中間檔（網址 -> 標題）
+        self.disk_budget = DiskBudget(output_dir, reserve_bytes=min_free_bytes)
+        self.partial_titles = {}
+        # 串流模式：下載的資料直接送進 FFmpeg 轉為 MP3，不寫入來源檔
+        self.stream = stream
+        # 額外的進度監聽者，會收到 progress_hook / ffmpeg_progress_hook 的原始資料
+        self.progress_listeners = []
+        # 批次執行時由 RetryBatch 提供：不等待轉檔的項目以 defer_result(url) 把結果延後到轉檔與完整性檢查完成
+        self.defer_result = None
+        # 下載名額的優先排程：單一下載優先於批次，批次在其他程式進行單一下載時暫緩開始新的項目
+        self.scheduler = scheduler
+        self.priority = priority
+        # 取消檢查（例如 HTTP API 的工作）：回傳 True 時在下載後、轉檔前後中止，不把工作當作完成
+        self.cancelled = None
+        # 格式規劃：依量測到的頻寬與時間、大小限制選擇格式（None 時使用指定的格式）
+        self.planner = planner
+        if planner is not None:
+            self.progress_listeners.append(planner.meter.on_progress)
         
     def find_ffmpeg(self):
         """嘗試尋找系統中的 FFmpeg"""
@@ -54,17 +106,9 @@ class YouTubeAudioDownloader:
                 return custom_path
             
             # 檢查系統 PATH
-            try:
-                result = subprocess.run(
-                    ["which", "ffmpeg"],
-                    capture_output=True,
-                    text=True,
-                    timeout=5
-                )
-                if result.returncode == 0 and result.stdout.strip():
-                    return result.stdout.strip()
-            except:
-                pass
+            ffmpeg_in_path = resolve_ffmpeg(ffmpeg_name)
+            if ffmpeg_in_path:
+                return ffmpeg_in_path
             
             # 檢查常見 Unix 路徑
             common_paths = [
@@ -96,19 +140,11 @@ class YouTubeAudioDownloader:
             
             print(f"✓ FFmpeg 路徑已設定: {self.ffmpeg_path}")
             
-            # 測試 FFmpeg
-            try:
-                result = subprocess.run(
-                    [self.ffmpeg_path, "-version"],
-                    capture_output=True,
-                    text=True,
-                    timeout=5
-                )
-                if "ffmpeg version" in result.stdout:
-                    print("✓ FFmpeg 測試成功")
-                else:
-                    print("⚠ FFmpeg 版本檢查失敗")
-            except:
+            # 測試 FFmpeg（結果依執行檔快取，同一個版本只檢查一次）
+            capabilities = get_capabilities(self.ffmpeg_path)
+            if capabilities:
+                print(f"✓ {capabilities.describe()}")
+            else:
                 print("⚠ FFmpeg 測試失敗，但仍將嘗試使用")
         else:
             print("⚠ 未找到 FFmpeg，yt-dlp 將嘗試使用內建下載器")
@@ -171,6 +207,8 @@ class YouTubeAudioDownloader:
     
     def ffmpeg_progress_hook(self, d):
         """FFmpeg 轉換進度回調"""
+        for listener in self.progress_listeners:
+            listener(d)
         if d['status'] == 'started':
             self.is_converting = True
             print("\n正在轉換為 MP3...")
@@ -181,28 +219,74 @@ class YouTubeAudioDownloader:
             self.is_converting = False
             print("\r轉換完成！" + " " * 50)
     
-    def download_with_format(self, url, format_id='bestaudio/best'):
-        """使用指定格式下載音訊"""
+    def download_with_format(self, url, format_id='bestaudio/best', quality='192', wait=True, name_prefix=''):
+        """
+        使用指定格式下載音訊
+        有轉檔池時，下載完成後交給轉檔池轉為 MP3；wait=False 時不等待轉檔完成即返回。
+        quality 可為 '128,192,320'，只下載、解碼一次並同時輸出多個位元率。
+        name_prefix 會加在輸出檔名前（例如播放清單編號），儲存庫中仍以原標題保存。
+        """
+        self.last_error = None
+        use_pool = self.transcode_pool is not None
+        qualities = parse_qualities(quality)
+        if len(qualities) > 1 and not use_pool:
+            print(f"⚠ 多位元率輸出需要轉檔池，僅輸出 {qualities[0]} kbps")
+            qualities = qualities[:1]
+        normalize = self.loudness is not None and use_pool
+        if self.loudness is not None and not use_pool:
+            print("⚠ 響度標準化需要轉檔池，本次不標準化")
+        store_format = self.store_format(format_id, normalize)
+        
+        # 先查本機儲存庫，命中時不需要任何網路請求
+        video_id = extract_video_id(url)
+        metric_labels = (format_id, ",".join(qualities))
+        if video_id and self.restore_from_store(video_id, store_format, qualities, name_prefix):
+            METRICS.downloads.inc(labels=metric_labels + ('cached',))
+            return True
         
-        # 取得影片資訊以設定檔名
+        # 取得影片資訊以設定檔名，並依選定格式的大小估計磁碟用量
+        info = {}
         try:
-            with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+            started = time.monotonic()
+            with yt_dlp.YoutubeDL({'quiet': True, 'format': format_id}) as ydl:
                 info = ydl.extract_info(url, download=False)
+                METRICS.extract_seconds.observe(time.monotonic() - started)
                 title = self.sanitize_filename(info.get('title', 'audio'))
                 self.total_duration = info.get('duration', 0)
         except Exception as e:
             print(f"取得影片資訊失敗: {str(e)}")
             title = "youtube_audio"
             self.total_duration = 0
+        title = name_prefix + title
+        
+        # 依頻寬與限制改選格式；改選後的格式可能已在儲存庫中
+        plan = self.planner.plan(info) if self.planner is not None else None
+        if plan is not None:
+            print(f"格式規劃: {plan.describe()}")
+            format_id = plan.format_id
+            info = dict(info, **plan.formats[0])
+            info.pop('requested_formats', None)
+            store_format = self.store_format(format_id, normalize)
+            metric_labels = (format_id, ",".join(qualities))
+            if video_id and self.restore_from_store(video_id, store_format, qualities, name_prefix):
+                METRICS.downloads.inc(labels=metric_labels + ('cached',))
+                return True
+        disk_bytes = estimate_job_bytes(info, qualities, source_bytes=plan.size if plan else None)
+        
+        # 串流模式只適用於單一 HTTP 檔案；標準化需要量測結果，沒有快取時改用一般模式
+        stream = self.stream and streamable(info)
+        stream_filter = None
+        if stream and normalize:
+            measurement = self.loudness.cache.get(video_id) if video_id else None
+            if measurement is None:
+                print("⚠ 響度標準化需要先量測完整的來源檔，本次不使用串流模式")
+                stream = False
+            else:
+                stream_filter = loudnorm_filter(measurement)
         
         # 設定下載選項
         ydl_opts = {
             'format': format_id,
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
             'outtmpl': os.path.join(self.output_dir, f'{title}.%(ext)s'),
             'quiet': False,
             'no_warnings': False,
@@ -211,31 +295,203 @@ class YouTubeAudioDownloader:
             'postprocessor_hooks': [self.ffmpeg_progress_hook],
             'ffmpeg_location': os.path.dirname(self.ffmpeg_path) if self.ffmpeg_path else None,
         }
+        if not use_pool:
+            ydl_opts['postprocessors'] = [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': qualities[0],
+            }]
         
+        # 磁碟預留量在轉檔完成（轉檔池）或函式結束時歸還
+        reserved = False
+        handed_off = False
         try:
+            # 空間不足時在這裡等待其他工作釋放空間，而不是寫到一半失敗
+            self.disk_budget.acquire(disk_bytes)
+            reserved = True
+            
             print(f"\n開始下載: {title}")
             print(f"使用格式: {format_id}")
             if self.ffmpeg_path:
                 print(f"FFmpeg 路徑: {self.ffmpeg_path}")
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # 添加額外的 metadata
-                info_dict = ydl.extract_info(url, download=True)
-                
+            targets = quality_outputs(self.output_dir, title, qualities)
+            output_file = targets[0][0]
+            tracker = METRICS.track_download(*metric_labels)
+            # 只在下載期間佔用名額，轉檔不影響其他工作開始下載
+            slot = self.scheduler.acquire(self.priority) if self.scheduler is not None else None
+            self.progress_listeners.append(tracker.on_progress)
+            try:
+                if stream:
+                    encoder = self.transcode_pool.encoder if use_pool else mp3_encoder_for(self.ffmpeg_path)
+                    print(f"串流轉檔: 邊下載邊轉為 MP3（{encoder}），不保存來源檔")
+                    with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+                        stream_to_mp3(ydl, info, targets, self.ffmpeg_path, encoder,
+                                      audio_filter=stream_filter, progress_hooks=[self.progress_hook])
+                    info_dict = info
+                    self.verify_outputs([output for output, _ in targets], info)
+                else:
+                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                        # 添加額外的 metadata
+                        info_dict = ydl.extract_info(url, download=True)
+                        source_file = self.get_downloaded_path(ydl, info_dict)
+            except Exception:
+                METRICS.downloads.inc(labels=metric_labels + ('failed',))
+                raise
+            finally:
+                self.progress_listeners.remove(tracker.on_progress)
+                tracker.flush()
+                if slot is not None:
+                    self.scheduler.release(slot)
+            METRICS.downloads.inc(labels=metric_labels + ('success',))
+            self.partial_titles.pop(url, None)
+            self.check_cancelled()
+            
+            if stream:
+                # MP3 已在下載的同時完成
+                for output, quality in targets:
+                    self.add_metadata(output, info_dict)
+                    self.save_to_store(output, info_dict.get('id'), store_format, quality,
+                                       self.sanitize_filename(info_dict.get('title', 'audio')))
+            elif use_pool:
+                target_qualities = dict(targets)
+                audio_filter = None
+                if normalize:
+                    # 量測在轉檔執行緒中進行，已量測過的影片直接使用快取
+                    audio_filter = lambda source: self.loudness.filter_for(info_dict.get('id'), source)
+                future = self.transcode_pool.submit_multi(
+                    source_file, targets,
+                    on_done=lambda out, err: self.on_transcoded(
+                        out, err, info_dict, store_format, target_qualities[out]
+                    ),
+                    audio_filter=audio_filter,
+                    verify=lambda path: verify_media(path, info_dict.get('duration'), self.ffmpeg_path)
+                )
+                future.add_done_callback(lambda f: self.disk_budget.release(disk_bytes))
+                if not wait and self.defer_result is not None:
+                    # 轉檔或完整性檢查失敗時，批次會依錯誤分類重新下載
+                    settle = self.defer_result(url)
+                    future.add_done_callback(lambda f: settle(f.exception()))
+                handed_off = True
+                print(f"\n{self.transcode_pool.describe()}")
+                if not wait:
+                    print(f"✓ 下載完成，已排入轉檔佇列: {title}")
+                    return True
+                future.result()
+                # 轉檔期間取消的工作不回報為完成
+                self.check_cancelled()
+            elif os.path.exists(output_file):
+                self.verify_outputs([output_file], info_dict)
                 # 如果下載成功，嘗試添加 metadata
-                output_file = os.path.join(self.output_dir, f"{title}.mp3")
-                if os.path.exists(output_file):
-                    self.add_metadata(output_file, info_dict)
+                self.add_metadata(output_file, info_dict)
+                self.save_to_store(output_file, info_dict.get('id'), store_format, qualities[0],
+                                   self.sanitize_filename(info_dict.get('title', 'audio')))
             
             print(f"\n✓ 下載完成！檔案保存在: {self.output_dir}")
             return True
             
         except Exception as e:
+            self.last_error = e
             print(f"\n✗ 下載失敗: {str(e)}")
             # 顯示詳細錯誤資訊
             import traceback
             traceback.print_exc()
+            # 暫時性錯誤保留中間檔讓重試時續傳；空間不足或不會重試的錯誤立即清除
+            category = classify_error(e)
+            if category == ERROR_DISK or not self.retry_policy.should_retry(category, 1):
+                self.discard_partials(url, title)
+            else:
+                self.partial_titles[url] = title
             return False
+        finally:
+            if reserved and not handed_off:
+                self.disk_budget.release(disk_bytes)
+    
+    def check_cancelled(self):
+        """工作已被取消時拋出 DownloadCancelled"""
+        if self.cancelled is not None and self.cancelled():
+            raise DownloadCancelled("工作已取消")
+    
+    def verify_outputs(self, outputs, info_dict):
+        """檢查輸出檔的容器與長度；不完整時刪除所有輸出檔並拋出 IntegrityError（重試時重新下載）"""
+        try:
+            for output in outputs:
+                verify_media(output, info_dict.get('duration'), self.ffmpeg_path)
+        except IntegrityError:
+            for output in outputs:
+                if os.path.exists(output):
+                    os.remove(output)
+            raise
+    
+    def discard_partials(self, url, title=None):
+        """刪除下載失敗留下的中間檔（放棄重試時呼叫）"""
+        saved = self.partial_titles.pop(url, None)
+        title = title or saved
+        if title:
+            freed = remove_partials(self.output_dir, title)
+            if freed:
+                print(f"已清除中間檔 {freed / 1024 / 1024:.1f} MB: {title}")
+    
+    def get_downloaded_path(self, ydl, info_dict):
+        """取得 yt-dlp 實際寫入的檔案路徑"""
+        downloads = info_dict.get('requested_downloads') or []
+        if downloads and downloads[0].get('filepath'):
+            return downloads[0]['filepath']
+        return ydl.prepare_filename(info_dict)
+    
+    def on_transcoded(self, output_file, error, info_dict, format_id, quality):
+        """轉檔池完成回調（在轉檔執行緒中執行）"""
+        if error is not None:
+            print(f"\n✗ 轉檔失敗: {os.path.basename(output_file)} - {str(error)}")
+            return
+        print(f"\n✓ 轉檔完成: {os.path.basename(output_file)}")
+        self.add_metadata(output_file, info_dict)
+        self.save_to_store(output_file, info_dict.get('id'), format_id, quality,
+                           self.sanitize_filename(info_dict.get('title', 'audio')))
+    
+    def get_media_store(self):
+        """取得本機媒體儲存庫；停用時回傳 None"""
+        if not self.use_store:
+            return None
+        return MediaStore(self.store_dir or os.path.join(self.output_dir, ".store"))
+    
+    def store_format(self, format_id, normalized=None):
+        """儲存庫的格式鍵：標準化過的輸出與原始輸出分開保存"""
+        if normalized is None:
+            normalized = self.loudness is not None and self.transcode_pool is not None
+        return f"{format_id}+loudnorm" if normalized else format_id
+    
+    def restore_from_store(self, video_id, format_id, qualities, name_prefix=''):
+        """所有要求的品質都在儲存庫中時，直接以連結產生輸出檔"""
+        store = self.get_media_store()
+        if store is None:
+            return False
+        
+        entries = [store.lookup(video_id, format_id, q) for q in qualities]
+        if not all(entries):
+            return False
+        
+        title = name_prefix + entries[0]['title']
+        targets = quality_outputs(self.output_dir, title, qualities)
+        try:
+            methods = [store.materialize(entry['path'], output) for (output, _), entry in zip(targets, entries)]
+        except OSError as e:
+            print(f"⚠ 從本機儲存庫取得失敗，改為重新下載: {str(e)}")
+            return False
+        
+        print(f"\n✓ 已從本機儲存庫取得 ({', '.join(sorted(set(methods)))}): {title}")
+        return True
+    
+    def save_to_store(self, output_file, video_id, format_id, quality, title=None):
+        """將完成的檔案收進本機儲存庫（title 預設取輸出檔名）"""
+        store = self.get_media_store()
+        if store is None or not video_id or not os.path.exists(output_file):
+            return
+        try:
+            title = title or os.path.splitext(os.path.basename(output_file))[0]
+            store.put(output_file, video_id, format_id, quality, title)
+        except OSError as e:
+            print(f"⚠ 寫入本機儲存庫失敗: {str(e)}")
     
     def add_metadata(self, audio_file, info_dict):
         """為音訊檔案添加 metadata"""
@@ -249,13 +505,14 @@ class YouTubeAudioDownloader:
             
             # 下載縮圖
             if thumbnail_url:
-                import requests
-                thumbnail_path = os.path.join(self.output_dir, "temp_cover.jpg")
+                # 每個檔案使用獨立的暫存縮圖，避免轉檔池同時處理時互相覆蓋
+                thumbnail_path = audio_file + ".cover.jpg"
                 
                 try:
-                    response = requests.get(thumbnail_url, timeout=10)
+                    # 共用連線池：同一主機的縮圖不必每次重新建立 TLS 連線
+                    cover = dl_http.fetch(thumbnail_url)
                     with open(thumbnail_path, 'wb') as f:
-                        f.write(response.content)
+                        f.write(cover)
                     
                     # 使用 FFmpeg 添加 metadata 和封面
                     cmd = [
@@ -295,6 +552,8 @@ class YouTubeAudioDownloader:
     
     def progress_hook(self, d):
         """下載進度回調函數"""
+        for listener in self.progress_listeners:
+            listener(d)
         if d['status'] == 'downloading':
             total = d.get('total_bytes') or d.get('total_bytes_estimate')
             downloaded = d.get('downloaded_bytes', 0)
@@ -308,8 +567,8 @@ class YouTubeAudioDownloader:
                       f"速度: {speed_mb:5.2f} MB/s", end='')
         elif d['status'] == 'finished':
             print(f"\r下載完成: 100.00%" + " " * 30)
-            # 啟動 FFmpeg 進度監控
-            if self.total_duration > 0:
+            # 啟動 FFmpeg 進度監控（使用轉檔池時由轉檔池回報進度，串流模式下已同時轉換完成）
+            if self.total_duration > 0 and self.transcode_pool is None and not d.get('streamed'):
                 threading.Thread(target=self.monitor_conversion, daemon=True).start()
     
     def monitor_conversion(self):
@@ -345,64 +604,130 @@ class YouTubeAudioDownloader:
         
         print("\r轉換完成！" + " " * 60)
     
-    def batch_download(self, urls_file):
-        """批次下載多個影片"""
-        if not os.path.exists(urls_file):
+    def batch_download(self, urls_file, quality='192', failed_file=None, preflight=None):
+        """
+        批次下載多個影片（urls_file 為 '-' 時從標準輸入讀取）
+        failed_file 指定時，最終失敗的網址會逐行寫入，可直接作為下次批次的輸入。
+        preflight（Preflight）指定時先平行檢查可用性，無法下載的項目不進入批次。
+        """
+        if urls_file != '-' and not os.path.exists(urls_file):
             print(f"檔案不存在: {urls_file}")
             return
         
-        with open(urls_file, 'r', encoding='utf-8') as f:
-            urls = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        # 串流讀取並去除重複，不會把整個檔案載入記憶體
+        ingester = UrlIngester(
+            on_invalid=lambda line: print(f"無效的 YouTube 網址: {line}"),
+            window=DEDUP_WINDOW if self.low_memory else None
+        )
+        failed_out = open(failed_file, 'w', encoding='utf-8') if failed_file else None
         
-        print(f"找到 {len(urls)} 個影片連結")
-        
-        success_count = 0
-        for i, url in enumerate(urls, 1):
+        def attempt(url):
             print(f"\n{'='*50}")
-            print(f"正在處理第 {i}/{len(urls)} 個影片")
+            print(f"正在處理: {url}")
             print(f"{'='*50}")
-            
-            if self.is_valid_youtube_url(url):
-                if self.download_with_format(url):
-                    success_count += 1
-            else:
-                print(f"無效的 YouTube 網址: {url}")
+            # 不等待轉檔，下一個下載可以和轉檔同時進行
+            if self.download_with_format(url, quality=quality, wait=False):
+                return None
+            return self.last_error or Exception("下載失敗")
+        
+        def on_done(url, success, done):
+            print(f"批次進度: 已完成 {done} 個 (已讀取 {ingester.total} 行)")
+            if self.transcode_pool:
+                print(self.transcode_pool.describe())
+            if not success:
+                self.discard_partials(url)
+            if failed_out and not success:
+                failed_out.write(url + "\n")
+                failed_out.flush()
+        
+        # 暫時性錯誤會排到批次尾端重試，不會卡住其他項目
+        batch = RetryBatch(
+            self.retry_policy,
+            keep_results=not self.low_memory,
+            max_pending=PENDING_LIMIT if self.low_memory else None
+        )
+        urls = ingester.ingest_source(urls_file)
+        if preflight:
+            urls = preflight.filter(urls)
+        # 轉檔後的完整性檢查在轉檔執行緒中進行，項目在檢查通過後才算完成，失敗時重新排入批次
+        self.defer_result = batch.defer
+        try:
+            batch.run(urls, attempt, on_done)
+        finally:
+            self.defer_result = None
+            if failed_out:
+                failed_out.close()
+        
+        if self.transcode_pool:
+            print("\n等待轉檔完成...")
+            self.transcode_pool.wait()
+            print(self.transcode_pool.describe())
+        
+        print(f"\n{'='*50}")
+        print(f"批次下載完成！成功: {batch.succeeded_count}/{ingester.unique}")
+        print(f"共讀取 {ingester.total} 行，重複 {ingester.duplicates} 個，無效 {ingester.invalid} 個")
+        if preflight:
+            print(preflight.describe())
+        for label, count in batch.summary().items():
+            print(f"  {label}: {count}")
+    
+    def batch_download_async(self, urls_file, quality='192', resolve_jobs=8, download_jobs=4, transcode_jobs=None,
+                             failed_file=None, preflight=None):
+        """以 asyncio 協調器批次下載（解析、下載、轉檔各階段分別限制同時數量）"""
+        if urls_file != '-' and not os.path.exists(urls_file):
+            print(f"檔案不存在: {urls_file}")
+            return
+        
+        from dl_async import AsyncOrchestrator
+        
+        ingester = UrlIngester(
+            on_invalid=lambda line: print(f"無效的 YouTube 網址: {line}"),
+            window=DEDUP_WINDOW if self.low_memory else None
+        )
+        failed_out = open(failed_file, 'w', encoding='utf-8') if failed_file else None
+        
+        def on_failed(url, category, error):
+            failed_out.write(url + "\n")
+            failed_out.flush()
+        
+        orchestrator = AsyncOrchestrator(
+            self,
+            resolve_jobs=resolve_jobs,
+            download_jobs=download_jobs,
+            transcode_jobs=transcode_jobs,
+            quality=quality,
+            retry_policy=self.retry_policy,
+            keep_results=not self.low_memory,
+            on_failed=on_failed if failed_out else None
+        )
+        urls = ingester.ingest_source(urls_file)
+        if preflight:
+            urls = preflight.filter(urls)
+        try:
+            succeeded, _ = orchestrator.run(urls)
+        finally:
+            if failed_out:
+                failed_out.close()
         
         print(f"\n{'='*50}")
-        print(f"批次下載完成！成功: {success_count}/{len(urls)}")
+        print(f"批次下載完成！成功: {succeeded}/{ingester.unique}")
+        print(f"共讀取 {ingester.total} 行，重複 {ingester.duplicates} 個，無效 {ingester.invalid} 個")
+        if preflight:
+            print(preflight.describe())
+        for category, count in orchestrator.failure_counts.items():
+            print(f"  {ERROR_LABELS[category]}: {count}")
     
     def is_valid_youtube_url(self, url):
         """檢查是否為有效的 YouTube 網址"""
-        patterns = [
-            r'^https?://(www\.)?youtube\.com/watch\?v=',
-            r'^https?://youtu\.be/',
-            r'^https?://(www\.)?youtube\.com/embed/',
-            r'^https?://(www\.)?youtube\.com/shorts/',
-            r'^https?://(www\.)?youtube\.com/playlist\?list=',
-        ]
-        
-        for pattern in patterns:
-            if re.match(pattern, url):
-                return True
-        return False
+        return parse_youtube_url(url) is not None
     
     def check_ffmpeg_installation(self):
-        """檢查 FFmpeg 安裝狀態"""
+        """檢查 FFmpeg 安裝狀態（使用快取的能力資訊）"""
         if self.ffmpeg_path and os.path.exists(self.ffmpeg_path):
-            try:
-                result = subprocess.run(
-                    [self.ffmpeg_path, "-version"],
-                    capture_output=True,
-                    text=True,
-                    timeout=5
-                )
-                if "ffmpeg version" in result.stdout:
-                    version_line = result.stdout.split('\n')[0]
-                    return True, version_line
-                else:
-                    return False, "FFmpeg 版本檢查失敗"
-            except Exception as e:
-                return False, f"FFmpeg 測試失敗: {str(e)}"
+            capabilities = get_capabilities(self.ffmpeg_path)
+            if capabilities:
+                return True, capabilities.describe()
+            return False, "FFmpeg 版本檢查失敗"
         else:
             return False, "未找到 FFmpeg"
 
@@ -526,23 +851,404 @@ def quick_download():
     parser.add_argument('-o', '--output', default='downloads', help='輸出資料夾')
     parser.add_argument('-f', '--ffmpeg', default=default_ffmpeg_path, 
                        help='FFmpeg 路徑')
-    parser.add_argument('-q', '--quality', default='192', help='MP3 音質 (128, 192, 256, 320)')
+    parser.add_argument('-q', '--quality', default='192', type=quality_arg,
+                       help='MP3 音質 (128, 192, 256, 320)，以逗號分隔可同時輸出多個位元率')
     parser.add_argument('-fmt', '--format', default='bestaudio/best', help='下載格式')
+    parser.add_argument('--store', default=None, help='本機媒體儲存庫位置 (預設為 <輸出資料夾>/.store)')
+    parser.add_argument('--no-store', action='store_true', help='不使用本機媒體儲存庫')
+    parser.add_argument('--normalize', action='store_true', help='以 EBU R128 兩階段量測標準化音量（量測結果依影片快取）')
+    parser.add_argument('--stream', action='store_true',
+                       help='串流轉檔：下載的資料直接送進 FFmpeg，不寫入來源檔（僅適用單一檔案的格式）')
+    parser.add_argument('--deadline', type=float, default=None,
+                       help='每個影片希望在此秒數內完成，依量測到的頻寬改選較小的格式')
+    parser.add_argument('--max-size', type=float, default=None,
+                       help='每個影片下載的來源檔不超過此大小 (MB)，依格式表改選較小的格式')
     
     args = parser.parse_args()
     
     # 建立下載器
     downloader = YouTubeAudioDownloader(
         output_dir=args.output,
-        ffmpeg_path=args.ffmpeg if os.path.exists(args.ffmpeg) else None
+        ffmpeg_path=args.ffmpeg if os.path.exists(args.ffmpeg) else None,
+        store_dir=args.store,
+        use_store=not args.no_store,
+        normalize=args.normalize,
+        stream=args.stream,
+        planner=make_planner(args),
+        scheduler=make_scheduler(),
+        priority=PRIORITY_INTERACTIVE
     )
     
     # 開始下載
-    downloader.download_with_format(args.url, args.format)
+    downloader.download_with_format(args.url, args.format, args.quality)
+
+def make_scheduler(slots=1):
+    """
+    命令列模式的優先排程：每個程序只有一種工作，以鎖定檔跨程序協調——
+    quick 模式下載時，其他程序中的批次、播放清單與同步暫緩開始新的項目
+    """
+    return PriorityScheduler(slots=slots, reserved=0, beacon_dir=DEFAULT_BEACON_DIR)
+
+def quality_arg(value):
+    """argparse 的 -q 參數型別：不支援的音質在解析參數時就回報，而不是批次進行到一半才失敗"""
+    import argparse
+    try:
+        parse_qualities(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+def make_planner(args):
+    """指定 --deadline 或 --max-size 時建立格式規劃器"""
+    if args.deadline is None and args.max_size is None:
+        return None
+    from dl_planner import FormatPlanner
+    max_bytes = args.max_size * 1024 * 1024 if args.max_size is not None else None
+    planner = FormatPlanner(deadline=args.deadline, max_bytes=max_bytes)
+    print(planner.describe())
+    return planner
+
+def start_metrics(port):
+    """指定埠號時啟動 Prometheus 指標端點"""
+    if port is None:
+        return
+    from dl_metrics import start_metrics_server
+    start_metrics_server(port)
+    print(f"指標端點已啟動: http://127.0.0.1:{port}/metrics")
+
+def batch_cli():
+    """批次下載模式（命令列參數）"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(prog='dl2.py batch', description='YouTube 批次下載')
+    parser.add_argument('source', help="包含連結的檔案路徑，'-' 代表標準輸入")
+    parser.add_argument('-o', '--output', default='downloads', help='輸出資料夾')
+    parser.add_argument('-f', '--ffmpeg', default=None, help='FFmpeg 路徑')
+    parser.add_argument('-q', '--quality', default='192', type=quality_arg,
+                       help='MP3 音質 (128, 192, 256, 320)，以逗號分隔可同時輸出多個位元率')
+    parser.add_argument('-w', '--transcode-workers', type=int, default=None,
+                       help='同時轉檔的 FFmpeg 程序數 (預設為 CPU 核心數，0 表示不使用轉檔池)')
+    parser.add_argument('--store', default=None, help='本機媒體儲存庫位置 (預設為 <輸出資料夾>/.store)')
+    parser.add_argument('--no-store', action='store_true', help='不使用本機媒體儲存庫')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                       help='使用 asyncio 協調器同時處理多個項目（適合數千個連結）')
+    parser.add_argument('--resolve-jobs', type=int, default=8, help='--async 時同時解析的數量')
+    parser.add_argument('--download-jobs', type=int, default=4, help='--async 時同時下載的數量')
+    parser.add_argument('--metrics-port', type=int, default=None, help='在此埠號提供 Prometheus /metrics')
+    parser.add_argument('--normalize', action='store_true', help='以 EBU R128 兩階段量測標準化音量（量測結果依影片快取）')
+    parser.add_argument('--stream', action='store_true',
+                       help='串流轉檔：下載的資料直接送進 FFmpeg，不寫入來源檔（僅適用單一檔案的格式）')
+    parser.add_argument('--deadline', type=float, default=None,
+                       help='每個影片希望在此秒數內完成，依量測到的頻寬改選較小的格式')
+    parser.add_argument('--max-size', type=float, default=None,
+                       help='每個影片下載的來源檔不超過此大小 (MB)，依格式表改選較小的格式')
+    parser.add_argument('--low-memory', action='store_true',
+                       help='低記憶體模式：不保存每個項目的結果，去重與佇列都有固定上限（適合數十萬個連結）')
+    parser.add_argument('--failed-out', default=None, help='將最終失敗的網址寫入此檔案，可作為下次批次的輸入')
+    parser.add_argument('--min-free-mb', type=int, default=DEFAULT_RESERVE_BYTES // 1024 // 1024,
+                       help='保留的磁碟空間 (MB)，剩餘空間不足以容納下一個下載時會等待')
+    parser.add_argument('--preflight', action='store_true',
+                       help='下載前先平行檢查可用性，略過私人、已移除、地區限制、會員限定的影片')
+    parser.add_argument('--preflight-jobs', type=int, default=16, help='--preflight 時同時檢查的數量')
+    parser.add_argument('--preflight-report', default=None, help='--preflight 的檢查結果寫入此檔案 (TSV)')
+    
+    args = parser.parse_args(sys.argv[2:])
+    if args.use_async and args.stream:
+        # 非同步協調器自行下載來源檔後再以子程序轉檔，沒有串流轉檔的路徑
+        parser.error('--stream 無法與 --async 同時使用')
+    start_metrics(args.metrics_port)
+    
+    downloader = YouTubeAudioDownloader(
+        output_dir=args.output,
+        ffmpeg_path=args.ffmpeg,
+        transcode_workers=args.transcode_workers,
+        store_dir=args.store,
+        use_store=not args.no_store,
+        low_memory=args.low_memory,
+        min_free_bytes=args.min_free_mb * 1024 * 1024,
+        normalize=args.normalize,
+        stream=args.stream,
+        planner=make_planner(args),
+        scheduler=make_scheduler(args.download_jobs if args.use_async else 1),
+        priority=PRIORITY_BULK
+    )
+    preflight = None
+    report = None
+    if args.preflight:
+        from dl_preflight import Preflight
+        report = open(args.preflight_report, 'w', encoding='utf-8') if args.preflight_report else None
+        preflight = Preflight(jobs=args.preflight_jobs, report=report)
+    try:
+        if args.use_async:
+            downloader.batch_download_async(
+                args.source, args.quality,
+                resolve_jobs=args.resolve_jobs,
+                download_jobs=args.download_jobs,
+                transcode_jobs=args.transcode_workers or None,
+                failed_file=args.failed_out,
+                preflight=preflight
+            )
+        else:
+            downloader.batch_download(args.source, args.quality, failed_file=args.failed_out,
+                                      preflight=preflight)
+    finally:
+        if report:
+            report.close()
+
+def preflight_cli():
+    """只檢查可用性：輸出檢查報告與可下載的網址清單，不下載"""
+    import argparse
+    from dl_preflight import DEFAULT_PREFLIGHT_JOBS, Preflight
+    
+    parser = argparse.ArgumentParser(prog='dl2.py preflight', description='批次下載前的可用性檢查')
+    parser.add_argument('source', help="包含連結的檔案路徑，'-' 代表標準輸入")
+    parser.add_argument('-o', '--output', default=None, help="可下載的網址寫入此檔案（預設為標準輸出）")
+    parser.add_argument('--report', default=None, help='每個網址的檢查結果寫入此檔案 (TSV：狀態、網址、說明)')
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_PREFLIGHT_JOBS, help='同時檢查的數量')
+    
+    args = parser.parse_args(sys.argv[2:])
+    if args.source != '-' and not os.path.exists(args.source):
+        print(f"檔案不存在: {args.source}")
+        return
+    
+    # 清單輸出到標準輸出時，訊息改寫到標準錯誤，方便直接接到 batch -
+    log = (lambda message: print(message, file=sys.stderr)) if args.output is None else print
+    ingester = UrlIngester(on_invalid=lambda line: log(f"無效的 YouTube 網址: {line}"))
+    report = open(args.report, 'w', encoding='utf-8') if args.report else None
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    preflight = Preflight(jobs=args.jobs, report=report, log=log)
+    try:
+        for url in preflight.filter(ingester.ingest_source(args.source)):
+            out.write(url + "\n")
+            out.flush()
+    finally:
+        if report:
+            report.close()
+        if args.output:
+            out.close()
+    
+    log(f"\n{preflight.describe()}")
+    for label, count in preflight.summary().items():
+        log(f"  {label}: {count}")
+
+def sync_cli():
+    """播放清單增量同步：只下載上次同步後新增的影片"""
+    import argparse
+    from dl_ingest import iter_lines
+    from dl_sync import PlaylistSync, SyncState
+    
+    parser = argparse.ArgumentParser(prog='dl2.py sync', description='播放清單增量同步')
+    parser.add_argument('playlists', nargs='+',
+                       help="播放清單網址，或每行一個網址的檔案（'-' 代表標準輸入）")
+    parser.add_argument('--db', default='sync.db', help='同步紀錄資料庫 (SQLite)')
+    parser.add_argument('-o', '--output', default='downloads', help='輸出資料夾')
+    parser.add_argument('-f', '--ffmpeg', default=None, help='FFmpeg 路徑')
+    parser.add_argument('-q', '--quality', default='192', type=quality_arg, help='MP3 音質，以逗號分隔可同時輸出多個位元率')
+    parser.add_argument('--normalize', action='store_true', help='以 EBU R128 兩階段量測標準化音量（量測結果依影片快取）')
+    
+    args = parser.parse_args(sys.argv[2:])
+    
+    downloader = YouTubeAudioDownloader(output_dir=args.output, ffmpeg_path=args.ffmpeg,
+                                        normalize=args.normalize, scheduler=make_scheduler(),
+                                        priority=PRIORITY_BULK)
+    state = SyncState(args.db)
+    syncer = PlaylistSync(downloader, state, quality=args.quality)
+    
+    def playlist_urls():
+        for item in args.playlists:
+            if item == '-' or os.path.isfile(item):
+                yield from iter_lines(item)
+            else:
+                yield item
+    
+    try:
+        for url in playlist_urls():
+            try:
+                syncer.sync(url)
+            except Exception as e:
+                print(f"✗ 同步失敗: {url} - {str(e)}")
+        if downloader.transcode_pool:
+            downloader.transcode_pool.wait()
+    except KeyboardInterrupt:
+        print("\n同步被使用者中斷（已完成的項目已記錄，下次同步會繼續）")
+    finally:
+        state.close()
+    print(f"\n同步完成！{syncer.describe()}")
+
+def playlist_cli():
+    """大型播放清單／頻道：依索引分段，多個工作執行緒平行下載，檔名依清單順序編號"""
+    import argparse
+    from dl_shard import DEFAULT_SHARD_SIZE, DEFAULT_SHARD_WORKERS, ShardedPlaylist
+    
+    parser = argparse.ArgumentParser(prog='dl2.py playlist', description='播放清單分段平行下載')
+    parser.add_argument('url', help='播放清單或頻道網址')
+    parser.add_argument('-o', '--output', default='downloads', help='輸出資料夾')
+    parser.add_argument('-f', '--ffmpeg', default=None, help='FFmpeg 路徑')
+    parser.add_argument('-q', '--quality', default='192', type=quality_arg, help='MP3 音質，以逗號分隔可同時輸出多個位元率')
+    parser.add_argument('-j', '--workers', type=int, default=DEFAULT_SHARD_WORKERS, help='同時處理的分段數')
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE, help='每段的項目數')
+    parser.add_argument('--no-number', action='store_true', help='檔名不加清單編號')
+    parser.add_argument('--normalize', action='store_true', help='以 EBU R128 兩階段量測標準化音量（量測結果依影片快取）')
+    parser.add_argument('--stream', action='store_true',
+                       help='串流轉檔：下載的資料直接送進 FFmpeg，不寫入來源檔（僅適用單一檔案的格式）')
+    
+    args = parser.parse_args(sys.argv[2:])
+    
+    # 各工作執行緒的下載器共用同一個轉檔池與磁碟預算
+    shared = YouTubeAudioDownloader(output_dir=args.output, ffmpeg_path=args.ffmpeg)
+    scheduler = make_scheduler(args.workers)
+    
+    def make_downloader():
+        downloader = YouTubeAudioDownloader(
+            output_dir=args.output, ffmpeg_path=shared.ffmpeg_path, transcode_workers=0,
+            normalize=args.normalize, stream=args.stream, scheduler=scheduler, priority=PRIORITY_BULK
+        )
+        downloader.transcode_pool = shared.transcode_pool
+        downloader.disk_budget = shared.disk_budget
+        return downloader
+    
+    sharded = ShardedPlaylist(make_downloader, quality=args.quality, workers=args.workers,
+                              shard_size=args.shard_size, numbered=not args.no_number)
+    try:
+        sharded.run(args.url)
+        if shared.transcode_pool:
+            print("\n等待轉檔完成...")
+            shared.transcode_pool.wait()
+            print(shared.transcode_pool.describe())
+    except KeyboardInterrupt:
+        print("\n下載被使用者中斷")
+    print(f"\n播放清單下載完成！{sharded.describe()}")
+    for label, count in sharded.summary().items():
+        print(f"  {label}: {count}")
+
+def serve_cli():
+    """協調器模式：保存工作佇列，分派給工作節點"""
+    import argparse
+    from dl_broker import DEFAULT_PORT, BrokerServer, JobBroker
+    
+    parser = argparse.ArgumentParser(prog='dl2.py serve', description='分散式下載協調器')
+    parser.add_argument('source', nargs='?', help="要加入佇列的連結檔案，'-' 代表標準輸入")
+    parser.add_argument('--db', default='jobs.db', help='工作佇列資料庫 (SQLite)')
+    parser.add_argument('--archive', default='archive.txt', help='共用的下載紀錄檔')
+    parser.add_argument('--host', default='127.0.0.1', help='監聽位址')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='監聽埠號')
+    parser.add_argument('--lease', type=int, default=600, help='租約秒數，逾期未回報的工作會重新分派')
+    parser.add_argument('--max-attempts', type=int, default=5, help='每個工作的最大嘗試次數')
+    
+    args = parser.parse_args(sys.argv[2:])
+    
+    broker = JobBroker(args.db, lease_seconds=args.lease, max_attempts=args.max_attempts,
+                       archive_path=args.archive)
+    if args.source:
+        ingester = UrlIngester(on_invalid=lambda line: print(f"無效的 YouTube 網址: {line}"))
+        added = broker.enqueue(ingester.ingest_source(args.source))
+        print(f"已加入 {added} 個工作（重複 {ingester.duplicates} 個，無效 {ingester.invalid} 個）")
+    
+    server = BrokerServer(broker, args.host, args.port)
+    print(f"協調器已啟動: {args.host}:{args.port}")
+    print(f"佇列狀態: {broker.stats()}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n協調器結束，佇列狀態: {broker.stats()}")
+    finally:
+        server.server_close()
+        broker.close()
+
+def worker_cli():
+    """工作節點模式：向協調器取得網址並下載"""
+    import argparse
+    import socket
+    from dl_broker import DEFAULT_PORT, BrokerClient, run_worker
+    
+    parser = argparse.ArgumentParser(prog='dl2.py worker', description='分散式下載工作節點')
+    parser.add_argument('--host', default='127.0.0.1', help='協調器位址')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='協調器埠號')
+    parser.add_argument('--id', default=f"{socket.gethostname()}-{os.getpid()}", help='工作節點名稱')
+    parser.add_argument('-o', '--output', default='downloads', help='輸出資料夾')
+    parser.add_argument('-f', '--ffmpeg', default=None, help='FFmpeg 路徑')
+    parser.add_argument('-q', '--quality', default='192', type=quality_arg, help='MP3 音質，以逗號分隔可同時輸出多個位元率')
+    parser.add_argument('--exit-when-idle', action='store_true', help='佇列清空後結束')
+    parser.add_argument('--normalize', action='store_true', help='以 EBU R128 兩階段量測標準化音量（量測結果依影片快取）')
+    parser.add_argument('--metrics-port', type=int, default=None, help='在此埠號提供 Prometheus /metrics')
+    
+    args = parser.parse_args(sys.argv[2:])
+    start_metrics(args.metrics_port)
+    
+    downloader = YouTubeAudioDownloader(output_dir=args.output, ffmpeg_path=args.ffmpeg,
+                                        normalize=args.normalize, scheduler=make_scheduler(),
+                                        priority=PRIORITY_BULK)
+    client = BrokerClient(args.host, args.port)
+    print(f"工作節點 {args.id} 已連線到 {args.host}:{args.port}")
+    try:
+        run_worker(downloader, client, args.id, quality=args.quality, exit_when_idle=args.exit_when_idle)
+    except KeyboardInterrupt:
+        print("\n工作節點被使用者中斷（未完成的工作會在租約逾期後重新分派）")
+    finally:
+        client.close()
+
+def api_cli():
+    """HTTP/JSON 控制 API：讓其他服務提交與監控下載工作"""
+    import argparse
+    from dl_api import DEFAULT_PORT, ApiServer, DownloadService
+    
+    parser = argparse.ArgumentParser(prog='dl2.py api', description='YouTube 下載 HTTP API')
+    parser.add_argument('--host', default='127.0.0.1', help='監聽位址')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='監聽埠號')
+    parser.add_argument('-o', '--output', default='downloads', help='輸出資料夾')
+    parser.add_argument('-f', '--ffmpeg', default=None, help='FFmpeg 路徑')
+    parser.add_argument('-j', '--workers', type=int, default=2, help='同時下載的工作數')
+    parser.add_argument('--max-jobs', type=int, default=1000, help='工作表保留的最大工作數')
+    parser.add_argument('--normalize', action='store_true', help='以 EBU R128 兩階段量測標準化音量（量測結果依影片快取）')
+    
+    args = parser.parse_args(sys.argv[2:])
+    
+    # 所有下載器共用同一個轉檔池與磁碟預算
+    shared = YouTubeAudioDownloader(output_dir=args.output, ffmpeg_path=args.ffmpeg)
+    # API 工作與批次同屬背景工作，經由排程器讓位給 quick 模式等優先下載
+    scheduler = make_scheduler(args.workers)
+    
+    def make_downloader():
+        downloader = YouTubeAudioDownloader(
+            output_dir=args.output, ffmpeg_path=shared.ffmpeg_path, transcode_workers=0,
+            normalize=args.normalize, scheduler=scheduler, priority=PRIORITY_BULK
+        )
+        downloader.transcode_pool = shared.transcode_pool
+        downloader.disk_budget = shared.disk_budget
+        return downloader
+    
+    service = DownloadService(make_downloader, workers=args.workers, max_jobs=args.max_jobs)
+    server = ApiServer(service, args.host, args.port)
+    print(f"API 已啟動: http://{args.host}:{args.port}")
+    print("  POST   /jobs            {\"url\": ..., \"quality\": \"192\"}")
+    print("  GET    /jobs[?status=]  列出工作")
+    print("  GET    /jobs/<id>       查詢狀態")
+    print("  DELETE /jobs/<id>       取消工作")
+    print("  GET    /events[?job=]   進度事件串流 (SSE)")
+    print("  GET    /metrics         Prometheus 指標")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nAPI 結束")
+    finally:
+        server.server_close()
+
+# 子命令：python dl2.py <子命令> [參數...]
+SUBCOMMANDS = {
+    'batch': batch_cli,
+    'preflight': preflight_cli,
+    'sync': sync_cli,
+    'playlist': playlist_cli,
+    'serve': serve_cli,
+    'worker': worker_cli,
+    'api': api_cli,
+}
 
 if __name__ == "__main__":
     # 檢查是否有命令列參數
-    if len(sys.argv) > 1 and not sys.argv[1].startswith('-'):
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        SUBCOMMANDS[sys.argv[1]]()
+    elif len(sys.argv) > 1 and not sys.argv[1].startswith('-'):
         # 快速下載模式
         quick_download()
     else:
@@ -0,0 +1,356 @@
+import itertools
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from yt_dlp.utils import DownloadCancelled
+
+from dl_ingest import parse_youtube_url
+from dl_metrics import METRICS
+from dl_transcode import parse_qualities
+
+DEFAULT_PORT = 8765
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+FINISHED_STATUSES = (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED)
+
+# 同一個工作的下載進度事件最短間隔（秒），避免 SSE 串流被進度更新塞滿
+PROGRESS_EVENT_INTERVAL = 0.5
+
+
+class ApiJob:
+    """API 工作的狀態"""
+
+    def __init__(self, job_id, url, quality):
+        self.id = job_id
+        self.url = url
+        self.quality = quality
+        self.status = STATUS_QUEUED
+        self.stage = None
+        self.percent = 0.0
+        self.speed = None
+        self.eta = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = False
+        self.last_event = 0.0
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'url': self.url,
+            'quality': self.quality,
+            'status': self.status,
+            'stage': self.stage,
+            'percent': round(self.percent, 1),
+            'speed': self.speed,
+            'eta': self.eta,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobTable:
+    """
+    有上限的記憶體內工作表。
+    滿了之後會淘汰最舊的已結束工作；全部都還在進行時拒絕新工作。
+    """
+
+    def __init__(self, max_jobs=1000):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._subscribers = set()
+
+    def add(self, url, quality):
+        with self._lock:
+            if len(self._jobs) >= self.max_jobs:
+                for job_id, job in self._jobs.items():
+                    if job.status in FINISHED_STATUSES:
+                        del self._jobs[job_id]
+                        break
+                else:
+                    return None
+            job = ApiJob(str(next(self._ids)), url, quality)
+            self._jobs[job.id] = job
+        self.publish(job, 'queued')
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, status=None):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if status:
+            jobs = [job for job in jobs if job.status == status]
+        return jobs
+
+    def subscribe(self):
+        """訂閱事件；回傳的佇列有上限，讀取太慢的訂閱者會漏掉事件而不是拖慢下載"""
+        subscriber = queue.Queue(maxsize=1000)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, job, event):
+        payload = {'event': event, 'job': job.to_dict()}
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(payload)
+            except queue.Full:
+                pass
+
+
+class DownloadService:
+    """以背景執行緒執行 API 工作；每條執行緒使用自己的下載器"""
+
+    def __init__(self, downloader_factory, workers=2, max_jobs=1000, log=print):
+        self.table = JobTable(max_jobs)
+        self.log = log
+        self._queue = queue.Queue()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(
+                target=self._worker, args=(downloader_factory(),),
+                name=f"api-worker-{i + 1}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def enqueue(self, url, quality='192'):
+        job = self.table.add(url, quality)
+        if job is not None:
+            self._queue.put(job)
+        return job
+
+    def cancel(self, job_id):
+        """
+        取消工作：排隊中的直接取消，下載中的在下一次進度回調時中止，轉檔中的在轉檔前後中止。
+        已完成或已失敗的工作無法取消，呼叫端以 job.status 判斷。
+        """
+        job = self.table.get(job_id)
+        if job is None:
+            return None
+        if job.status == STATUS_QUEUED:
+            job.status = STATUS_CANCELLED
+            job.finished = time.time()
+            self.table.publish(job, 'cancelled')
+        elif job.status == STATUS_RUNNING:
+            job.cancel_requested = True
+        return job
+
+    def _worker(self, downloader):
+        while True:
+            job = self._queue.get()
+            if job.status != STATUS_QUEUED:
+                continue
+
+            job.status = STATUS_RUNNING
+            job.stage = 'download'
+            job.started = time.time()
+            self.table.publish(job, 'started')
+
+            listener = self._make_listener(job)
+            downloader.progress_listeners.append(listener)
+            # 下載完成後已不會有進度回調，交給轉檔池前後由下載器檢查取消
+            downloader.cancelled = lambda: job.cancel_requested
+            try:
+                success = downloader.download_with_format(job.url, quality=job.quality)
+            finally:
+                downloader.progress_listeners.remove(listener)
+                downloader.cancelled = None
+
+            job.finished = time.time()
+            job.stage = None
+            # 最後一次檢查之後才要求取消時檔案已經寫入，仍視為完成
+            if success:
+                job.status = STATUS_DONE
+                job.percent = 100.0
+                self.table.publish(job, 'done')
+            elif job.cancel_requested:
+                job.status = STATUS_CANCELLED
+                self.table.publish(job, 'cancelled')
+            else:
+                job.status = STATUS_FAILED
+                job.error = str(downloader.last_error) if downloader.last_error else "下載失敗"
+                self.table.publish(job, 'failed')
+
+    def _make_listener(self, job):
+        table = self.table
+
+        def listener(d):
+            if job.cancel_requested:
+                raise DownloadCancelled("工作已取消")
+
+            if 'postprocessor' in d:
+                job.stage = 'convert'
+                table.publish(job, 'progress')
+                return
+
+            if d['status'] == 'downloading':
+                total = d.get('total_bytes') or d.get('total_bytes_estimate')
+                if total:
+                    job.percent = d.get('downloaded_bytes', 0) / total * 100
+                job.speed = d.get('speed')
+                job.eta = d.get('eta')
+                now = time.monotonic()
+                if now - job.last_event >= PROGRESS_EVENT_INTERVAL:
+                    job.last_event = now
+                    table.publish(job, 'progress')
+            elif d['status'] == 'finished':
+                job.percent = 100.0
+                job.stage = 'convert'
+                table.publish(job, 'progress')
+
+        return listener
+
+
+class _ApiHandler(BaseHTTPRequestHandler):
+    server_version = "YouTubeDownloaderAPI/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _job_id(self, path):
+        parts = path.strip('/').split('/')
+        if len(parts) >= 2 and parts[0] == 'jobs':
+            return parts[1]
+        return None
+
+    def do_GET(self):
+        service = self.server.service
+        parsed = urlparse(self.path)
+        path = parsed.path.rstrip('/')
+
+        if path == '/jobs':
+            status = parse_qs(parsed.query).get('status', [None])[0]
+            self._send_json(200, {'jobs': [job.to_dict() for job in service.table.list(status)]})
+        elif path == '/metrics':
+            data = METRICS.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif path == '/events':
+            self._stream_events(parse_qs(parsed.query).get('job', [None])[0])
+        elif path.startswith('/jobs/'):
+            job = service.table.get(self._job_id(path))
+            if job is None:
+                self._send_json(404, {'error': '找不到工作'})
+            else:
+                self._send_json(200, job.to_dict())
+        else:
+            self._send_json(404, {'error': '找不到路徑'})
+
+    def do_POST(self):
+        service = self.server.service
+        path = urlparse(self.path).path.rstrip('/')
+
+        if path == '/jobs':
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                self._send_json(400, {'error': '無效的 JSON'})
+                return
+            url = (body.get('url') or '').strip()
+            if parse_youtube_url(url) is None:
+                self._send_json(400, {'error': '無效的 YouTube 網址'})
+                return
+            quality = str(body.get('quality', '192'))
+            try:
+                parse_qualities(quality)
+            except ValueError as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            job = service.enqueue(url, quality)
+            if job is None:
+                self._send_json(503, {'error': '工作表已滿'})
+            else:
+                self._send_json(201, job.to_dict())
+        elif path.startswith('/jobs/') and path.endswith('/cancel'):
+            self._cancel(path)
+        else:
+            self._send_json(404, {'error': '找不到路徑'})
+
+    def do_DELETE(self):
+        path = urlparse(self.path).path.rstrip('/')
+        if path.startswith('/jobs/'):
+            self._cancel(path)
+        else:
+            self._send_json(404, {'error': '找不到路徑'})
+
+    def _cancel(self, path):
+        job = self.server.service.cancel(self._job_id(path))
+        if job is None:
+            self._send_json(404, {'error': '找不到工作'})
+        elif job.status in (STATUS_DONE, STATUS_FAILED):
+            self._send_json(409, {'error': '工作已結束，無法取消', 'job': job.to_dict()})
+        else:
+            self._send_json(200, job.to_dict())
+
+    def _stream_events(self, job_id):
+        """Server-Sent Events：持續推送工作事件，job 參數可只看單一工作"""
+        table = self.server.service.table
+        subscriber = table.subscribe()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'keep-alive')
+        self.end_headers()
+        try:
+            while True:
+                try:
+                    payload = subscriber.get(timeout=15)
+                except queue.Empty:
+                    # 定期送出註解行，讓中間的代理伺服器不會關閉連線
+                    self.wfile.write(b": keep-alive\n\n")
+                    self.wfile.flush()
+                    continue
+                if job_id and payload['job']['id'] != job_id:
+                    continue
+                data = json.dumps(payload['job'], ensure_ascii=False)
+                self.wfile.write(f"event: {payload['event']}\ndata: {data}\n\n".encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            table.unsubscribe(subscriber)
+
+
+class ApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service, host="127.0.0.1", port=DEFAULT_PORT):
+        self.service = service
+        super().__init__((host, port), _ApiHandler)
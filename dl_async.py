@@ -0,0 +1,327 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import yt_dlp
+
+from dl_disk import estimate_job_bytes, remove_partials
+from dl_ingest import extract_video_id
+from dl_loudness import loudnorm_filter, measure_command, parse_measurement
+from dl_metrics import METRICS
+from dl_retry import ERROR_DISK, ERROR_LABELS, RetryPolicy, classify_error, record_failure
+from dl_transcode import build_mp3_command, default_worker_count, mp3_encoder_for, parse_qualities, quality_outputs
+from dl_verify import IntegrityError, verify_media
+
+_DONE = object()
+
+
+class AsyncOrchestrator:
+    """
+    以 asyncio 管理大量下載工作。
+    解析、下載、轉檔三個階段各自以信號量限制同時數量；
+    yt-dlp 的阻塞呼叫放在固定大小的執行緒池中，FFmpeg 以非同步子程序執行，
+    因此一個程序就能管理很長的佇列，而不需要每個項目一條執行緒。
+    keep_results=False 時不保存失敗項目，只統計各錯誤分類的數量，
+    失敗的項目改由 on_failed(url, category, error) 回調交給呼叫端處理。
+    """
+
+    def __init__(self, downloader, resolve_jobs=8, download_jobs=4, transcode_jobs=None,
+                 format_id='bestaudio/best', quality='192', retry_policy=None, log=print,
+                 keep_results=True, on_failed=None):
+        self.downloader = downloader
+        self.resolve_jobs = resolve_jobs
+        self.download_jobs = download_jobs
+        self.transcode_jobs = transcode_jobs or default_worker_count()
+        self.encoder = mp3_encoder_for(downloader.ffmpeg_path)
+        self.format_id = format_id
+        self.qualities = parse_qualities(quality)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.log = log
+        self.keep_results = keep_results
+        self.on_failed = on_failed
+        self.succeeded = 0
+        self.failed = []
+        self.failure_counts = {}
+        self.in_stage = {'resolve': 0, 'download': 0, 'transcode': 0}
+
+    def run(self, urls):
+        """同步入口：處理 urls（可為產生器），回傳 (成功數, 失敗清單)"""
+        return asyncio.run(self.run_async(urls))
+
+    async def run_async(self, urls):
+        loop = asyncio.get_running_loop()
+        # 只有解析與下載會佔用執行緒
+        executor = ThreadPoolExecutor(
+            max_workers=self.resolve_jobs + self.download_jobs,
+            thread_name_prefix="ytdl"
+        )
+        loop.set_default_executor(executor)
+
+        self._resolve_sem = asyncio.Semaphore(self.resolve_jobs)
+        self._download_sem = asyncio.Semaphore(self.download_jobs)
+        self._transcode_sem = asyncio.Semaphore(self.transcode_jobs)
+
+        # 同時處理中的項目上限等於所有階段容量總和，佇列有上限以免一次讀入整個來源
+        worker_count = self.resolve_jobs + self.download_jobs + self.transcode_jobs
+        self._queue = queue = asyncio.Queue(maxsize=worker_count * 2)
+        # 尚未結束（成功或放棄）的項目數；等待重試的項目也算在內
+        self._outstanding = 0
+        self._fed = False
+        self._drained = asyncio.Event()
+        self._retries = set()
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(worker_count)]
+
+        # 來源（預檢產生器、標準輸入、檔案）讀取時可能阻塞，在專用執行緒中取出下一個項目，
+        # 事件迴圈不會因為等待預檢或輸入而停住，也不佔用解析與下載的執行緒
+        feeder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+        items = iter(urls)
+        try:
+            while True:
+                url = await loop.run_in_executor(feeder, next, items, _DONE)
+                if url is _DONE:
+                    break
+                self._outstanding += 1
+                await queue.put((url, 1))
+        finally:
+            feeder.shutdown(wait=False)
+        self._fed = True
+        self._check_drained()
+        # 重試的項目會在延遲後重新排入佇列，要等所有項目都結束才能讓工作者離開
+        await self._drained.wait()
+        for _ in workers:
+            await queue.put(_DONE)
+        await asyncio.gather(*workers)
+
+        executor.shutdown(wait=True)
+        return self.succeeded, self.failed
+
+    async def _worker(self, queue):
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                return
+            url, attempt = item
+            if await self._process_with_retry(url, attempt):
+                self._outstanding -= 1
+                self._check_drained()
+
+    def _check_drained(self):
+        if self._fed and self._outstanding == 0:
+            self._drained.set()
+
+    async def _process_with_retry(self, url, attempt):
+        """處理一次；回傳 True 表示項目已結束，False 表示已排定稍後重試"""
+        try:
+            await self._process(url)
+            self.downloader.partial_titles.pop(url, None)
+            self.succeeded += 1
+            return True
+        except Exception as e:
+            category = classify_error(e)
+            label = ERROR_LABELS[category]
+            record_failure(category)
+            if not self.retry_policy.should_retry(category, attempt):
+                self.log(f"✗ {label}: {url} - {str(e)}")
+                self.downloader.discard_partials(url)
+                self.failure_counts[category] = self.failure_counts.get(category, 0) + 1
+                if self.keep_results:
+                    self.failed.append((url, category, e))
+                if self.on_failed:
+                    self.on_failed(url, category, e)
+                return True
+            METRICS.retries.inc(labels=(category,))
+            delay = self.retry_policy.delay(category, attempt)
+            self.log(f"⟳ {label}，{delay:.1f} 秒後重試 (第 {attempt + 1} 次): {url}")
+            # 延遲後重新排入佇列，等待期間工作者可以繼續處理其他項目
+            task = asyncio.create_task(self._requeue(url, attempt + 1, delay))
+            self._retries.add(task)
+            task.add_done_callback(self._retries.discard)
+            return False
+
+    async def _requeue(self, url, attempt, delay):
+        await asyncio.sleep(delay)
+        await self._queue.put((url, attempt))
+
+    async def _process(self, url):
+        loop = asyncio.get_running_loop()
+        downloader = self.downloader
+
+        video_id = extract_video_id(url)
+        store_format = downloader.store_format(self.format_id, downloader.loudness is not None)
+        # 儲存庫的雜湊與連結／複製都是檔案 I/O，在執行緒池中進行，不阻塞事件迴圈
+        if video_id and await loop.run_in_executor(None, downloader.restore_from_store, video_id, store_format,
+                                                   self.qualities):
+            return
+
+        async with self._resolve_sem:
+            with self._stage('resolve'):
+                ie_result = await loop.run_in_executor(None, self._resolve, url)
+
+        title = downloader.sanitize_filename(ie_result.get('title') or 'audio')
+        format_id = self.format_id
+        plan = downloader.planner.plan(ie_result) if downloader.planner is not None else None
+        if plan is not None:
+            self.log(f"格式規劃 {title}: {plan.describe()}")
+            format_id = plan.format_id
+            store_format = downloader.store_format(format_id, downloader.loudness is not None)
+            if video_id and await loop.run_in_executor(None, downloader.restore_from_store, video_id,
+                                                       store_format, self.qualities):
+                return
+        disk_bytes = estimate_job_bytes(ie_result, self.qualities, source_bytes=plan.size if plan else None)
+        await self._reserve_disk(disk_bytes)
+        try:
+            async with self._download_sem:
+                with self._stage('download'):
+                    info_dict, source_file = await loop.run_in_executor(None, self._download, ie_result, title,
+                                                                         format_id)
+
+            targets = quality_outputs(downloader.output_dir, title, self.qualities)
+            async with self._transcode_sem:
+                with self._stage('transcode'):
+                    await self._transcode(source_file, targets, info_dict.get('id'), info_dict.get('duration'))
+        except Exception as e:
+            # 暫時性錯誤保留中間檔讓重試時續傳，放棄時才清除
+            category = classify_error(e)
+            if category == ERROR_DISK or not self.retry_policy.should_retry(category, 1):
+                remove_partials(downloader.output_dir, title)
+            else:
+                downloader.partial_titles[url] = title
+            raise
+        finally:
+            downloader.disk_budget.release(disk_bytes)
+
+        for output, quality in targets:
+            await loop.run_in_executor(None, downloader.add_metadata, output, info_dict)
+            await loop.run_in_executor(None, downloader.save_to_store, output, info_dict.get('id'), store_format,
+                                       quality)
+        self.log(f"✓ 完成: {title} ({self.describe()})")
+
+    async def _reserve_disk(self, nbytes):
+        """等到磁碟空間足夠才開始下載（以輪詢等待，不佔用執行緒）"""
+        budget = self.downloader.disk_budget
+        notified = False
+        while not budget.try_acquire(nbytes):
+            if not notified:
+                self.log(f"⏸ 磁碟空間不足（需要約 {nbytes / 1024 / 1024:.0f} MB），等待其他工作完成...")
+                notified = True
+            await asyncio.sleep(budget.poll_interval)
+
+    def _resolve(self, url):
+        """只解析影片資訊，不處理格式（下載階段直接沿用，不再重複解析）"""
+        started = time.monotonic()
+        with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
+            ie_result = ydl.extract_info(url, download=False, process=False)
+        METRICS.extract_seconds.observe(time.monotonic() - started)
+        return ie_result
+
+    def _download(self, ie_result, title, format_id):
+        downloader = self.downloader
+        tracker = METRICS.track_download(format_id, ",".join(self.qualities))
+        hooks = [tracker.on_progress]
+        if downloader.planner is not None:
+            hooks.append(downloader.planner.meter.on_progress)
+        ydl_opts = {
+            'format': format_id,
+            'outtmpl': os.path.join(downloader.output_dir, f'{title}.%(ext)s'),
+            'quiet': True,
+            'no_warnings': True,
+            'noprogress': True,
+            'progress_hooks': hooks,
+            'ffmpeg_location': os.path.dirname(downloader.ffmpeg_path) if downloader.ffmpeg_path else None,
+        }
+        scheduler = downloader.scheduler
+        slot = scheduler.acquire(downloader.priority) if scheduler is not None else None
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info_dict = ydl.process_ie_result(ie_result, download=True)
+                return info_dict, downloader.get_downloaded_path(ydl, info_dict)
+        finally:
+            tracker.flush()
+            if slot is not None:
+                scheduler.release(slot)
+
+    async def _loudness_filter(self, video_id, source_file):
+        """取得響度標準化濾鏡；沒有快取時以非同步子程序量測"""
+        cache = self.downloader.loudness.cache
+        measurement = cache.get(video_id) if video_id else None
+        if measurement is None:
+            proc = await asyncio.create_subprocess_exec(
+                *measure_command(self.downloader.ffmpeg_path, source_file),
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            _, stderr = await proc.communicate()
+            if proc.returncode != 0:
+                raise RuntimeError("FFmpeg 響度量測失敗")
+            measurement = parse_measurement(stderr.decode('utf-8', 'replace'))
+            if video_id:
+                cache.put(video_id, measurement)
+        return loudnorm_filter(measurement)
+
+    async def _transcode(self, source_file, targets, video_id=None, duration=None):
+        temp_targets = [(output + ".part.mp3", quality) for output, quality in targets]
+        for output, _ in targets:
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+        audio_filter = None
+        if self.downloader.loudness is not None:
+            audio_filter = await self._loudness_filter(video_id, source_file)
+        cmd = build_mp3_command(self.downloader.ffmpeg_path, source_file, temp_targets,
+                                audio_filter=audio_filter, encoder=self.encoder)
+        started = time.monotonic()
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await proc.communicate()
+        METRICS.transcode_seconds.observe(time.monotonic() - started, (",".join(q for _, q in targets),))
+        if proc.returncode != 0:
+            for temp_output, _ in temp_targets:
+                if os.path.exists(temp_output):
+                    os.remove(temp_output)
+            tail = stderr.decode('utf-8', 'replace').strip().splitlines()[-1:] or ["未知錯誤"]
+            raise RuntimeError(f"FFmpeg 轉檔失敗: {tail[0]}")
+
+        # 完整性檢查（掃描封包、比對長度）在執行緒中進行；失敗時連同來源檔刪除，重試時重新下載
+        loop = asyncio.get_running_loop()
+        try:
+            for temp_output, _ in temp_targets:
+                await loop.run_in_executor(None, verify_media, temp_output, duration, self.downloader.ffmpeg_path)
+        except IntegrityError:
+            for temp_output, _ in temp_targets:
+                if os.path.exists(temp_output):
+                    os.remove(temp_output)
+            if os.path.exists(source_file):
+                os.remove(source_file)
+            raise
+
+        for (temp_output, _), (output, _) in zip(temp_targets, targets):
+            os.replace(temp_output, output)
+        if os.path.abspath(source_file) not in {os.path.abspath(o) for o, _ in targets}:
+            os.remove(source_file)
+
+    def _stage(self, name):
+        return _StageCounter(self.in_stage, name)
+
+    def describe(self):
+        return (f"解析中 {self.in_stage['resolve']} | 下載中 {self.in_stage['download']} | "
+                f"轉檔中 {self.in_stage['transcode']} | 成功 {self.succeeded} | "
+                f"失敗 {sum(self.failure_counts.values())}")
+
+
+class _StageCounter:
+    """統計各階段目前處理中的項目數（只在事件迴圈執行緒中使用，不需要鎖）"""
+
+    def __init__(self, counts, name):
+        self.counts = counts
+        self.name = name
+
+    def __enter__(self):
+        self.counts[self.name] += 1
+
+    def __exit__(self, *exc):
+        self.counts[self.name] -= 1
@@ -0,0 +1,235 @@
+import hashlib
+import lzma
+import os
+import platform
+import shutil
+import tarfile
+import zipfile
+from urllib.parse import urlparse
+
+import dl_http
+
+# 各平台的 FFmpeg 靜態版本：壓縮檔網址、保存時的檔名、校驗碼檔案與演算法、壓縮檔中的執行檔名稱
+FFMPEG_BUILDS = {
+    ('Windows', 'x86_64'): {
+        'url': "https://github.com/BtbN/FFmpeg-Builds/releases/download/latest/ffmpeg-master-latest-win64-gpl.zip",
+        'archive': "ffmpeg-master-latest-win64-gpl.zip",
+        'checksum_url': "https://github.com/BtbN/FFmpeg-Builds/releases/download/latest/checksums.sha256",
+        'algorithm': 'sha256',
+        'binary': "ffmpeg.exe",
+    },
+    ('Darwin', 'x86_64'): {
+        # evermeet.cx 沒有提供校驗碼，只能依賴 zip 內建的 CRC 檢查
+        'url': "https://evermeet.cx/ffmpeg/getrelease/ffmpeg/zip",
+        'archive': "ffmpeg-macos.zip",
+        'checksum_url': None,
+        'algorithm': None,
+        'binary': "ffmpeg",
+    },
+    ('Linux', 'x86_64'): {
+        'url': "https://johnvansickle.com/ffmpeg/releases/ffmpeg-release-amd64-static.tar.xz",
+        'archive': "ffmpeg-release-amd64-static.tar.xz",
+        'checksum_url': "https://johnvansickle.com/ffmpeg/releases/ffmpeg-release-amd64-static.tar.xz.md5",
+        'algorithm': 'md5',
+        'binary': "ffmpeg",
+    },
+    ('Linux', 'arm64'): {
+        'url': "https://johnvansickle.com/ffmpeg/releases/ffmpeg-release-arm64-static.tar.xz",
+        'archive': "ffmpeg-release-arm64-static.tar.xz",
+        'checksum_url': "https://johnvansickle.com/ffmpeg/releases/ffmpeg-release-arm64-static.tar.xz.md5",
+        'algorithm': 'md5',
+        'binary': "ffmpeg",
+    },
+}
+
+# 下載過（且已通過校驗）的壓縮檔保存在這裡，重新安裝時不需要網路
+DEFAULT_ARCHIVE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "youtube_download", "ffmpeg")
+# 本機鏡像：資料夾或 HTTP 網址，裡面放與官方相同檔名的壓縮檔
+MIRROR_ENV = "YTDL_FFMPEG_MIRROR"
+# 預先指定的壓縮檔雜湊值（官方的演算法；官方沒有校驗碼時為 SHA-256），離線使用鏡像時必須設定
+CHECKSUM_ENV = "YTDL_FFMPEG_CHECKSUM"
+
+_ARCH_ALIASES = {'amd64': 'x86_64', 'x64': 'x86_64', 'aarch64': 'arm64'}
+
+
+def build_for(system=None, machine=None):
+    """目前平台適用的 FFmpeg 靜態版本；沒有時回傳 None（macOS 的 Intel 版本可在 Apple Silicon 上以 Rosetta 執行）"""
+    system = system or platform.system()
+    machine = (machine or platform.machine()).lower()
+    machine = _ARCH_ALIASES.get(machine, machine)
+    build = FFMPEG_BUILDS.get((system, machine))
+    if build is None and system == 'Darwin':
+        build = FFMPEG_BUILDS[('Darwin', 'x86_64')]
+    return build
+
+
+def _remote_name(url):
+    return os.path.basename(urlparse(url).path)
+
+
+def parse_checksum(text, filename):
+    """從校驗碼檔案中找出指定檔名的雜湊值；只有一個雜湊值（不含檔名）的格式也接受"""
+    lines = [line.split() for line in text.splitlines() if line.strip()]
+    for parts in lines:
+        if len(parts) >= 2 and parts[-1].lstrip('*') == filename:
+            return parts[0].lower()
+    if len(lines) == 1 and len(lines[0]) == 1:
+        return lines[0][0].lower()
+    return None
+
+
+def file_digest(path, algorithm):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _is_url(location):
+    return urlparse(location).scheme in ('http', 'https')
+
+
+def _read_text(location):
+    if _is_url(location):
+        return dl_http.fetch(location).decode('utf-8', 'replace')
+    with open(location, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def expected_checksum(build, mirror=None, pinned=None):
+    """
+    取得壓縮檔的 (演算法, 雜湊值)；沒有可用的校驗碼時回傳 None。
+    pinned 指定時直接使用；否則一律從官方來源取得，鏡像只提供壓縮檔，
+    不採用鏡像的校驗碼檔案（否則被竄改的鏡像可以連校驗碼一起替換）。
+    官方有提供校驗碼卻取得不到時拋出例外，不安裝未經驗證的執行檔。
+    """
+    if pinned:
+        return build['algorithm'] or 'sha256', pinned.strip().lower()
+    if not build['checksum_url']:
+        if mirror:
+            raise RuntimeError(f"官方沒有提供校驗碼，使用鏡像時請以環境變數 {CHECKSUM_ENV} 指定 SHA-256")
+        return None
+
+    try:
+        value = parse_checksum(_read_text(build['checksum_url']), _remote_name(build['url']))
+    except Exception as e:
+        hint = f"；離線使用鏡像時請以環境變數 {CHECKSUM_ENV} 指定雜湊值" if mirror else ""
+        raise RuntimeError(f"無法取得 FFmpeg 的官方校驗碼: {str(e)}{hint}") from e
+    if not value:
+        raise RuntimeError(f"無法取得 FFmpeg 的官方校驗碼: 校驗碼檔案中沒有 {_remote_name(build['url'])}")
+    return build['algorithm'], value
+
+
+def _verify(path, expected):
+    return expected is None or file_digest(path, expected[0]) == expected[1]
+
+
+def extract_binary(archive_path, binary, dest_path):
+    """
+    只取出壓縮檔中的 FFmpeg 執行檔，不解開整個壓縮檔。
+    zip 直接依中央目錄讀取該成員（讀取時會檢查 CRC）；tar.xz 依序解壓縮，找到執行檔後立即停止。
+    """
+    temp_path = dest_path + ".tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+    try:
+        if zipfile.is_zipfile(archive_path):
+            with zipfile.ZipFile(archive_path) as zf:
+                member = next((name for name in zf.namelist() if os.path.basename(name) == binary), None)
+                if member is None:
+                    raise RuntimeError(f"壓縮檔中找不到 {binary}")
+                with zf.open(member) as src, open(temp_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+        else:
+            with tarfile.open(archive_path, 'r:*') as tf:
+                for member in tf:
+                    if member.isfile() and os.path.basename(member.name) == binary:
+                        with tf.extractfile(member) as src, open(temp_path, 'wb') as dst:
+                            shutil.copyfileobj(src, dst, 1024 * 1024)
+                        break
+                else:
+                    raise RuntimeError(f"壓縮檔中找不到 {binary}")
+        os.chmod(temp_path, 0o755)
+        os.replace(temp_path, dest_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return dest_path
+
+
+def fetch_archive(build, mirror=None, archive_dir=DEFAULT_ARCHIVE_DIR, reporthook=None, log=print, checksum=None):
+    """
+    取得已驗證的壓縮檔路徑，依序使用：快取資料夾（只保存驗證過的檔案，不需要網路）、
+    本機鏡像資料夾、鏡像網址、官方網址。下載以平行範圍請求進行，中斷後可續傳。
+    """
+    cached = os.path.join(archive_dir, build['archive'])
+    if os.path.exists(cached):
+        log(f"使用快取的 FFmpeg 壓縮檔: {cached}")
+        return cached
+
+    expected = expected_checksum(build, mirror, checksum)
+    if expected is None:
+        log("⚠ 來源沒有提供校驗碼，只以壓縮檔內建的 CRC 檢查")
+
+    remote_name = _remote_name(build['url'])
+    urls = []
+    if mirror:
+        if _is_url(mirror):
+            urls.append(mirror.rstrip('/') + '/' + remote_name)
+        else:
+            for name in (build['archive'], remote_name):
+                local = os.path.join(mirror, name)
+                if os.path.exists(local):
+                    if _verify(local, expected):
+                        log(f"使用本機鏡像的 FFmpeg 壓縮檔: {local}")
+                        return local
+                    log(f"⚠ 本機鏡像的壓縮檔校驗不符，略過: {local}")
+    urls.append(build['url'])
+
+    os.makedirs(archive_dir, exist_ok=True)
+    last_error = None
+    for url in urls:
+        log(f"正在下載: {url}")
+        try:
+            dl_http.download_parallel(url, cached, reporthook=reporthook)
+        except Exception as e:
+            # 保留 .part 與進度檔，下次從已完成的段落繼續
+            log(f"⚠ 下載失敗: {str(e)}")
+            last_error = e
+            continue
+        if _verify(cached, expected):
+            return cached
+        os.remove(cached)
+        last_error = RuntimeError(f"{expected[0]} 校驗碼不符")
+        log(f"⚠ 校驗碼不符，已刪除: {url}")
+    raise RuntimeError(f"FFmpeg 壓縮檔下載失敗: {last_error}")
+
+
+def bootstrap_ffmpeg(dest_dir, mirror=None, archive_dir=DEFAULT_ARCHIVE_DIR, reporthook=None, log=print,
+                     checksum=None):
+    """
+    下載並安裝 FFmpeg 靜態版本到 dest_dir，回傳執行檔路徑。
+    mirror 未指定時使用環境變數 YTDL_FFMPEG_MIRROR（資料夾或 HTTP 網址），
+    checksum 未指定時使用環境變數 YTDL_FFMPEG_CHECKSUM。
+    """
+    build = build_for()
+    if build is None:
+        raise RuntimeError(f"沒有適用於 {platform.system()} {platform.machine()} 的 FFmpeg 靜態版本")
+    mirror = mirror or os.environ.get(MIRROR_ENV)
+    checksum = checksum or os.environ.get(CHECKSUM_ENV)
+
+    dest_path = os.path.join(dest_dir, build['binary'])
+
+    archive_path = fetch_archive(build, mirror, archive_dir, reporthook, log, checksum)
+    log(f"正在取出 {build['binary']}...")
+    try:
+        return extract_binary(archive_path, build['binary'], dest_path)
+    except (zipfile.BadZipFile, tarfile.TarError, lzma.LZMAError, EOFError) as e:
+        # 快取中沒有校驗碼可比對的壓縮檔可能已損毀：刪除後重新下載一次
+        if archive_path != os.path.join(archive_dir, build['archive']):
+            raise
+        log(f"⚠ 快取的壓縮檔已損毀，重新下載: {str(e)}")
+        os.remove(archive_path)
+        archive_path = fetch_archive(build, mirror, archive_dir, reporthook, log, checksum)
+        return extract_binary(archive_path, build['binary'], dest_path)
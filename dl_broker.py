@@ -0,0 +1,296 @@
+import json
+import os
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+import uuid
+
+from dl_ingest import extract_video_id
+from dl_retry import classify_error
+
+DEFAULT_PORT = 8766
+
+STATUS_QUEUED = "queued"
+STATUS_LEASED = "leased"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+class JobBroker:
+    """
+    以 SQLite 保存的工作佇列。
+    工作被取出時會附帶租約（token + 到期時間）；到期未回報的工作會重新排入佇列，
+    舊的租約持有者之後回報也會被忽略。
+    失敗後重新排入的工作在 not_before 之前不會被取出，退避時間由回報的工作節點決定。
+    """
+
+    def __init__(self, db_path, lease_seconds=600, max_attempts=5, archive_path=None):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.archive_path = archive_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL UNIQUE,
+                status TEXT NOT NULL,
+                worker TEXT,
+                token TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated REAL,
+                not_before REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, lease_expires);
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if 'not_before' not in columns:
+            # 舊版建立的資料庫沒有 not_before 欄位
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN not_before REAL")
+        self._conn.commit()
+        self._archived = self._load_archive()
+
+    def _load_archive(self):
+        """讀取共用的下載紀錄（yt-dlp download archive 格式：'youtube <影片 ID>'）"""
+        archived = set()
+        if self.archive_path and os.path.exists(self.archive_path):
+            with open(self.archive_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 2:
+                        archived.add(parts[1])
+        return archived
+
+    def _append_archive(self, video_id):
+        if not self.archive_path or not video_id or video_id in self._archived:
+            return
+        self._archived.add(video_id)
+        with open(self.archive_path, 'a', encoding='utf-8') as f:
+            f.write(f"youtube {video_id}\n")
+
+    def enqueue(self, urls):
+        """加入工作，已在佇列或已下載過的網址會略過；回傳新增數量"""
+        now = time.time()
+        added = 0
+        with self._lock:
+            for url in urls:
+                if extract_video_id(url) in self._archived:
+                    continue
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO jobs (url, status, attempts, updated) VALUES (?, ?, 0, ?)",
+                    (url, STATUS_QUEUED, now)
+                )
+                added += cursor.rowcount
+            self._conn.commit()
+        return added
+
+    def lease(self, worker):
+        """取出一個工作並建立租約；沒有工作時回傳 None"""
+        now = time.time()
+        with self._lock:
+            # 先回收逾期的租約；已用完嘗試次數的直接標記失敗
+            self._conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "worker = NULL, token = NULL, error = COALESCE(error, '租約逾期') "
+                "WHERE status = ? AND lease_expires < ?",
+                (self.max_attempts, STATUS_FAILED, STATUS_QUEUED, STATUS_LEASED, now)
+            )
+            # 還在退避中的工作先跳過
+            row = self._conn.execute(
+                "SELECT id, url, attempts FROM jobs WHERE status = ? "
+                "AND (not_before IS NULL OR not_before <= ?) ORDER BY id LIMIT 1",
+                (STATUS_QUEUED, now)
+            ).fetchone()
+            if row is None:
+                self._conn.commit()
+                return None
+
+            job_id, url, attempts = row
+            token = uuid.uuid4().hex
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, token = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated = ? WHERE id = ?",
+                (STATUS_LEASED, worker, token, now + self.lease_seconds, now, job_id)
+            )
+            self._conn.commit()
+        return {'id': job_id, 'url': url, 'token': token, 'attempt': attempts + 1,
+                'lease_seconds': self.lease_seconds}
+
+    def heartbeat(self, job_id, token):
+        """延長租約；租約已失效時回傳 False"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ? AND token = ? AND status = ?",
+                (now + self.lease_seconds, now, job_id, token, STATUS_LEASED)
+            )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, token, video_id=None):
+        """回報完成並寫入共用下載紀錄"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, token = NULL, error = NULL, updated = ? "
+                "WHERE id = ? AND token = ? AND status = ?",
+                (STATUS_DONE, time.time(), job_id, token, STATUS_LEASED)
+            )
+            self._conn.commit()
+            if cursor.rowcount == 1:
+                self._append_archive(video_id)
+        return cursor.rowcount == 1
+
+    def fail(self, job_id, token, error, retryable=True, delay=0):
+        """回報失敗：可重試且未超過次數時重新排入佇列，delay 秒後才會再被取出"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT attempts FROM jobs WHERE id = ? AND token = ? AND status = ?",
+                (job_id, token, STATUS_LEASED)
+            ).fetchone()
+            if row is None:
+                return False
+            requeue = retryable and row[0] < self.max_attempts
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, token = NULL, error = ?, updated = ?, "
+                "not_before = ? WHERE id = ?",
+                (STATUS_QUEUED if requeue else STATUS_FAILED, str(error)[:500], now,
+                 now + delay if requeue else None, job_id)
+            )
+            self._conn.commit()
+        return True
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {STATUS_QUEUED: 0, STATUS_LEASED: 0, STATUS_DONE: 0, STATUS_FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    """一行一個 JSON 請求、一行一個 JSON 回應"""
+
+    def handle(self):
+        broker = self.server.broker
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                op = request.get('op')
+                if op == 'lease':
+                    response = {'job': broker.lease(request.get('worker', '?'))}
+                elif op == 'heartbeat':
+                    response = {'ok': broker.heartbeat(request['job_id'], request['token'])}
+                elif op == 'complete':
+                    response = {'ok': broker.complete(request['job_id'], request['token'], request.get('video_id'))}
+                elif op == 'fail':
+                    response = {'ok': broker.fail(request['job_id'], request['token'],
+                                                  request.get('error', ''), request.get('retryable', True),
+                                                  request.get('delay', 0))}
+                elif op == 'enqueue':
+                    response = {'added': broker.enqueue(request.get('urls', []))}
+                elif op == 'stats':
+                    response = {'stats': broker.stats()}
+                else:
+                    response = {'error': f'未知的操作: {op}'}
+            except Exception as e:
+                response = {'error': str(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode('utf-8'))
+            self.wfile.flush()
+
+
+class BrokerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, broker, host="127.0.0.1", port=DEFAULT_PORT):
+        self.broker = broker
+        super().__init__((host, port), _BrokerHandler)
+
+
+class BrokerClient:
+    """工作節點使用的連線"""
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, timeout=30):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._file = self._sock.makefile('rwb')
+        self._lock = threading.Lock()
+
+    def request(self, op, **fields):
+        fields['op'] = op
+        with self._lock:
+            self._file.write((json.dumps(fields) + "\n").encode('utf-8'))
+            self._file.flush()
+            line = self._file.readline()
+        if not line:
+            raise ConnectionError("協調器已中斷連線")
+        response = json.loads(line)
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+def run_worker(downloader, client, worker_id, quality='192', poll_interval=5, exit_when_idle=False, log=print):
+    """
+    工作節點主迴圈：向協調器取工作、下載、回報結果。
+    下載期間以背景執行緒定期延長租約；失敗時依下載器的重試策略決定是否重試與退避時間。
+    """
+    retry_policy = downloader.retry_policy
+    processed = 0
+    while True:
+        job = client.request('lease', worker=worker_id)['job']
+        if job is None:
+            if exit_when_idle:
+                stats = client.request('stats')['stats']
+                if stats[STATUS_QUEUED] == 0 and stats[STATUS_LEASED] == 0:
+                    log(f"佇列已清空，工作節點結束（共處理 {processed} 個）")
+                    return processed
+            time.sleep(poll_interval)
+            continue
+
+        log(f"\n[{worker_id}] 取得工作 #{job['id']} (第 {job['attempt']} 次): {job['url']}")
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=_heartbeat_loop, args=(client, job, stop), daemon=True
+        )
+        heartbeat.start()
+        try:
+            success = downloader.download_with_format(job['url'], quality=quality)
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        if success:
+            client.request('complete', job_id=job['id'], token=job['token'],
+                           video_id=extract_video_id(job['url']))
+        else:
+            error = downloader.last_error
+            category = classify_error(error)
+            client.request('fail', job_id=job['id'], token=job['token'], error=str(error),
+                           retryable=retry_policy.should_retry(category, job['attempt']),
+                           delay=retry_policy.delay(category, job['attempt']))
+        processed += 1
+
+
+def _heartbeat_loop(client, job, stop):
+    # 在租約到期前的三分之一時間續約
+    interval = max(1, job['lease_seconds'] / 3)
+    while not stop.wait(interval):
+        try:
+            if not client.request('heartbeat', job_id=job['id'], token=job['token'])['ok']:
+                return
+        except Exception:
+            return
@@ -0,0 +1,58 @@
+import threading
+
+from yt_dlp.utils import DownloadCancelled
+
+
+class JobControl:
+    """
+    下載工作的暫停／繼續／取消控制。
+    下載執行緒在 yt-dlp 的 progress_hook 中呼叫 checkpoint()：
+    暫停時在這裡等待（連線保持開啟，繼續後從原位置接著讀取），
+    取消時拋出 DownloadCancelled，讓 yt-dlp 中斷下載並保留 .part 檔，
+    之後重新下載同一個影片時會從中斷的位元組繼續。
+    """
+
+    def __init__(self):
+        self._running = threading.Event()
+        self._running.set()
+        self._cancelled = threading.Event()
+        # 取消時是否刪除中間檔（放棄這次下載，不打算續傳）
+        self.discard = False
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def cancel(self, discard=False):
+        self.discard = discard
+        self._cancelled.set()
+        # 叫醒暫停中的執行緒，讓它們看到取消狀態
+        self._running.set()
+
+    def wait_if_paused(self):
+        """暫停時等到繼續或取消為止；回傳是否已取消"""
+        self._running.wait()
+        return self.cancelled
+
+    def checkpoint(self):
+        """在下載執行緒中呼叫：暫停時等待，已取消時拋出 DownloadCancelled"""
+        if self.wait_if_paused():
+            raise DownloadCancelled("下載已取消")
+
+    def progress_hook(self, d):
+        """加入 yt-dlp 的 progress_hooks，每收到一段資料就檢查一次"""
+        self.checkpoint()
+
+    def sleep(self, seconds):
+        """可被取消中斷的等待（給 RetryBatch 的重試等待使用）"""
+        self._cancelled.wait(seconds)
@@ -0,0 +1,318 @@
+import copy
+import json
+import os
+import threading
+import time
+from http.cookiejar import Cookie
+
+from yt_dlp.cookies import extract_cookies_from_browser
+
+from dl_metrics import METRICS
+
+# 磁碟快取為選用功能：安裝 cryptography 與 keyring 後以 Fernet 加密保存，金鑰放在作業系統的憑證儲存
+# （macOS Keychain、Windows 認證管理員、Linux Secret Service），重新開啟程式時不必再讀取瀏覽器；
+# 否則只保存在記憶體中
+try:
+    import keyring
+    from cryptography.fernet import Fernet, InvalidToken
+    from keyring.errors import KeyringError
+except ImportError:
+    Fernet = None
+
+DEFAULT_COOKIE_DIR = os.path.join(os.path.expanduser("~"), ".youtube_download", "cookies")
+# 瀏覽器會定期輪替登入 cookie（__Secure-*PSIDTS 等），最多隔這麼久重新擷取一次
+MAX_AGE = 30 * 60
+# 在最早過期的 cookie 過期前這麼久更新
+REFRESH_MARGIN = 5 * 60
+# 兩次背景更新的最短間隔（避免很快過期的 cookie 讓背景執行緒一直擷取）
+MIN_REFRESH_INTERVAL = 60
+# 擷取失敗後這段時間內直接回報同一個錯誤，不重複讀取瀏覽器
+RETRY_INTERVAL = 60
+# 超過這段時間沒有下載使用快取時暫停背景更新，下次使用時再同步擷取
+IDLE_TIMEOUT = 2 * MAX_AGE
+# 只保留下載需要的網域，減少記憶體與磁碟快取中的 cookies
+COOKIE_DOMAINS = ("youtube.com", "google.com", "youtu.be")
+# 憑證儲存中的金鑰名稱
+KEYRING_SERVICE = "youtube_download"
+KEYRING_USERNAME = "cookie-cache-key"
+# 不會保護金鑰的 keyring 後端（沒有可用後端、明文檔案等），使用時只保存在記憶體
+_INSECURE_KEYRING_MODULES = ("keyring.backends.fail", "keyring.backends.null", "keyrings.alt")
+# 舊版與快取放在同一個資料夾的明文金鑰檔
+_LEGACY_KEY_FILE = "cookies.key"
+
+_COOKIE_FIELDS = ("version", "name", "value", "port", "domain", "path", "secure", "expires", "discard",
+                  "comment", "comment_url", "rfc2109")
+
+
+def _wanted(cookie):
+    domain = cookie.domain.lstrip(".")
+    return any(domain == wanted or domain.endswith("." + wanted) for wanted in COOKIE_DOMAINS)
+
+
+def _to_dict(cookie):
+    data = {field: getattr(cookie, field) for field in _COOKIE_FIELDS}
+    data["rest"] = dict(cookie._rest)
+    return data
+
+
+def _from_dict(data):
+    return Cookie(
+        data["version"], data["name"], data["value"],
+        data["port"], data["port"] is not None,
+        data["domain"], bool(data["domain"]), data["domain"].startswith("."),
+        data["path"], bool(data["path"]),
+        data["secure"], data["expires"], data["discard"],
+        data["comment"], data["comment_url"], data["rest"], data["rfc2109"],
+    )
+
+
+def _load_key():
+    """
+    從作業系統的憑證儲存取得加密金鑰，不存在時建立。
+    沒有安全的憑證儲存可用時回傳 None（金鑰不能與快取放在一起，否則加密沒有意義）。
+    """
+    if type(keyring.get_keyring()).__module__.startswith(_INSECURE_KEYRING_MODULES):
+        return None
+    key = keyring.get_password(KEYRING_SERVICE, KEYRING_USERNAME)
+    if not key:
+        key = Fernet.generate_key().decode('ascii')
+        keyring.set_password(KEYRING_SERVICE, KEYRING_USERNAME, key)
+    return key.encode('ascii')
+
+
+def _remove_legacy_cache(cache_dir):
+    """刪除舊版的明文金鑰檔與用它加密的快取"""
+    if not os.path.exists(os.path.join(cache_dir, _LEGACY_KEY_FILE)):
+        return
+    for name in os.listdir(cache_dir):
+        if name == _LEGACY_KEY_FILE or name.endswith(".jar"):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                pass
+
+
+class CookieCache:
+    """
+    瀏覽器 Cookies 快取：只在第一次使用時讀取並解密瀏覽器的 cookie 資料庫（Chrome 可能需要數秒），
+    之後每個 YoutubeDL 的解析與下載都從記憶體中的快取取得，不再使用 cookiesfrombrowser。
+    背景執行緒在最早過期的 cookie 過期前（最多 max_age 秒）重新擷取並替換快取，
+    更新期間下載照常使用舊的 cookies；cookie 真的過期時才同步等待擷取。
+    cache_dir 指定、已安裝 cryptography 與 keyring 且有安全的憑證儲存時，快取以 Fernet 加密寫入磁碟
+    （金鑰只存在憑證儲存中），重新開啟程式時直接載入；否則只保存在記憶體中。
+    """
+
+    def __init__(self, browser, profile=None, cache_dir=DEFAULT_COOKIE_DIR, max_age=MAX_AGE, log=print):
+        self.browser = browser
+        self.profile = profile
+        self.max_age = max_age
+        self.log = log
+        self._fernet = None
+        self._cache_path = None
+        if cache_dir and Fernet is not None:
+            try:
+                if os.path.isdir(cache_dir):
+                    _remove_legacy_cache(cache_dir)
+                key = _load_key()
+                if key is None:
+                    self.log("ℹ 沒有可用的系統憑證儲存，Cookies 只保存在記憶體")
+                else:
+                    os.makedirs(cache_dir, exist_ok=True)
+                    self._fernet = Fernet(key)
+                    self._cache_path = os.path.join(cache_dir, f"{browser}-{profile or 'default'}.jar")
+            except (OSError, ValueError, KeyringError) as e:
+                self.log(f"⚠ 無法使用 Cookies 磁碟快取，只保存在記憶體: {str(e)}")
+                self._fernet = None
+                self._cache_path = None
+
+        self._lock = threading.Lock()
+        self._extract_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._closed = False
+        self._cookies = None
+        self._extracted = 0
+        self._refresh_at = 0
+        self._expires_at = 0
+        self._error = None
+        self._error_until = 0
+        self._last_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.extractions = 0
+        self.background_extractions = 0
+        self.extract_seconds = 0.0
+
+    @property
+    def label(self):
+        name = self.browser.capitalize()
+        return f"{name}（{self.profile}）" if self.profile else name
+
+    def _fresh(self, now):
+        # 背景更新暫停（閒置）或一直失敗時，超過 max_age 兩倍的快取也不再使用
+        return self._cookies is not None and now < self._expires_at and now < self._extracted + 2 * self.max_age
+
+    def get(self):
+        """回傳快取的 cookies；快取不存在或已過期時同步擷取（同時呼叫的執行緒只擷取一次）"""
+        with self._lock:
+            now = time.time()
+            self._last_used = now
+            if now >= self._refresh_at:
+                # 叫醒閒置中的背景執行緒，之後的下載使用更新過的 cookies
+                self._wake.set()
+            if self._fresh(now):
+                self.hits += 1
+                METRICS.cookie_lookups.inc(labels=("hit",))
+                return self._cookies
+        with self._extract_lock:
+            with self._lock:
+                now = time.time()
+                if self._fresh(now):
+                    self.hits += 1
+                    METRICS.cookie_lookups.inc(labels=("hit",))
+                    return self._cookies
+                self.misses += 1
+                METRICS.cookie_lookups.inc(labels=("miss",))
+                if self._error is not None and now < self._error_until:
+                    raise self._error
+                # 磁碟快取只在第一次使用時載入，過期或 invalidate() 之後一律重新擷取
+                first = self._cookies is None
+            if not (first and self._load_disk()):
+                try:
+                    self._extract(background=False)
+                except Exception as e:
+                    with self._lock:
+                        self._error = e
+                        self._error_until = time.time() + RETRY_INTERVAL
+                    raise
+            self._start_refresher()
+            self._wake.set()
+            with self._lock:
+                return self._cookies
+
+    def apply(self, ydl):
+        """把快取的 cookies 放進 YoutubeDL 的 cookie jar（取代 cookiesfrombrowser 選項）"""
+        for cookie in self.get():
+            ydl.cookiejar.set_cookie(copy.copy(cookie))
+
+    def invalidate(self):
+        """捨棄快取（例如 YouTube 要求重新驗證時），下次使用前重新擷取"""
+        with self._lock:
+            self._expires_at = 0
+            self._refresh_at = 0
+        self._wake.set()
+
+    def _install(self, cookies, extracted):
+        """替換快取內容並依 cookie 的過期時間安排下次更新；回傳 cookie 數"""
+        now = time.time()
+        cookies = [c for c in cookies if _wanted(c) and not c.is_expired(now)]
+        expiries = [c.expires for c in cookies if c.expires]
+        # 很快就過期的 cookie 不會讓每次使用都同步擷取（過期的 cookie 本來就不會被送出）
+        expires_at = max(min(expiries, default=extracted + self.max_age * 2), now + MIN_REFRESH_INTERVAL)
+        refresh_at = min(extracted + self.max_age, expires_at - REFRESH_MARGIN)
+        with self._lock:
+            self._cookies = cookies
+            self._extracted = extracted
+            self._expires_at = expires_at
+            self._refresh_at = max(refresh_at, now + MIN_REFRESH_INTERVAL)
+            self._error = None
+        return len(cookies)
+
+    def _extract(self, background):
+        """讀取瀏覽器的 cookie 資料庫（呼叫時持有 _extract_lock）"""
+        started = time.monotonic()
+        jar = extract_cookies_from_browser(self.browser, self.profile)
+        elapsed = time.monotonic() - started
+        METRICS.cookie_extract_seconds.observe(elapsed)
+        count = self._install(list(jar), time.time())
+        with self._lock:
+            self.extractions += 1
+            self.extract_seconds += elapsed
+            if background:
+                self.background_extractions += 1
+        if background:
+            self.log(f"🍪 已在背景更新 {self.label} Cookies（{count} 個，耗時 {elapsed:.1f} 秒）")
+        else:
+            self.log(f"🍪 已從 {self.label} 擷取 {count} 個 Cookies（耗時 {elapsed:.1f} 秒），之後的下載直接使用快取")
+        self._save_disk()
+
+    def _load_disk(self):
+        """從加密的磁碟快取載入；不存在、無法解密或已到更新時間時回傳 False"""
+        if self._cache_path is None or not os.path.exists(self._cache_path):
+            return False
+        try:
+            with open(self._cache_path, 'rb') as f:
+                data = json.loads(self._fernet.decrypt(f.read()))
+        except (OSError, ValueError, InvalidToken):
+            return False
+        extracted = data.get("extracted", 0)
+        if data.get("browser") != self.browser or time.time() - extracted >= self.max_age:
+            return False
+        count = self._install([_from_dict(item) for item in data.get("cookies", [])], extracted)
+        self.log(f"🍪 從加密快取載入 {self.label} Cookies（{count} 個），不必讀取瀏覽器")
+        return True
+
+    def _save_disk(self):
+        if self._cache_path is None:
+            return
+        with self._lock:
+            data = {
+                "browser": self.browser,
+                "extracted": self._extracted,
+                "cookies": [_to_dict(c) for c in self._cookies],
+            }
+        temp_path = self._cache_path + ".tmp"
+        try:
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self._fernet.encrypt(json.dumps(data).encode('utf-8')))
+            os.replace(temp_path, self._cache_path)
+        except OSError as e:
+            self.log(f"⚠ 無法寫入 Cookies 磁碟快取: {str(e)}")
+
+    def _start_refresher(self):
+        with self._lock:
+            if self._thread is not None or self._closed:
+                return
+            self._thread = threading.Thread(target=self._refresh_loop, name="cookie-refresh", daemon=True)
+        self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                delay = self._refresh_at - now
+                idle = now - self._last_used > IDLE_TIMEOUT
+            if idle:
+                self._wake.wait()
+            elif delay > 0:
+                self._wake.wait(delay)
+            self._wake.clear()
+            if self._closed:
+                return
+            with self._extract_lock:
+                with self._lock:
+                    if time.time() < self._refresh_at:
+                        continue
+                try:
+                    self._extract(background=True)
+                except Exception as e:
+                    with self._lock:
+                        self._refresh_at = time.time() + RETRY_INTERVAL
+                    self.log(f"⚠ 背景更新 {self.label} Cookies 失敗，{RETRY_INTERVAL} 秒後重試: {str(e)}")
+
+    def close(self):
+        """停止背景更新"""
+        self._closed = True
+        self._wake.set()
+
+    def describe(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            rate = self.hits / lookups * 100 if lookups else 0
+            text = (f"🍪 Cookies 快取（{self.label}）: 命中 {self.hits}/{lookups} ({rate:.1f}%) | "
+                    f"擷取 {self.extractions} 次（背景 {self.background_extractions} 次），"
+                    f"共 {self.extract_seconds:.1f} 秒")
+            if self._cookies is not None:
+                text += f" | 下次更新 {time.strftime('%H:%M', time.localtime(self._refresh_at))}"
+            return text
@@ -0,0 +1,162 @@
+import glob
+import os
+import re
+import shutil
+import threading
+
+# 沒有任何大小資訊時假設的來源位元率 (kbps)，以常見的最高音訊位元率估計，寧可高估
+FALLBACK_BITRATE = 320
+# 沒有長度資訊時假設的來源大小
+FALLBACK_SOURCE_BYTES = 100 * 1024 * 1024
+# 預設保留的磁碟空間，不分配給下載工作
+DEFAULT_RESERVE_BYTES = 500 * 1024 * 1024
+
+
+class DiskTooSmallError(Exception):
+    """工作需要的空間超過整個磁碟（扣除保留空間），等待或重試都不會成功"""
+
+# yt-dlp 下載中斷時留下的中間檔
+PARTIAL_SUFFIXES = ('.part', '.ytdl', '.temp', '.part.mp3', '.temp.mp3', '.temp.mp4')
+# 影音分開下載、尚未合併的單一格式檔，例如「標題.f137.mp4」
+_FORMAT_FILE_RE = re.compile(r'\.f\d+(-\d+)?\.\w+$')
+
+
+def format_size(fmt):
+    """單一格式的大小（位元組）：優先使用 filesize，否則以位元率 × 長度估計；無法估計時回傳 None"""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return size
+    bitrate = fmt.get('tbr') or fmt.get('abr')
+    duration = fmt.get('duration')
+    if bitrate and duration:
+        return bitrate * 1000 / 8 * duration
+    return None
+
+
+def estimate_source_bytes(info):
+    """
+    從格式資訊估計下載檔的大小。
+    已選定格式時使用選定格式（影音分開時加總）；
+    未選定時（process=False 的解析結果）取純音訊格式中最大的一個。
+    """
+    duration = info.get('duration')
+    requested = info.get('requested_formats')
+    if requested:
+        sizes = [format_size(dict(fmt, duration=duration)) for fmt in requested]
+        if all(sizes):
+            return sum(sizes)
+
+    size = format_size(info)
+    if size:
+        return size
+
+    formats = info.get('formats') or []
+    audio_only = [fmt for fmt in formats if fmt.get('vcodec') == 'none'] or formats
+    sizes = [format_size(dict(fmt, duration=duration)) for fmt in audio_only]
+    sizes = [size for size in sizes if size]
+    if sizes:
+        return max(sizes)
+
+    if duration:
+        return FALLBACK_BITRATE * 1000 / 8 * duration
+    return FALLBACK_SOURCE_BYTES
+
+
+def estimate_job_bytes(info, qualities=(), merge=False, source_bytes=None):
+    """
+    估計單一工作的磁碟用量峰值：來源檔 + 各位元率的 MP3 輸出。
+    轉檔時來源與暫存輸出同時存在，來源在轉檔完成後才刪除，因此取兩者總和。
+    merge=True（影音分開下載再合併）時，合併輸出與來源同時存在，另加一份來源大小。
+    已知來源大小（例如格式規劃的結果）時以 source_bytes 傳入。
+    """
+    source = source_bytes or estimate_source_bytes(info)
+    duration = info.get('duration') or 0
+    outputs = sum(int(q) * 1000 / 8 * duration for q in qualities)
+    if merge:
+        outputs += source
+    # 額外 5% 給容器開銷與封面等小檔案
+    return int((source + outputs) * 1.05)
+
+
+def remove_partials(output_dir, title):
+    """刪除指定標題留下的中間檔，回傳釋放的位元組數"""
+    freed = 0
+    pattern = os.path.join(glob.escape(output_dir), glob.escape(title) + '.*')
+    for path in glob.glob(pattern):
+        name = os.path.basename(path)[len(title):]
+        if not (name.endswith(PARTIAL_SUFFIXES) or '.part-Frag' in name or _FORMAT_FILE_RE.fullmatch(name)):
+            continue
+        try:
+            freed += os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            pass
+    return freed
+
+
+class DiskBudget:
+    """
+    依剩餘磁碟空間決定是否讓下一個工作開始。
+    每個工作開始前先預留估計的峰值用量，完成（或失敗）後歸還；
+    空間不足時等待其他工作歸還，而不是讓工作寫到一半失敗。
+    預留量在工作寫入期間不會扣除，因此估計偏向保守。
+    """
+
+    def __init__(self, path, reserve_bytes=DEFAULT_RESERVE_BYTES, poll_interval=5.0, log=print):
+        self.path = path
+        self.reserve_bytes = reserve_bytes
+        self.poll_interval = poll_interval
+        self.log = log
+        self.reserved = 0
+        self.in_flight = 0
+        self.waits = 0
+        self._cond = threading.Condition()
+
+    def _usage(self):
+        # 輸出資料夾可能還沒建立，往上找到存在的目錄
+        path = os.path.abspath(self.path)
+        while not os.path.exists(path):
+            path = os.path.dirname(path)
+        return shutil.disk_usage(path)
+
+    def free_bytes(self):
+        return self._usage().free
+
+    def available(self):
+        """扣除保留空間與已預留給工作的量後，還可以分配的位元組數"""
+        return self.free_bytes() - self.reserve_bytes - self.reserved
+
+    def try_acquire(self, nbytes):
+        """空間足夠時預留並回傳 True；不會等待"""
+        with self._cond:
+            if self.available() < nbytes:
+                if self.in_flight == 0 and self._usage().total - self.reserve_bytes < nbytes:
+                    raise DiskTooSmallError(f"檔案需要約 {nbytes / 1024 / 1024:.0f} MB，超過磁碟容量")
+                return False
+            self.reserved += nbytes
+            self.in_flight += 1
+            return True
+
+    def acquire(self, nbytes):
+        """等待到空間足夠後預留"""
+        notified = False
+        while not self.try_acquire(nbytes):
+            if not notified:
+                self.waits += 1
+                self.log(f"⏸ 磁碟空間不足（需要約 {nbytes / 1024 / 1024:.0f} MB，"
+                         f"可用 {max(0, self.available()) / 1024 / 1024:.0f} MB），等待其他工作完成...")
+                notified = True
+            with self._cond:
+                self._cond.wait(self.poll_interval)
+        if notified:
+            self.log("▶ 磁碟空間足夠，繼續下載")
+
+    def release(self, nbytes):
+        with self._cond:
+            self.reserved -= nbytes
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def describe(self):
+        return (f"磁碟: 可用 {self.free_bytes() / 1024 / 1024 / 1024:.1f} GB | "
+                f"已預留 {self.reserved / 1024 / 1024:.0f} MB ({self.in_flight} 個工作)")
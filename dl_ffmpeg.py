@@ -0,0 +1,150 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+
+# 各輸出格式可用的編碼器，越前面越優先（相同品質下速度較快或品質較好的排前面）
+ENCODER_PREFERENCES = {
+    'mp3': ('libmp3lame', 'mp3_mf', 'libshine'),
+    'aac': ('libfdk_aac', 'aac_at', 'aac'),
+    'opus': ('libopus', 'opus'),
+}
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "youtube_download", "ffmpeg_caps.json")
+
+# `ffmpeg -encoders` 的每一行：「 A....D libmp3lame  說明」，第一個旗標為類型，第二、三個為幀／切片多執行緒
+_ENCODER_LINE_RE = re.compile(r'^ ([VAS])([F.])([S.])[X.][B.][D.] (\S+)', re.M)
+_VERSION_RE = re.compile(r'ffmpeg version (\S+)')
+
+_memo = {}
+_memo_lock = threading.Lock()
+
+
+class FFmpegCapabilities:
+    """FFmpeg 的版本、可用編碼器與多執行緒支援"""
+
+    def __init__(self, path, version, encoders, threaded_encoders, threads):
+        self.path = path
+        self.version = version
+        self.encoders = set(encoders)
+        self.threaded_encoders = set(threaded_encoders)
+        self.threads = threads
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['path'], data['version'], data['encoders'], data['threaded_encoders'], data['threads'])
+
+    def to_dict(self):
+        return {
+            'path': self.path,
+            'version': self.version,
+            'encoders': sorted(self.encoders),
+            'threaded_encoders': sorted(self.threaded_encoders),
+            'threads': self.threads,
+        }
+
+    def has_encoder(self, name):
+        return name in self.encoders
+
+    def best_encoder(self, codec):
+        """回傳指定輸出格式（mp3、aac、opus）可用的最佳編碼器；都沒有時回傳 None"""
+        for name in ENCODER_PREFERENCES.get(codec, ()):
+            if name in self.encoders:
+                return name
+        return None
+
+    def describe(self):
+        found = [name for codec in ENCODER_PREFERENCES for name in ENCODER_PREFERENCES[codec] if name in self.encoders]
+        return (f"FFmpeg {self.version} | 編碼器: {', '.join(found) or '無'} | "
+                f"多執行緒: {'支援' if self.threads else '不支援'}")
+
+
+def resolve_ffmpeg(path=None):
+    """取得 FFmpeg 執行檔的完整路徑；只有命令名稱時從 PATH 中尋找，找不到時回傳 None"""
+    path = path or "ffmpeg"
+    if os.path.isabs(path):
+        return path if os.path.exists(path) else None
+    return shutil.which(path)
+
+
+def probe(path):
+    """實際執行 FFmpeg 取得版本與編碼器清單（約需數十毫秒，結果應快取）"""
+    version_result = subprocess.run(
+        [path, "-hide_banner", "-version"], capture_output=True, text=True, timeout=10
+    )
+    match = _VERSION_RE.search(version_result.stdout)
+    if version_result.returncode != 0 or not match:
+        raise RuntimeError("FFmpeg 版本檢查失敗")
+    # 預設組態會自動啟用 pthreads／w32threads，只有明確停用時才視為不支援
+    threads = not re.search(r'--disable-(pthreads|w32threads|os2threads)', version_result.stdout)
+
+    encoders_result = subprocess.run(
+        [path, "-hide_banner", "-encoders"], capture_output=True, text=True, timeout=10
+    )
+    encoders = []
+    threaded = []
+    for kind, frame, slice_, name in _ENCODER_LINE_RE.findall(encoders_result.stdout):
+        encoders.append(name)
+        if frame == 'F' or slice_ == 'S':
+            threaded.append(name)
+    return FFmpegCapabilities(path, match.group(1), encoders, threaded, threads)
+
+
+def _load_cache(cache_path):
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache_path, cache):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=2)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        # 快取寫不進去只會讓下次啟動再量測一次
+        pass
+
+
+def get_capabilities(path=None, cache_path=DEFAULT_CACHE_PATH):
+    """
+    取得 FFmpeg 的能力資訊；找不到或無法執行時回傳 None。
+    結果以「實際路徑 + 修改時間 + 大小」為鍵快取在磁碟上，
+    同一個執行檔只在第一次使用（或更新之後）執行一次檢查。
+    """
+    resolved = resolve_ffmpeg(path)
+    if not resolved:
+        return None
+    real_path = os.path.realpath(resolved)
+    try:
+        stat = os.stat(real_path)
+    except OSError:
+        return None
+    stamp = [stat.st_mtime_ns, stat.st_size]
+
+    with _memo_lock:
+        cached = _memo.get(real_path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        disk = _load_cache(cache_path) if cache_path else {}
+        entry = disk.get(real_path)
+        if entry and entry.get('stamp') == stamp:
+            capabilities = FFmpegCapabilities.from_dict(entry['capabilities'])
+            capabilities.path = resolved
+        else:
+            try:
+                capabilities = probe(resolved)
+            except (OSError, RuntimeError, subprocess.SubprocessError):
+                return None
+            if cache_path:
+                disk[real_path] = {'stamp': stamp, 'capabilities': capabilities.to_dict()}
+                _save_cache(cache_path, disk)
+        _memo[real_path] = (stamp, capabilities)
+        return capabilities
@@ -1,4 +1,5 @@
 import yt_dlp
+from yt_dlp.utils import DownloadCancelled
 import os
 import sys
 import re
@@ -6,17 +7,55 @@ import subprocess
 import threading
 import time
 import platform
-import zipfile
-import tarfile
-import urllib.request
 from datetime import datetime
 from pathlib import Path
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 from tkinter.ttk import Progressbar
 import queue
+import sqlite3
 import ssl
 import certifi
+import dl_http
+from dl_bootstrap import bootstrap_ffmpeg
+from dl_control import JobControl
+from dl_cookies import CookieCache
+from dl_disk import DiskBudget, estimate_job_bytes, remove_partials
+from dl_ffmpeg import get_capabilities, resolve_ffmpeg
+from dl_history import DEFAULT_PAGE_SIZE, STATUS_CACHED, STATUS_CANCELLED, STATUS_DONE, STATUS_FAILED, STATUS_LABELS, JobHistory
+from dl_retry import ERROR_CANCELLED, ERROR_DISK, RetryBatch, RetryPolicy, classify_error
+from dl_ingest import KIND_VIDEO, canonical_url, extract_video_id, parse_youtube_url
+from dl_loudness import LoudnessCache, LoudnessNormalizer, loudnorm_filter
+from dl_metrics import METRICS, start_metrics_server
+from dl_planner import FormatPlanner, ThroughputMeter
+from dl_priority import DEFAULT_BEACON_DIR, DEFAULT_RESERVED_SLOTS, PRIORITY_BULK, PRIORITY_INTERACTIVE, PriorityScheduler
+from dl_shard import DEFAULT_SHARD_SIZE, DEFAULT_SHARD_WORKERS, index_width, numbered_prefix, run_sharded, shard_ranges
+from dl_store import MediaStore
+from dl_stream import stream_to_mp3, streamable
+from dl_transcode import TranscodePool, quality_outputs
+from dl_verify import IntegrityError, verify_media
+
+# 多位元率模式輸出的位元率
+MULTI_BITRATE_QUALITIES = ["128", "192", "320"]
+
+# 影片品質對應的 yt-dlp 格式
+VIDEO_FORMATS = {
+    "720p": 'bestvideo[height<=720]+bestaudio/best[height<=720]',
+    "1080p": 'bestvideo[height<=1080]+bestaudio/best[height<=1080]',
+    "best": 'bestvideo+bestaudio/best',
+}
+AUDIO_FORMAT = 'bestaudio/best'
+
+# 日誌區保留的最大行數，長時間批次下載時不會無限增長
+MAX_LOG_LINES = 2000
+
+# 等待重試與等待轉檔的項目上限，下載遠快於轉檔時讓下載暫停等待
+PENDING_LIMIT = 64
+
+# 播放清單每次插入樹狀視圖的項目數（串流讀取時分批交給主執行緒）
+PLAYLIST_INSERT_CHUNK = 200
+# 取得播放清單時最多跟隨的轉址次數
+PLAYLIST_MAX_REDIRECTS = 5
 
 class YouTubeDownloaderGUI:
     def __init__(self, root):
@@ -32,6 +71,34 @@ class YouTubeDownloaderGUI:
         self.conversion_progress = 0
         self.is_converting = False
         self.log_queue = queue.Queue()
+        # 播放清單分段平行下載時，每條執行緒各自記錄最近的錯誤
+        self._thread_state = threading.local()
+        self.last_error = None
+        self.retry_policy = RetryPolicy()
+        self.transcode_pool = None
+        self.disk_budget = None
+        self.loudness = None
+        self.partial_titles = {}
+        # 由實際完成的下載量測頻寬，供「自動」影片品質選擇格式
+        self.throughput = ThroughputMeter()
+        # 目前工作的暫停／取消控制
+        self.job_control = None
+        self.download_thread = None
+        # 下載名額：播放清單的工作執行緒使用一般名額，網址欄的單一下載優先並可使用保留名額
+        self.scheduler = PriorityScheduler(slots=DEFAULT_SHARD_WORKERS, reserved=DEFAULT_RESERVED_SLOTS,
+                                           beacon_dir=DEFAULT_BEACON_DIR, log=self.log)
+        self.job_is_bulk = False
+        self.interactive_running = False
+        # 瀏覽器 Cookies 快取：第一次使用時擷取，之後所有解析與下載共用，背景更新
+        self.cookie_cache = None
+        self._cookie_lock = threading.Lock()
+        self._cookie_warned = None
+        # 下載紀錄資料庫（無法開啟時不記錄）
+        try:
+            self.history = JobHistory()
+        except (OSError, sqlite3.Error) as e:
+            self.history = None
+            print(f"⚠ 無法開啟下載紀錄: {str(e)}")
         
         # 設定 SSL 憑證
         self.setup_ssl()
@@ -46,6 +113,15 @@ class YouTubeDownloaderGUI:
         # 啟動日誌更新
         self.update_log()
     
+    @property
+    def last_error(self):
+        """目前執行緒最近一次下載失敗的例外"""
+        return getattr(self._thread_state, 'last_error', None)
+    
+    @last_error.setter
+    def last_error(self, error):
+        self._thread_state.last_error = error
+    
     def setup_ssl(self):
         """設定 SSL 憑證"""
         try:
@@ -63,15 +139,17 @@ class YouTubeDownloaderGUI:
         # 根據作業系統設定 FFmpeg 執行檔名稱
         if system == "Windows":
             ffmpeg_name = "ffmpeg.exe"
-            ffmpeg_dir = "ffmpeg-master-latest-win64-gpl"
+            # 舊版解開整個壓縮檔時的位置
+            ffmpeg_dirs = ["ffmpeg", "ffmpeg-master-latest-win64-gpl"]
         else:  # macOS 或 Linux
             ffmpeg_name = "ffmpeg"
-            ffmpeg_dir = "ffmpeg"
+            ffmpeg_dirs = ["ffmpeg"]
         
         # 檢查本地 FFmpeg
-        local_ffmpeg = os.path.join(script_dir, ffmpeg_dir, "bin", ffmpeg_name)
-        if os.path.exists(local_ffmpeg):
-            return local_ffmpeg
+        for ffmpeg_dir in ffmpeg_dirs:
+            local_ffmpeg = os.path.join(script_dir, ffmpeg_dir, "bin", ffmpeg_name)
+            if os.path.exists(local_ffmpeg):
+                return local_ffmpeg
         
         # 檢查系統 PATH 中的 FFmpeg
         ffmpeg_in_path = self.check_ffmpeg_in_path()
@@ -91,58 +169,26 @@ class YouTubeDownloaderGUI:
         return None
     
     def check_ffmpeg_in_path(self):
-        """檢查 FFmpeg 是否在系統 PATH 中"""
-        try:
-            result = subprocess.run(
-                ["ffmpeg", "-version"],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode == 0:
-                # FFmpeg 在 PATH 中，取得完整路徑
-                which_result = subprocess.run(
-                    ["which", "ffmpeg"],
-                    capture_output=True,
-                    text=True,
-                    timeout=5
-                )
-                if which_result.returncode == 0:
-                    ffmpeg_path = which_result.stdout.strip()
-                    return ffmpeg_path if ffmpeg_path else "ffmpeg"
-                
-                # 如果 which 失敗，返回命令名稱
-                if platform.system() == "Windows":
-                    return "ffmpeg.exe"
-                else:
-                    return "ffmpeg"
-        except:
-            pass
+        """檢查 FFmpeg 是否在系統 PATH 中且可以執行（檢查結果依執行檔快取）"""
+        ffmpeg_path = resolve_ffmpeg("ffmpeg")
+        if ffmpeg_path and get_capabilities(ffmpeg_path):
+            return ffmpeg_path
         return None
     
     def download_ffmpeg(self):
         """下載 FFmpeg"""
         system = platform.system()
         script_dir = os.path.dirname(os.path.abspath(__file__))
+        # 與 find_ffmpeg 檢查的本地路徑相同，下次啟動時直接使用
+        ffmpeg_dir = os.path.join(script_dir, "ffmpeg", "bin")
         
         self.log("正在下載 FFmpeg...")
         
         try:
             if system == "Windows":
                 # Windows: 下載預編譯版本
-                url = "https://github.com/BtbN/FFmpeg-Builds/releases/download/latest/ffmpeg-master-latest-win64-gpl.zip"
-                download_path = os.path.join(script_dir, "ffmpeg.zip")
-                extract_dir = script_dir
-                
                 self.log("正在下載 Windows 版 FFmpeg...")
-                urllib.request.urlretrieve(url, download_path, self.download_progress)
-                
-                self.log("正在解壓縮...")
-                with zipfile.ZipFile(download_path, 'r') as zip_ref:
-                    zip_ref.extractall(extract_dir)
-                
-                os.remove(download_path)
-                ffmpeg_path = os.path.join(script_dir, "ffmpeg-master-latest-win64-gpl", "bin", "ffmpeg.exe")
+                ffmpeg_path = bootstrap_ffmpeg(ffmpeg_dir, reporthook=self.download_progress, log=self.log)
                 
             elif system == "Darwin":  # macOS
                 # macOS: 建議使用 Homebrew，或下載靜態編譯版本
@@ -170,21 +216,7 @@ class YouTubeDownloaderGUI:
                 except:
                     # Homebrew 不可用，下載靜態編譯版本
                     self.log("Homebrew 不可用，下載靜態編譯版本...")
-                    url = "https://evermeet.cx/ffmpeg/getrelease/ffmpeg/zip"
-                    download_path = os.path.join(script_dir, "ffmpeg.zip")
-                    ffmpeg_dir = os.path.join(script_dir, "ffmpeg", "bin")
-                    os.makedirs(ffmpeg_dir, exist_ok=True)
-                    
-                    urllib.request.urlretrieve(url, download_path, self.download_progress)
-                    
-                    with zipfile.ZipFile(download_path, 'r') as zip_ref:
-                        zip_ref.extractall(ffmpeg_dir)
-                    
-                    os.remove(download_path)
-                    ffmpeg_path = os.path.join(ffmpeg_dir, "ffmpeg")
-                    
-                    # 給予執行權限
-                    os.chmod(ffmpeg_path, 0o755)
+                    ffmpeg_path = bootstrap_ffmpeg(ffmpeg_dir, reporthook=self.download_progress, log=self.log)
                 
             else:  # Linux
                 self.log("Linux 系統偵測到")
@@ -216,23 +248,7 @@ class YouTubeDownloaderGUI:
                 if not installed:
                     # 下載靜態編譯版本
                     self.log("使用靜態編譯版本...")
-                    url = "https://johnvansickle.com/ffmpeg/releases/ffmpeg-release-amd64-static.tar.xz"
-                    download_path = os.path.join(script_dir, "ffmpeg.tar.xz")
-                    
-                    urllib.request.urlretrieve(url, download_path, self.download_progress)
-                    
-                    self.log("正在解壓縮...")
-                    with tarfile.open(download_path, 'r:xz') as tar_ref:
-                        tar_ref.extractall(script_dir)
-                    
-                    os.remove(download_path)
-                    
-                    # 找到解壓後的目錄
-                    for item in os.listdir(script_dir):
-                        if item.startswith("ffmpeg-") and os.path.isdir(os.path.join(script_dir, item)):
-                            ffmpeg_path = os.path.join(script_dir, item, "ffmpeg")
-                            os.chmod(ffmpeg_path, 0o755)
-                            break
+                    ffmpeg_path = bootstrap_ffmpeg(ffmpeg_dir, reporthook=self.download_progress, log=self.log)
             
             self.log("✓ FFmpeg 下載並設定完成")
             return ffmpeg_path
@@ -260,11 +276,40 @@ class YouTubeDownloaderGUI:
             else:
                 # 如果是命令名稱，檢查是否在 PATH 中
                 self.log(f"使用系統 FFmpeg: {self.ffmpeg_path}")
+            capabilities = get_capabilities(self.ffmpeg_path)
+            if capabilities:
+                self.log(capabilities.describe())
     
     def setup_output_dir(self):
         """建立輸出目錄"""
         Path(self.output_dir).mkdir(exist_ok=True)
     
+    def get_transcode_pool(self):
+        """取得轉檔池（FFmpeg 路徑變更後會重新建立）"""
+        ffmpeg_path = self.ffmpeg_path or "ffmpeg"
+        if self.transcode_pool is None or self.transcode_pool.ffmpeg_path != ffmpeg_path:
+            self.transcode_pool = TranscodePool(ffmpeg_path, log=self.log, max_pending=PENDING_LIMIT)
+            self.log(f"轉檔池已啟動: {self.transcode_pool.workers} 個 FFmpeg 工作（編碼器 {self.transcode_pool.encoder}）")
+        return self.transcode_pool
+    
+    def get_loudness_normalizer(self):
+        """取得響度標準化器（量測快取放在儲存庫目錄下）"""
+        cache_dir = os.path.join(self.output_dir, ".store", "loudness")
+        if (self.loudness is None or self.loudness.cache.root != cache_dir
+                or self.loudness.ffmpeg_path != (self.ffmpeg_path or "ffmpeg")):
+            self.loudness = LoudnessNormalizer(LoudnessCache(cache_dir), self.ffmpeg_path)
+        return self.loudness
+    
+    def _audio_store_format(self):
+        """儲存庫的格式鍵：標準化過的輸出與原始輸出分開保存"""
+        return AUDIO_FORMAT + "+loudnorm" if self.normalize_loudness.get() else AUDIO_FORMAT
+    
+    def get_disk_budget(self):
+        """取得磁碟空間預算（輸出資料夾變更後會重新建立）"""
+        if self.disk_budget is None or self.disk_budget.path != self.output_dir:
+            self.disk_budget = DiskBudget(self.output_dir, log=self.log)
+        return self.disk_budget
+    
     def create_widgets(self):
         """建立 GUI 元件"""
         # 主要容器
@@ -304,7 +349,7 @@ class YouTubeDownloaderGUI:
         
         self.playlist_tree = ttk.Treeview(
             playlist_container,
-            columns=("title", "duration", "url"),
+            columns=("title", "duration", "url", "index"),
             show="tree headings",
             height=8,
             yscrollcommand=playlist_scroll.set
@@ -320,6 +365,7 @@ class YouTubeDownloaderGUI:
         self.playlist_tree.column("title", width=400)
         self.playlist_tree.column("duration", width=80)
         self.playlist_tree.column("url", width=0, stretch=False)
+        self.playlist_tree.column("index", width=0, stretch=False)
         
         self.playlist_tree.pack(fill=tk.BOTH, expand=True)
         
@@ -331,6 +377,20 @@ class YouTubeDownloaderGUI:
         ttk.Button(playlist_btn_frame, text="取消全選", command=self.deselect_all_playlist).pack(side=tk.LEFT, padx=5)
         ttk.Button(playlist_btn_frame, text="下載選中項目", command=self.download_selected_playlist).pack(side=tk.LEFT, padx=5)
         
+        # 檔名加上清單編號：分段平行下載時完成順序不固定，依檔名排序仍與清單順序一致
+        self.number_playlist = tk.BooleanVar(value=True)
+        ttk.Checkbutton(
+            playlist_btn_frame,
+            text="檔名依清單順序編號",
+            variable=self.number_playlist
+        ).pack(side=tk.LEFT, padx=5)
+        
+        # 播放清單下載中仍可從網址欄下載單一影片，並使用這些保留名額立即開始
+        ttk.Label(playlist_btn_frame, text="單一下載保留名額").pack(side=tk.LEFT, padx=(15, 2))
+        self.reserved_slots = tk.StringVar(value=str(DEFAULT_RESERVED_SLOTS))
+        ttk.Spinbox(playlist_btn_frame, from_=0, to=4, width=3, textvariable=self.reserved_slots).pack(side=tk.LEFT)
+        self.reserved_slots.trace('w', self.on_reserved_slots_change)
+        
         # 下載類型選擇
         type_frame = ttk.LabelFrame(main_frame, text="下載類型", padding="10")
         type_frame.grid(row=3, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=5)
@@ -349,6 +409,30 @@ class YouTubeDownloaderGUI:
         ttk.Radiobutton(self.audio_quality_frame, text="256 kbps", variable=self.audio_quality, value="256").pack(side=tk.LEFT, padx=10)
         ttk.Radiobutton(self.audio_quality_frame, text="320 kbps", variable=self.audio_quality, value="320").pack(side=tk.LEFT, padx=10)
         
+        # 多位元率：只下載、解碼一次，同時輸出到各位元率子目錄
+        self.multi_bitrate = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            self.audio_quality_frame,
+            text="同時輸出 " + "/".join(MULTI_BITRATE_QUALITIES) + " kbps",
+            variable=self.multi_bitrate
+        ).pack(side=tk.LEFT, padx=10)
+        
+        # 響度標準化：兩階段 EBU R128，量測結果依影片快取
+        self.normalize_loudness = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            self.audio_quality_frame,
+            text="音量標準化",
+            variable=self.normalize_loudness
+        ).pack(side=tk.LEFT, padx=10)
+        
+        # 串流轉檔：邊下載邊轉 MP3，不寫入來源檔（僅適用單一檔案的格式）
+        self.stream_audio = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            self.audio_quality_frame,
+            text="串流轉檔",
+            variable=self.stream_audio
+        ).pack(side=tk.LEFT, padx=10)
+        
         # 影片品質選擇（僅影片模式）
         self.video_quality_frame = ttk.LabelFrame(main_frame, text="影片品質", padding="10")
         self.video_quality_frame.grid(row=5, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=5)
@@ -359,6 +443,15 @@ class YouTubeDownloaderGUI:
         ttk.Radiobutton(self.video_quality_frame, text="1080p", variable=self.video_quality, value="1080p").pack(side=tk.LEFT, padx=10)
         ttk.Radiobutton(self.video_quality_frame, text="最佳品質", variable=self.video_quality, value="best").pack(side=tk.LEFT, padx=10)
         
+        # 自動：依量測到的頻寬，在時間與大小限制內選擇最高的品質（留空表示不限制）
+        ttk.Radiobutton(self.video_quality_frame, text="自動（依頻寬）", variable=self.video_quality, value="auto").pack(side=tk.LEFT, padx=10)
+        ttk.Label(self.video_quality_frame, text="時限(分)").pack(side=tk.LEFT)
+        self.plan_minutes = tk.StringVar(value="")
+        ttk.Entry(self.video_quality_frame, textvariable=self.plan_minutes, width=5).pack(side=tk.LEFT, padx=(2, 10))
+        ttk.Label(self.video_quality_frame, text="上限(MB)").pack(side=tk.LEFT)
+        self.plan_megabytes = tk.StringVar(value="")
+        ttk.Entry(self.video_quality_frame, textvariable=self.plan_megabytes, width=6).pack(side=tk.LEFT, padx=2)
+        
         # 監聽下載類型變化
         self.download_type.trace('w', self.on_download_type_change)
         
@@ -411,9 +504,17 @@ class YouTubeDownloaderGUI:
         self.dir_label.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
         ttk.Button(dir_frame, text="選擇目錄", command=self.choose_directory).pack(side=tk.LEFT, padx=5)
         
-        # 下載按鈕
-        self.download_btn = ttk.Button(main_frame, text="開始下載", command=self.start_download, style="Accent.TButton")
-        self.download_btn.grid(row=8, column=0, columnspan=3, pady=10)
+        # 下載、暫停、取消按鈕
+        control_frame = ttk.Frame(main_frame)
+        control_frame.grid(row=8, column=0, columnspan=3, pady=10)
+        
+        self.download_btn = ttk.Button(control_frame, text="開始下載", command=self.start_download, style="Accent.TButton")
+        self.download_btn.pack(side=tk.LEFT, padx=5)
+        self.pause_btn = ttk.Button(control_frame, text="暫停", command=self.toggle_pause, state=tk.DISABLED)
+        self.pause_btn.pack(side=tk.LEFT, padx=5)
+        self.cancel_btn = ttk.Button(control_frame, text="取消", command=self.cancel_download, state=tk.DISABLED)
+        self.cancel_btn.pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_frame, text="下載紀錄", command=self.show_history).pack(side=tk.LEFT, padx=5)
         
         # 進度條
         self.progress_var = tk.DoubleVar()
@@ -496,6 +597,9 @@ class YouTubeDownloaderGUI:
                 message = self.log_queue.get_nowait()
                 self.log_text.config(state=tk.NORMAL)
                 self.log_text.insert(tk.END, f"{message}\n")
+                excess = int(self.log_text.index('end-1c').split('.')[0]) - MAX_LOG_LINES
+                if excess > 0:
+                    self.log_text.delete('1.0', f'{excess + 1}.0')
                 self.log_text.see(tk.END)
                 self.log_text.config(state=tk.DISABLED)
         except queue.Empty:
@@ -531,7 +635,10 @@ class YouTubeDownloaderGUI:
         threading.Thread(target=self._fetch_playlist_thread, args=(url,), daemon=True).start()
     
     def _fetch_playlist_thread(self, url):
-        """取得播放清單的執行緒函數"""
+        """
+        取得播放清單的執行緒函數
+        以 process=False 取得未展開的清單，邊讀邊分批插入，不會把所有項目的資訊同時留在記憶體中。
+        """
         try:
             ydl_opts = {
                 'quiet': True,
@@ -541,28 +648,38 @@ class YouTubeDownloaderGUI:
             }
             
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
+                info = ydl.extract_info(url, download=False, process=False)
+                # process=False 不會跟隨轉址結果（例如沒有 v= 的 watch?list= 會轉到 /playlist?list=），自行解析
+                for _ in range(PLAYLIST_MAX_REDIRECTS):
+                    if info.get('_type') not in ('url', 'url_transparent'):
+                        break
+                    info = ydl.extract_info(info['url'], download=False, process=False)
                 
                 if 'entries' in info:
                     # 清空現有項目
                     self.root.after(0, lambda: self.playlist_tree.delete(*self.playlist_tree.get_children()))
                     
                     playlist_title = info.get('title', '播放清單')
-                    total_videos = len(info['entries'])
-                    
                     self.log(f"找到播放清單: {playlist_title}")
-                    self.log(f"共 {total_videos} 個影片")
                     
-                    # 添加到樹狀視圖
+                    # 添加到樹狀視圖；網址欄只保存影片 ID，下載時再組回網址
+                    total_videos = 0
+                    rows = []
                     for idx, entry in enumerate(info['entries'], 1):
-                        if entry:
-                            title = entry.get('title', f'影片 {idx}')
-                            duration = entry.get('duration', 0)
-                            duration_str = f"{int(duration // 60)}:{int(duration % 60):02d}" if duration else "未知"
-                            video_url = entry.get('url', '') or f"https://www.youtube.com/watch?v={entry.get('id', '')}"
-                            
-                            self.root.after(0, lambda t=title, d=duration_str, u=video_url: 
-                                          self.playlist_tree.insert("", tk.END, values=(t, d, u), tags=('unchecked',)))
+                        if not entry:
+                            continue
+                        title = entry.get('title') or f'影片 {idx}'
+                        duration = entry.get('duration', 0)
+                        duration_str = f"{int(duration // 60)}:{int(duration % 60):02d}" if duration else "未知"
+                        rows.append((title, duration_str, entry.get('id') or entry.get('url', ''), idx))
+                        total_videos += 1
+                        if len(rows) >= PLAYLIST_INSERT_CHUNK:
+                            self.root.after(0, lambda r=rows: self._insert_playlist_rows(r))
+                            rows = []
+                    if rows:
+                        self.root.after(0, lambda r=rows: self._insert_playlist_rows(r))
+                    
+                    self.log(f"共 {total_videos} 個影片")
                     
                     # 顯示播放清單框架
                     self.root.after(0, self.playlist_frame.grid)
@@ -575,6 +692,11 @@ class YouTubeDownloaderGUI:
         finally:
             self.root.after(0, lambda: self.fetch_playlist_btn.config(state=tk.NORMAL))
     
+    def _insert_playlist_rows(self, rows):
+        """在主執行緒中插入一批播放清單項目"""
+        for values in rows:
+            self.playlist_tree.insert("", tk.END, values=values, tags=('unchecked',))
+    
     def select_all_playlist(self):
         """全選播放清單項目"""
         for item in self.playlist_tree.get_children():
@@ -604,19 +726,25 @@ class YouTubeDownloaderGUI:
         
         # 如果是點擊按鈕，開始下載
         if not selected:
-            # 取得所有已勾選的項目
+            # 取得所有已勾選的項目與其在清單中的編號
+            items = self.playlist_tree.get_children()
             checked_items = []
-            for item in self.playlist_tree.get_children():
+            for item in items:
                 if 'checked' in self.playlist_tree.item(item)['tags']:
-                    values = self.playlist_tree.item(item)['values']
-                    checked_items.append(values[2])  # URL
+                    # 以 set() 取值，避免全數字的影片 ID 被 Tcl 轉成整數
+                    checked_items.append((int(self.playlist_tree.set(item, "index")), self.playlist_tree.set(item, "url")))
             
             if not checked_items:
                 messagebox.showwarning("警告", "請先選擇要下載的項目！")
                 return
             
+            width = index_width(len(items)) if self.number_playlist.get() else None
+            if self.is_downloading:
+                messagebox.showwarning("警告", "已有下載任務正在進行！")
+                return
+            
             self.log(f"準備下載 {len(checked_items)} 個項目...")
-            threading.Thread(target=self._download_playlist_thread, args=(checked_items,), daemon=True).start()
+            self._start_job(self._download_playlist_thread, (checked_items, width), bulk=True)
     
     # 綁定點擊事件
     def on_playlist_click(self, event):
@@ -632,34 +760,95 @@ class YouTubeDownloaderGUI:
                     self.playlist_tree.item(i, tags=('checked',))
                     self.playlist_tree.item(i, text="✓")
     
-    def _download_playlist_thread(self, urls):
-        """下載播放清單的執行緒函數"""
-        self.is_downloading = True
-        self.root.after(0, lambda: self.download_btn.config(state=tk.DISABLED))
-        
-        success_count = 0
+    def _download_playlist_thread(self, video_refs, width=None):
+        """
+        下載播放清單的執行緒函數（video_refs 為 (清單編號, 影片 ID 或網址)）
+        選取的項目依清單順序切成多段，由數條工作執行緒平行處理；
+        width 不為 None 時檔名加上清單編號，完成順序不影響檔名排序。
+        """
+        control = self.job_control
+        
+        # 在啟動工作執行緒前建立共用的轉檔池與磁碟預算，避免各執行緒同時建立
+        if self.download_type.get() == "audio":
+            self.get_transcode_pool()
+            if self.normalize_loudness.get():
+                self.get_loudness_normalizer()
+        self.get_disk_budget()
+        
+        prefixes = {}
+        for index, ref in video_refs:
+            url = ref if '/' in ref else canonical_url(KIND_VIDEO, ref)
+            prefixes[url] = numbered_prefix(index, width) if width else ''
+        urls = list(prefixes)
         total = len(urls)
-        
-        for idx, url in enumerate(urls, 1):
+        lock = threading.Lock()
+        counts = {'done': 0, 'succeeded': 0}
+        failures = {}
+        
+        def attempt(url):
+            # 暫停時不開始新的項目
+            if control.wait_if_paused():
+                return DownloadCancelled("下載已取消")
             self.log(f"\n{'='*50}")
-            self.log(f"下載進度: {idx}/{total}")
+            self.log(f"下載: {url}")
             self.log(f"{'='*50}")
-            
-            if self._download_single(url):
-                success_count += 1
-            
+            # 不等待轉檔，下一個下載可以和轉檔同時進行
+            if self._download_single(url, wait=False, name_prefix=prefixes[url], priority=PRIORITY_BULK):
+                return None
+            return self.last_error or Exception("下載失敗")
+        
+        def on_done(url, success, _):
+            if success:
+                self.partial_titles.pop(url, None)
+            elif not control.cancelled:
+                self._discard_partials(url)
+            with lock:
+                counts['done'] += 1
+                counts['succeeded'] += success
+                done = counts['done']
             # 更新整體進度
-            overall_progress = (idx / total) * 100
+            overall_progress = (done / total) * 100
+            self.log(f"下載進度: {done}/{total}")
+            if self.transcode_pool:
+                self.log(self.transcode_pool.describe())
             self.root.after(0, lambda p=overall_progress: self.progress_var.set(p))
         
-        self.log(f"\n批次下載完成！成功: {success_count}/{total}")
-        self.is_downloading = False
-        self.root.after(0, lambda: self.download_btn.config(state=tk.NORMAL))
-        self.root.after(0, lambda: self.progress_label.config(text="下載完成！"))
+        def process_shard(shard):
+            start, end = shard
+            # 暫時性錯誤會排到這一段的尾端重試，不會卡住其他項目
+            batch = RetryBatch(self.retry_policy, log=self.log, sleep=control.sleep, keep_results=False,
+                               max_pending=PENDING_LIMIT, cancelled=lambda: control.cancelled)
+            # 轉檔與完整性檢查完成後才算完成，失敗時重新排入這一段
+            self._thread_state.defer_result = batch.defer
+            try:
+                batch.run(urls[start - 1:end], attempt, on_done)
+            finally:
+                self._thread_state.defer_result = None
+            with lock:
+                for label, count in batch.summary().items():
+                    failures[label] = failures.get(label, 0) + count
+        
+        shards = shard_ranges(total, DEFAULT_SHARD_SIZE)
+        if len(shards) > 1:
+            self.log(f"分成 {len(shards)} 段，{min(DEFAULT_SHARD_WORKERS, len(shards))} 個工作執行緒同時下載")
+        run_sharded(shards, process_shard, DEFAULT_SHARD_WORKERS, log=self.log)
+        
+        if self.transcode_pool:
+            self.log("等待轉檔完成...")
+            self.root.after(0, lambda: self.progress_label.config(text="等待轉檔完成..."))
+            self.transcode_pool.wait()
+            self.log(self.transcode_pool.describe())
+        
+        self.log(f"\n批次下載完成！成功: {counts['succeeded']}/{total}")
+        for label, count in failures.items():
+            self.log(f"  {label}: {count}")
+        self._end_job(urls)
+        self.root.after(0, lambda: self.progress_label.config(text="已取消" if control.cancelled else "下載完成！"))
     
     def start_download(self):
-        """開始下載"""
-        if self.is_downloading:
+        """開始下載；播放清單下載中時，單一下載插隊優先進行"""
+        interactive = self.is_downloading and self.job_is_bulk and not self.interactive_running
+        if self.is_downloading and not interactive:
             messagebox.showwarning("警告", "已有下載任務正在進行！")
             return
         
@@ -672,66 +861,371 @@ class YouTubeDownloaderGUI:
             messagebox.showerror("錯誤", "無效的 YouTube 網址！")
             return
         
+        if interactive:
+            self.log(f"⏩ 播放清單下載中，優先下載: {url}（{self.scheduler.describe()}）")
+            self.interactive_running = True
+            threading.Thread(target=self._interactive_thread, args=(url,), daemon=True).start()
+            return
+        
         self.log(f"開始下載: {url}")
         self.download_btn.config(state=tk.DISABLED)
         self.progress_var.set(0)
         
         # 在新執行緒中下載
-        threading.Thread(target=self._download_thread, args=(url,), daemon=True).start()
+        self._start_job(self._download_thread, (url,))
     
-    def _download_thread(self, url):
-        """下載執行緒"""
+    def _start_job(self, target, args, bulk=False):
+        """建立新的工作控制，並在背景執行緒中開始下載（bulk 為播放清單等批次工作）"""
         self.is_downloading = True
-        success = self._download_single(url)
+        self.job_is_bulk = bulk
+        self.job_control = JobControl()
+        self.pause_btn.config(state=tk.NORMAL, text="暫停")
+        self.cancel_btn.config(state=tk.NORMAL)
+        self.download_thread = threading.Thread(target=target, args=args, daemon=True)
+        self.download_thread.start()
+    
+    def _end_job(self, urls):
+        """
+        工作結束（在下載執行緒中呼叫）：取消時依使用者的選擇保留或刪除中間檔。
+        保留的 .part 檔在下次下載同一個影片時由 yt-dlp 從中斷的位元組繼續。
+        """
+        control = self.job_control
+        if control.cancelled:
+            if control.discard:
+                for url in urls:
+                    self._discard_partials(url)
+                self.log("⏹ 下載已取消，已清除中間檔")
+            else:
+                kept = sum(1 for url in urls if url in self.partial_titles)
+                self.log(f"⏹ 下載已取消，保留 {kept} 個項目的中間檔，重新下載時會從中斷處繼續")
+        if self.cookie_cache is not None and self.browser_choice.get() == self.cookie_cache.browser:
+            self.log(self.cookie_cache.describe())
         self.is_downloading = False
-        
+        self.root.after(0, lambda: self.pause_btn.config(state=tk.DISABLED, text="暫停"))
+        self.root.after(0, lambda: self.cancel_btn.config(state=tk.DISABLED))
         self.root.after(0, lambda: self.download_btn.config(state=tk.NORMAL))
+    
+    def on_reserved_slots_change(self, *args):
+        """調整單一下載的保留名額（立即生效）"""
+        try:
+            reserved = int(self.reserved_slots.get())
+        except ValueError:
+            return
+        self.scheduler.set_reserved(reserved)
+    
+    def _current_control(self):
+        """目前執行緒的工作控制：插隊的單一下載有自己的控制，不受批次的暫停影響"""
+        return getattr(self._thread_state, 'job_control', None) or self.job_control
+    
+    def _download_slot(self):
+        """
+        yt-dlp 下載期間佔用的下載名額（依 _download_single 設定的優先順序）；
+        等待名額時工作被取消會拋出 DownloadCancelled。
+        """
+        control = self._current_control()
+        priority = getattr(self._thread_state, 'priority', PRIORITY_INTERACTIVE)
+        return self.scheduler.slot(priority, cancelled=lambda: control is not None and control.cancelled)
+    
+    def _apply_cookies(self, ydl):
+        """
+        把選定瀏覽器的 Cookies 放進 YoutubeDL（取代 cookiesfrombrowser，瀏覽器只在快取過期時讀取）。
+        Safari 在 macOS 上沒有權限時提示一次，並改為不使用 cookies。
+        """
+        browser = self.browser_choice.get()
+        if browser == "none":
+            return
+        with self._cookie_lock:
+            if self.cookie_cache is None or self.cookie_cache.browser != browser:
+                if self.cookie_cache is not None:
+                    self.cookie_cache.close()
+                self.cookie_cache = CookieCache(browser, log=self.log)
+            cache = self.cookie_cache
+        try:
+            cache.apply(ydl)
+        except Exception as cookie_error:
+            # Safari 在 macOS 上可能有權限問題
+            if browser != "safari" or platform.system() != "Darwin":
+                raise
+            if self._cookie_warned is cookie_error:
+                return
+            self._cookie_warned = cookie_error
+            self.log(f"⚠ Safari Cookies 讀取失敗: {str(cookie_error)}")
+            self.log("💡 Safari 需要完全磁碟存取權限")
+            self.log("請改用 Chrome 或 Firefox，或按照以下步驟授予權限：")
+            self.log("1. 系統偏好設定 > 安全性與隱私 > 隱私權")
+            self.log("2. 選擇「完全磁碟取用權限」")
+            self.log("3. 點擊 + 並添加終端機或此應用程式")
+            self.root.after(0, lambda: messagebox.showwarning(
+                "Safari 權限問題",
+                "無法讀取 Safari 的 Cookies！\n\n" +
+                "macOS 的 Safari 需要「完全磁碟取用權限」。\n\n" +
+                "建議：\n" +
+                "• 改用 Chrome 或 Firefox（推薦）\n" +
+                "• 或授予權限：\n" +
+                "  系統偏好設定 > 安全性與隱私 > 隱私權 >\n" +
+                "  完全磁碟取用權限 > 添加終端機"
+            ))
+    
+    def _invalidate_cookies(self):
+        """YouTube 仍要求驗證時捨棄 Cookies 快取，下一次下載重新讀取瀏覽器（例如重新登入之後）"""
+        if self.cookie_cache is not None:
+            self.cookie_cache.invalidate()
+            self.log("🍪 已捨棄 Cookies 快取，下一次下載會重新讀取瀏覽器")
+    
+    def _interactive_thread(self, url):
+        """播放清單下載中插隊的單一下載（暫停／取消按鈕只控制播放清單）"""
+        self._thread_state.job_control = JobControl()
+        batch = RetryBatch(self.retry_policy, log=self.log)
+        succeeded, _ = batch.run(
+            [url], lambda u: None if self._download_single(u) else (self.last_error or Exception("下載失敗"))
+        )
+        if succeeded:
+            self.partial_titles.pop(url, None)
+            self.root.after(0, lambda: messagebox.showinfo("成功", f"優先下載完成！\n{url}"))
+        else:
+            self._discard_partials(url)
+            self.root.after(0, lambda: messagebox.showerror("錯誤", f"優先下載失敗！\n{url}"))
+        self.interactive_running = False
+    
+    def toggle_pause(self):
+        """暫停或繼續目前的下載（進行中的下載停在下一次進度回報，連線保持開啟）"""
+        control = self.job_control
+        if control is None or control.cancelled:
+            return
+        if control.paused:
+            control.resume()
+            self.pause_btn.config(text="暫停")
+            self.log("▶ 繼續下載")
+        else:
+            control.pause()
+            self.pause_btn.config(text="繼續")
+            self.log("⏸ 已暫停（轉檔中的項目會繼續完成）")
+    
+    def cancel_download(self):
+        """取消目前的下載，並詢問是否保留中間檔以便之後續傳"""
+        control = self.job_control
+        if control is None or control.cancelled:
+            return
+        answer = messagebox.askyesnocancel(
+            "取消下載",
+            "要保留已下載的部分嗎？\n\n" +
+            "是：保留中間檔，之後重新下載會從中斷處繼續\n" +
+            "否：刪除中間檔"
+        )
+        if answer is None:
+            return
+        control.cancel(discard=not answer)
+        self.pause_btn.config(state=tk.DISABLED, text="暫停")
+        self.cancel_btn.config(state=tk.DISABLED)
+        self.log("⏹ 正在取消下載...")
+    
+    def show_history(self):
+        """下載紀錄視窗：以標題、影片 ID 或網址搜尋，依結果篩選，每頁 50 筆"""
+        if self.history is None:
+            messagebox.showerror("錯誤", "無法開啟下載紀錄資料庫")
+            return
+        
+        window = tk.Toplevel(self.root)
+        window.title("下載紀錄")
+        window.geometry("900x500")
+        
+        search_frame = ttk.Frame(window, padding="10")
+        search_frame.pack(fill=tk.X)
+        ttk.Label(search_frame, text="搜尋（標題／影片 ID／網址）:").pack(side=tk.LEFT, padx=5)
+        query_entry = ttk.Entry(search_frame, width=40)
+        query_entry.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+        status_names = {label: status for status, label in STATUS_LABELS.items()}
+        status_choice = tk.StringVar(value="全部")
+        ttk.Combobox(
+            search_frame, textvariable=status_choice, state="readonly", width=8,
+            values=["全部"] + list(status_names)
+        ).pack(side=tk.LEFT, padx=5)
+        
+        columns = ("finished", "status", "title", "quality", "video_id", "url")
+        tree = ttk.Treeview(window, columns=columns, show="headings")
+        tree.heading("finished", text="時間")
+        tree.heading("status", text="結果")
+        tree.heading("title", text="標題")
+        tree.heading("quality", text="品質")
+        tree.heading("video_id", text="影片 ID")
+        tree.column("finished", width=130)
+        tree.column("status", width=60)
+        tree.column("title", width=420)
+        tree.column("quality", width=90)
+        tree.column("video_id", width=110)
+        tree.column("url", width=0, stretch=False)
+        tree.pack(fill=tk.BOTH, expand=True, padx=10)
+        
+        nav_frame = ttk.Frame(window, padding="10")
+        nav_frame.pack(fill=tk.X)
+        prev_btn = ttk.Button(nav_frame, text="上一頁")
+        prev_btn.pack(side=tk.LEFT, padx=5)
+        next_btn = ttk.Button(nav_frame, text="下一頁")
+        next_btn.pack(side=tk.LEFT, padx=5)
+        page_label = ttk.Label(nav_frame, text="")
+        page_label.pack(side=tk.LEFT, padx=10)
+        ttk.Label(nav_frame, text="按兩下項目可填入網址重新下載").pack(side=tk.RIGHT, padx=5)
+        
+        # 每一頁的起點（上一頁最後一筆的 id），第一頁為 None
+        pages = [None]
+        
+        def load(page):
+            query = query_entry.get().strip()
+            filters = {'status': status_names.get(status_choice.get())}
+            video_id = extract_video_id(query) or (query if re.fullmatch(r'[0-9A-Za-z_-]{11}', query) else None)
+            started = time.perf_counter()
+            rows = []
+            if video_id:
+                rows = self.history.search(video_id=video_id, before=pages[page], **filters)
+            if not rows and query and not extract_video_id(query):
+                rows = self.history.search(query=query, before=pages[page], **filters)
+            elapsed = (time.perf_counter() - started) * 1000
+            
+            del pages[page + 1:]
+            if len(rows) == DEFAULT_PAGE_SIZE:
+                pages.append(rows[-1]['id'])
+            
+            tree.delete(*tree.get_children())
+            for row in rows:
+                tree.insert("", tk.END, values=(
+                    datetime.fromtimestamp(row['finished']).strftime('%Y-%m-%d %H:%M'),
+                    STATUS_LABELS.get(row['status'], row['status']),
+                    row['title'] or "",
+                    row['quality'] or "",
+                    row['video_id'] or "",
+                    row['url'] or "",
+                ))
+            page_label.config(text=f"第 {page + 1} 頁 | {len(rows)} 筆 | 查詢 {elapsed:.1f} ms")
+            prev_btn.config(state=tk.NORMAL if page > 0 else tk.DISABLED,
+                            command=lambda: load(page - 1))
+            next_btn.config(state=tk.NORMAL if len(pages) > page + 1 else tk.DISABLED,
+                            command=lambda: load(page + 1))
+        
+        def use_url(event):
+            selection = tree.selection()
+            if selection:
+                url = tree.item(selection[0])['values'][5]
+                self.url_entry.delete(0, tk.END)
+                self.url_entry.insert(0, url)
+        
+        ttk.Button(search_frame, text="搜尋", command=lambda: load(0)).pack(side=tk.LEFT, padx=5)
+        query_entry.bind("<Return>", lambda event: load(0))
+        status_choice.trace('w', lambda *args: load(0))
+        tree.bind("<Double-1>", use_url)
+        load(0)
+    
+    def on_close(self):
+        """關閉視窗：下載中時先取消（保留中間檔）並等待下載執行緒結束"""
+        if self.is_downloading and self.job_control is not None:
+            if not messagebox.askokcancel("結束", "下載仍在進行，要取消並結束嗎？\n已下載的部分會保留，下次可以續傳。"):
+                return
+            self.job_control.cancel(discard=False)
+            if self.download_thread is not None:
+                self.download_thread.join(timeout=10)
+        dl_http.close()
+        if self.cookie_cache is not None:
+            self.cookie_cache.close()
+        if self.history is not None:
+            self.history.close()
+        self.root.destroy()
+    
+    def _download_thread(self, url):
+        """下載執行緒"""
+        control = self.job_control
+        batch = RetryBatch(self.retry_policy, log=self.log, sleep=control.sleep,
+                           cancelled=lambda: control.cancelled)
+        succeeded, failed = batch.run(
+            [url], lambda u: None if self._download_single(u) else (self.last_error or Exception("下載失敗"))
+        )
+        success = bool(succeeded)
+        if success:
+            self.partial_titles.pop(url, None)
+        elif not control.cancelled:
+            self._discard_partials(url)
+        self._end_job([url])
         
         if success:
             self.root.after(0, lambda: messagebox.showinfo("成功", "下載完成！"))
-        else:
+        elif not control.cancelled:
             self.root.after(0, lambda: messagebox.showerror("錯誤", "下載失敗！"))
     
-    def _download_single(self, url):
-        """下載單一影片/音訊"""
+    def _download_single(self, url, wait=True, name_prefix='', priority=PRIORITY_INTERACTIVE):
+        """
+        下載單一影片/音訊（wait=False 時不等待音訊轉檔完成）
+        name_prefix 會加在輸出檔名前（播放清單編號），儲存庫中仍以原標題保存。
+        priority 決定取得下載名額的順序；每次嘗試的結果都寫入下載紀錄。
+        """
+        started = time.time()
+        self._thread_state.history_entry = None
+        self._thread_state.history_started = started
+        # 交給轉檔池且結果延後的項目，由轉檔完成時的回調寫入紀錄
+        self._thread_state.history_deferred = False
+        video_id = extract_video_id(url)
+        if self.history is not None and video_id:
+            previous = self.history.last_success(video_id)
+            if previous:
+                when = datetime.fromtimestamp(previous['finished']).strftime('%Y-%m-%d %H:%M')
+                self.log(f"ℹ 此影片曾於 {when} 下載過: {previous['title']}")
+        
+        # 名額只在 yt-dlp 下載期間佔用（_download_slot），解析、轉檔與完整性檢查不佔名額
+        self._thread_state.priority = priority
+        success = self._fetch_single(url, wait, name_prefix)
+        if not (success and self._thread_state.history_deferred):
+            self._record_history(url, started, success)
+        return success
+    
+    def _record_history(self, url, started, success, error=None, entry=None):
+        """
+        將一次下載嘗試寫入下載紀錄。
+        error／entry 未指定時使用目前執行緒最近的錯誤與影片資訊（轉檔池的回調在其他執行緒中呼叫時需指定）。
+        """
+        if self.history is None:
+            return
+        if error is None and not success:
+            error = self.last_error
+        video_id, title, cached = entry or self._thread_state.history_entry or (extract_video_id(url), None, False)
+        if success:
+            status = STATUS_CACHED if cached else STATUS_DONE
+        elif error is not None and classify_error(error) == ERROR_CANCELLED:
+            status = STATUS_CANCELLED
+        else:
+            status = STATUS_FAILED
+        if self.download_type.get() == "audio":
+            quality = ",".join(MULTI_BITRATE_QUALITIES) if self.multi_bitrate.get() else self.audio_quality.get()
+        else:
+            quality = self.video_quality.get()
+        error = str(error) if not success and error is not None else None
         try:
-            # 取得影片資訊時也使用 cookies
-            info_opts = {'quiet': True, 'nocheckcertificate': True}
+            self.history.record(video_id, title, url, self.download_type.get(), quality, status, started, error)
+        except sqlite3.Error as e:
+            self.log(f"⚠ 寫入下載紀錄失敗: {str(e)}")
+    
+    def _fetch_single(self, url, wait=True, name_prefix=''):
+        """取得影片資訊並下載（由 _download_single 呼叫）"""
+        self.last_error = None
+        browser = self.browser_choice.get()
+        try:
+            # 先查本機儲存庫，命中時不需要任何網路請求
+            if self._restore_from_store(url, name_prefix):
+                return True
             
-            browser = self.browser_choice.get()
-            if browser != "none":
-                try:
-                    info_opts['cookiesfrombrowser'] = (browser,)
-                    self.log(f"使用 {browser.capitalize()} 瀏覽器的 Cookies")
-                except Exception as cookie_error:
-                    # Safari 在 macOS 上可能有權限問題
-                    if browser == "safari" and platform.system() == "Darwin":
-                        self.log(f"⚠ Safari Cookies 讀取失敗: {str(cookie_error)}")
-                        self.log("💡 Safari 需要完全磁碟存取權限")
-                        self.log("請改用 Chrome 或 Firefox，或按照以下步驟授予權限：")
-                        self.log("1. 系統偏好設定 > 安全性與隱私 > 隱私權")
-                        self.log("2. 選擇「完全磁碟取用權限」")
-                        self.log("3. 點擊 + 並添加終端機或此應用程式")
-                        self.root.after(0, lambda: messagebox.showwarning(
-                            "Safari 權限問題",
-                            "無法讀取 Safari 的 Cookies！\n\n" +
-                            "macOS 的 Safari 需要「完全磁碟取用權限」。\n\n" +
-                            "建議：\n" +
-                            "• 改用 Chrome 或 Firefox（推薦）\n" +
-                            "• 或授予權限：\n" +
-                            "  系統偏好設定 > 安全性與隱私 > 隱私權 >\n" +
-                            "  完全磁碟取用權限 > 添加終端機"
-                        ))
-                        # 移除 cookies 設定，嘗試不使用 cookies
-                        info_opts.pop('cookiesfrombrowser', None)
-                    else:
-                        raise
+            # 取得影片資訊時也使用 cookies（在 YoutubeDL 建立後由快取放入）
+            info_opts = {'quiet': True, 'nocheckcertificate': True}
             
-            # 取得影片資訊
+            # 取得影片資訊（使用實際要下載的格式，讓檔案大小估計準確）
+            if self.download_type.get() == "audio":
+                info_opts['format'] = AUDIO_FORMAT
+            else:
+                info_opts['format'] = VIDEO_FORMATS.get(self.video_quality.get(), VIDEO_FORMATS["best"])
+            started = time.monotonic()
             with yt_dlp.YoutubeDL(info_opts) as ydl:
+                self._apply_cookies(ydl)
                 info = ydl.extract_info(url, download=False)
-                title = self.sanitize_filename(info.get('title', 'download'))
+                METRICS.extract_seconds.observe(time.monotonic() - started)
+                store_title = self.sanitize_filename(info.get('title', 'download'))
+                title = name_prefix + store_title
                 self.total_duration = info.get('duration', 0)
+                self._thread_state.history_entry = (info.get('id'), title, False)
             
             self.log(f"標題: {title}")
             if self.total_duration > 0:
@@ -740,13 +1234,14 @@ class YouTubeDownloaderGUI:
             
             # 根據下載類型設定選項
             if self.download_type.get() == "audio":
-                success = self._download_audio(url, title)
+                success = self._download_audio(url, title, wait, info, store_title)
             else:
-                success = self._download_video(url, title)
+                success = self._download_video(url, title, info, store_title)
             
             return success
             
         except Exception as e:
+            self.last_error = e
             error_msg = str(e)
             self.log(f"✗ 下載失敗: {error_msg}")
             
@@ -776,6 +1271,7 @@ class YouTubeDownloaderGUI:
                         "這樣可以使用您的登入狀態繞過機器人驗證。"
                     ))
                 else:
+                    self._invalidate_cookies()
                     self.log(f"⚠ 已選擇 {browser.capitalize()} 但仍失敗")
                     self.log("💡 可能的原因：")
                     self.log(f"1. {browser.capitalize()} 瀏覽器未登入 YouTube")
@@ -804,9 +1300,15 @@ class YouTubeDownloaderGUI:
             traceback.print_exc()
             return False
     
-    def _download_audio(self, url, title):
-        """下載音訊"""
+    def _download_audio(self, url, title, wait=True, info=None, store_title=None):
+        """下載音訊，下載完成後交給轉檔池轉為 MP3（磁碟預留量在轉檔完成後歸還）"""
         quality = self.audio_quality.get()
+        qualities = MULTI_BITRATE_QUALITIES if self.multi_bitrate.get() else [quality]
+        tracker = METRICS.track_download(AUDIO_FORMAT, ",".join(qualities))
+        budget = self.get_disk_budget()
+        disk_bytes = estimate_job_bytes(info or {}, qualities)
+        reserved = False
+        handed_off = False
         
         # 設定 FFmpeg 路徑
         ffmpeg_location = None
@@ -819,53 +1321,267 @@ class YouTubeDownloaderGUI:
                 ffmpeg_location = None
         
         ydl_opts = {
-            'format': 'bestaudio/best',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': quality,
-            }],
+            'format': AUDIO_FORMAT,
             'outtmpl': os.path.join(self.output_dir, f'{title}.%(ext)s'),
             'quiet': True,
             'no_warnings': True,
-            'progress_hooks': [self.progress_hook],
+            'progress_hooks': [self.progress_hook, tracker.on_progress, self.throughput.on_progress],
             'postprocessor_hooks': [self.postprocessor_hook],
             'ffmpeg_location': ffmpeg_location,
             'nocheckcertificate': True,  # 跳過 SSL 憑證驗證
         }
         
-        # 添加 cookies 支援
-        browser = self.browser_choice.get()
-        if browser != "none":
-            ydl_opts['cookiesfrombrowser'] = (browser,)
-            self.log(f"使用 {browser.capitalize()} 瀏覽器的 Cookies")
-        
         try:
+            budget.acquire(disk_bytes)
+            reserved = True
             self.root.after(0, lambda: self.progress_label.config(text="正在下載..."))
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
+            if self.stream_audio.get() and streamable(info):
+                stream_filter = self._stream_filter(info.get('id'))
+                if stream_filter is not False:
+                    return self._stream_audio(url, title, info, qualities, tracker, ydl_opts, stream_filter, store_title)
             
+            try:
+                with self._download_slot(), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                    self._apply_cookies(ydl)
+                    info_dict = ydl.extract_info(url, download=True)
+                    source_file = self._downloaded_path(ydl, info_dict)
+            except Exception:
+                METRICS.downloads.inc(labels=tracker.labels + ('failed',))
+                raise
+            finally:
+                tracker.flush()
+            METRICS.downloads.inc(labels=tracker.labels + ('success',))
+            
+            # 交給轉檔池，轉檔不佔用下載執行緒
+            pool = self.get_transcode_pool()
+            targets = quality_outputs(self.output_dir, title, qualities)
+            target_qualities = dict(targets)
+            video_id = info_dict.get('id')
+            store_format = self._audio_store_format()
+            audio_filter = None
+            if self.normalize_loudness.get():
+                # 量測在轉檔執行緒中進行，已量測過的影片直接使用快取
+                normalizer = self.get_loudness_normalizer()
+                audio_filter = lambda source: normalizer.filter_for(video_id, source)
+            duration = info_dict.get('duration')
+            future = pool.submit_multi(
+                source_file, targets,
+                on_done=lambda out, err: self._on_transcoded(
+                    out, err, video_id, target_qualities[out], store_format, store_title
+                ),
+                audio_filter=audio_filter,
+                verify=lambda path: verify_media(path, duration, self.ffmpeg_path)
+            )
+            future.add_done_callback(lambda f: budget.release(disk_bytes))
+            handed_off = True
+            defer_result = getattr(self._thread_state, 'defer_result', None)
+            if not wait and defer_result is not None:
+                # 轉檔或完整性檢查失敗時，批次會依錯誤分類重新下載；紀錄等到結果確定才寫入
+                settle = defer_result(url)
+                entry = self._thread_state.history_entry
+                started = self._thread_state.history_started
+                self._thread_state.history_deferred = True
+                
+                def finish(f):
+                    error = f.exception()
+                    self._record_history(url, started, error is None, error, entry)
+                    settle(error)
+                future.add_done_callback(finish)
+            self.log(pool.describe())
+            
+            if not wait:
+                self.log(f"✓ 下載完成，已排入轉檔佇列: {title}")
+                return True
+            
+            self.root.after(0, lambda: self.progress_label.config(text="正在轉換格式..."))
+            future.result()
             self.log(f"✓ 下載完成: {title}.mp3")
             return True
             
         except Exception as e:
+            self.last_error = e
             self.log(f"✗ 下載失敗: {str(e)}")
             if "bot" in str(e).lower() or "sign in" in str(e).lower():
                 self.log("💡 提示：請在 Cookies 設定中選擇您的瀏覽器以解決機器人驗證問題")
+            self._keep_or_remove_partials(url, title, e)
+            return False
+        finally:
+            if reserved and not handed_off:
+                budget.release(disk_bytes)
+    
+    def _stream_filter(self, video_id):
+        """
+        串流模式使用的音訊濾鏡：未開啟標準化時為 None；
+        標準化需要量測完整來源檔，沒有快取的量測結果時回傳 False（改用一般模式）
+        """
+        if not self.normalize_loudness.get():
+            return None
+        measurement = self.get_loudness_normalizer().cache.get(video_id) if video_id else None
+        if measurement is None:
+            self.log("⚠ 音量標準化需要先量測完整的來源檔，本次不使用串流轉檔")
+            return False
+        return loudnorm_filter(measurement)
+    
+    def _stream_audio(self, url, title, info, qualities, tracker, ydl_opts, audio_filter, store_title):
+        """串流轉檔：下載的資料直接送進 FFmpeg，MP3 在最後一個位元組到達時即完成"""
+        pool = self.get_transcode_pool()
+        targets = quality_outputs(self.output_dir, title, qualities)
+        self.log(f"串流轉檔: 邊下載邊轉為 MP3（{pool.encoder}），不保存來源檔")
+        try:
+            stream_opts = {key: ydl_opts[key] for key in ('quiet', 'no_warnings', 'nocheckcertificate') if key in ydl_opts}
+            with self._download_slot(), yt_dlp.YoutubeDL(stream_opts) as ydl:
+                self._apply_cookies(ydl)
+                stream_to_mp3(ydl, info, targets, self.ffmpeg_path, pool.encoder, audio_filter=audio_filter,
+                              progress_hooks=ydl_opts['progress_hooks'])
+            self._verify_outputs([output for output, _ in targets], info)
+        except Exception:
+            METRICS.downloads.inc(labels=tracker.labels + ('failed',))
+            raise
+        finally:
+            tracker.flush()
+        METRICS.downloads.inc(labels=tracker.labels + ('success',))
+        
+        for output, quality in targets:
+            self._save_to_store(output, info.get('id'), self._audio_store_format(), quality, store_title)
+        self.log(f"✓ 下載完成: {title}.mp3")
+        return True
+    
+    def _verify_outputs(self, outputs, info):
+        """檢查輸出檔的容器與長度；不完整時刪除所有輸出檔並拋出 IntegrityError（重試時重新下載）"""
+        try:
+            for output in outputs:
+                verify_media(output, info.get('duration'), self.ffmpeg_path)
+        except IntegrityError:
+            for output in outputs:
+                if os.path.exists(output):
+                    os.remove(output)
+            raise
+    
+    def _keep_or_remove_partials(self, url, title, error):
+        """
+        暫時性錯誤保留中間檔讓重試時續傳；空間不足或不會重試的錯誤立即清除。
+        使用者取消時先保留，工作結束後再依取消時的選擇處理。
+        """
+        self.partial_titles[url] = title
+        category = classify_error(error)
+        if category == ERROR_CANCELLED:
+            return
+        if category == ERROR_DISK or not self.retry_policy.should_retry(category, 1):
+            self._discard_partials(url)
+    
+    def _discard_partials(self, url):
+        """刪除下載失敗留下的中間檔（放棄重試時呼叫）"""
+        title = self.partial_titles.pop(url, None)
+        if title:
+            freed = remove_partials(self.output_dir, title)
+            if freed:
+                self.log(f"已清除中間檔 {freed / 1024 / 1024:.1f} MB: {title}")
+    
+    def _on_transcoded(self, output_file, error, video_id, quality, store_format=AUDIO_FORMAT, store_title=None):
+        """轉檔池完成回調（在轉檔執行緒中執行）"""
+        if error is not None:
+            self.log(f"✗ 轉檔失敗: {os.path.basename(output_file)} - {str(error)}")
+        else:
+            self.log(f"✓ 轉檔完成: {os.path.basename(output_file)}")
+            self._save_to_store(output_file, video_id, store_format, quality, store_title)
+    
+    def _downloaded_path(self, ydl, info_dict):
+        """取得 yt-dlp 實際寫入的檔案路徑"""
+        downloads = info_dict.get('requested_downloads') or []
+        if downloads and downloads[0].get('filepath'):
+            return downloads[0]['filepath']
+        return ydl.prepare_filename(info_dict)
+    
+    def get_media_store(self):
+        """取得本機媒體儲存庫（放在輸出目錄下，讓硬連結可以使用）"""
+        return MediaStore(os.path.join(self.output_dir, ".store"))
+    
+    def _restore_from_store(self, url, name_prefix=''):
+        """目前的下載設定已在儲存庫中時，直接以連結產生輸出檔，不需要網路"""
+        video_id = extract_video_id(url)
+        if not video_id:
+            return False
+        
+        store = self.get_media_store()
+        if self.download_type.get() == "audio":
+            qualities = MULTI_BITRATE_QUALITIES if self.multi_bitrate.get() else [self.audio_quality.get()]
+            entries = [store.lookup(video_id, self._audio_store_format(), q) for q in qualities]
+            if not all(entries):
+                return False
+            targets = quality_outputs(self.output_dir, name_prefix + entries[0]['title'], qualities)
+        else:
+            quality = self.video_quality.get()
+            if quality == "auto":
+                # 自動品質要依當時的頻寬決定格式，無法事先查詢
+                return False
+            entry = store.lookup(video_id, VIDEO_FORMATS.get(quality, VIDEO_FORMATS["best"]), quality)
+            if not entry:
+                return False
+            entries = [entry]
+            targets = [(os.path.join(self.output_dir, f"{name_prefix}{entry['title']}.{entry['ext']}"), quality)]
+        
+        try:
+            methods = [store.materialize(entry['path'], output) for (output, _), entry in zip(targets, entries)]
+        except OSError as e:
+            self.log(f"⚠ 從本機儲存庫取得失敗，改為重新下載: {str(e)}")
             return False
+        
+        self.log(f"✓ 已從本機儲存庫取得 ({', '.join(sorted(set(methods)))}): {name_prefix}{entries[0]['title']}")
+        self._thread_state.history_entry = (video_id, name_prefix + entries[0]['title'], True)
+        return True
     
-    def _download_video(self, url, title):
+    def _save_to_store(self, output_file, video_id, format_str, quality, title=None):
+        """將完成的檔案收進本機儲存庫（title 預設取輸出檔名）"""
+        if not video_id or not output_file or not os.path.exists(output_file):
+            return
+        try:
+            title = title or os.path.splitext(os.path.basename(output_file))[0]
+            self.get_media_store().put(output_file, video_id, format_str, quality, title)
+        except OSError as e:
+            self.log(f"⚠ 寫入本機儲存庫失敗: {str(e)}")
+    
+    def _plan_limit(self, var, scale, label):
+        """讀取規劃限制的輸入欄位：留空表示不限制，無法解析時忽略"""
+        text = var.get().strip()
+        if not text:
+            return None
+        try:
+            return float(text) * scale
+        except ValueError:
+            self.log(f"⚠ {label}「{text}」不是數字，不使用此限制")
+            return None
+    
+    def _plan_video(self, info):
+        """依量測到的頻寬與時間、大小限制選擇影片格式；格式表中沒有大小資訊時回傳 None（使用最佳品質）"""
+        planner = FormatPlanner(
+            deadline=self._plan_limit(self.plan_minutes, 60, "時限"),
+            max_bytes=self._plan_limit(self.plan_megabytes, 1024 * 1024, "大小上限"),
+            meter=self.throughput
+        )
+        plan = planner.plan(info or {}, video=True)
+        self.log(planner.describe())
+        if plan is None:
+            self.log("⚠ 格式表中沒有大小資訊，使用最佳品質")
+        else:
+            self.log(f"選擇格式: {plan.describe()}")
+        return plan
+    
+    def _download_video(self, url, title, info=None, store_title=None):
         """下載影片"""
         quality = self.video_quality.get()
         
         # 根據品質選擇格式
-        if quality == "720p":
-            format_str = 'bestvideo[height<=720]+bestaudio/best[height<=720]'
-        elif quality == "1080p":
-            format_str = 'bestvideo[height<=1080]+bestaudio/best[height<=1080]'
-        else:
-            format_str = 'bestvideo+bestaudio/best'
+        format_str = VIDEO_FORMATS.get(quality, VIDEO_FORMATS["best"])
+        plan = self._plan_video(info) if quality == "auto" else None
+        if plan is not None:
+            format_str = plan.format_id
+            quality = plan.label
+        tracker = METRICS.track_download(format_str, quality)
+        budget = self.get_disk_budget()
+        disk_bytes = estimate_job_bytes(info or {}, merge='+' in format_str,
+                                        source_bytes=plan.size if plan else None)
+        reserved = False
         
         # 設定 FFmpeg 路徑
         ffmpeg_location = None
@@ -882,43 +1598,63 @@ class YouTubeDownloaderGUI:
             'outtmpl': os.path.join(self.output_dir, f'{title}.%(ext)s'),
             'quiet': True,
             'no_warnings': True,
-            'progress_hooks': [self.progress_hook],
+            'progress_hooks': [self.progress_hook, tracker.on_progress, self.throughput.on_progress],
             'postprocessor_hooks': [self.postprocessor_hook],
             'merge_output_format': 'mp4',
             'ffmpeg_location': ffmpeg_location,
             'nocheckcertificate': True,  # 跳過 SSL 憑證驗證
         }
         
-        # 添加 cookies 支援
-        browser = self.browser_choice.get()
-        if browser != "none":
-            ydl_opts['cookiesfrombrowser'] = (browser,)
-            self.log(f"使用 {browser.capitalize()} 瀏覽器的 Cookies")
-        
         # 如果需要合併音視頻,添加後處理器
         if '+' in format_str:
             ydl_opts['postprocessors'] = [{
                 'key': 'FFmpegVideoConvertor',
                 'preferedformat': 'mp4',
             }]
+            # 需要重新編碼成 MP4 時，音訊使用這個 FFmpeg 上最好的 AAC 編碼器
+            capabilities = get_capabilities(self.ffmpeg_path)
+            aac_encoder = capabilities.best_encoder('aac') if capabilities else None
+            if aac_encoder:
+                ydl_opts['postprocessor_args'] = {'videoconvertor': ['-c:a', aac_encoder]}
         
         try:
+            budget.acquire(disk_bytes)
+            reserved = True
             self.root.after(0, lambda: self.progress_label.config(text="正在下載..."))
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
+            try:
+                with self._download_slot(), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                    self._apply_cookies(ydl)
+                    info_dict = ydl.extract_info(url, download=True)
+                    output_file = self._downloaded_path(ydl, info_dict)
+            except Exception:
+                METRICS.downloads.inc(labels=tracker.labels + ('failed',))
+                raise
+            finally:
+                tracker.flush()
+            METRICS.downloads.inc(labels=tracker.labels + ('success',))
             
+            self._save_to_store(output_file, info_dict.get('id'), format_str, quality, store_title)
             self.log(f"✓ 下載完成: {title}.mp4")
             return True
             
         except Exception as e:
+            self.last_error = e
             self.log(f"✗ 下載失敗: {str(e)}")
             if "bot" in str(e).lower() or "sign in" in str(e).lower():
                 self.log("💡 提示：請在 Cookies 設定中選擇您的瀏覽器以解決機器人驗證問題")
+            self._keep_or_remove_partials(url, title, e)
             return False
+        finally:
+            if reserved:
+                budget.release(disk_bytes)
     
     def progress_hook(self, d):
-        """下載進度回調"""
+        """下載進度回調（暫停時在這裡等待，取消時從這裡中斷下載）"""
+        control = self._current_control()
+        if control is not None:
+            control.checkpoint()
+        
         if d['status'] == 'downloading':
             total = d.get('total_bytes') or d.get('total_bytes_estimate')
             downloaded = d.get('downloaded_bytes', 0)
@@ -939,8 +1675,8 @@ class YouTubeDownloaderGUI:
             self.root.after(0, lambda: self.progress_label.config(text="下載完成，正在處理..."))
             self.log("✓ 檔案下載完成")
             
-            # 只有在音訊下載時才啟動轉換監控（因為需要轉換成 MP3）
-            if self.download_type.get() == "audio" and self.total_duration > 0:
+            # 只有在音訊下載時才啟動轉換監控（因為需要轉換成 MP3；串流模式下已同時轉換完成）
+            if self.download_type.get() == "audio" and self.total_duration > 0 and not d.get('streamed'):
                 threading.Thread(target=self.monitor_conversion, daemon=True).start()
     
     def postprocessor_hook(self, d):
@@ -997,23 +1733,17 @@ class YouTubeDownloaderGUI:
     
     def is_valid_youtube_url(self, url):
         """檢查是否為有效的 YouTube 網址"""
-        patterns = [
-            r'^https?://(www\.)?youtube\.com/watch\?v=',
-            r'^https?://youtu\.be/',
-            r'^https?://(www\.)?youtube\.com/embed/',
-            r'^https?://(www\.)?youtube\.com/shorts/',
-            r'^https?://(www\.)?youtube\.com/playlist\?list=',
-        ]
-        
-        for pattern in patterns:
-            if re.match(pattern, url):
-                return True
-        return False
+        return parse_youtube_url(url) is not None
 
 def main():
     """主程式"""
     root = tk.Tk()
     
+    # 設定 YTDL_METRICS_PORT 時提供 Prometheus 指標
+    metrics_port = os.environ.get("YTDL_METRICS_PORT")
+    if metrics_port:
+        start_metrics_server(int(metrics_port))
+    
     # 設定主題樣式
     style = ttk.Style()
     style.theme_use('clam')
@@ -1021,6 +1751,7 @@ def main():
     # 綁定播放清單點擊事件
     app = YouTubeDownloaderGUI(root)
     app.playlist_tree.bind('<Button-1>', app.on_playlist_click)
+    root.protocol("WM_DELETE_WINDOW", app.on_close)
     
     # 啟動主迴圈
     root.mainloop()
@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_HISTORY_PATH = os.path.join(os.path.expanduser("~"), ".youtube_download", "history.db")
+DEFAULT_PAGE_SIZE = 50
+
+# 下載結果
+STATUS_DONE = "done"
+STATUS_CACHED = "cached"        # 從本機儲存庫取得，沒有下載
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+STATUS_LABELS = {
+    STATUS_DONE: "完成",
+    STATUS_CACHED: "儲存庫",
+    STATUS_FAILED: "失敗",
+    STATUS_CANCELLED: "已取消",
+}
+
+_KEYS = ("id", "video_id", "title", "url", "kind", "quality", "status", "error", "started", "finished")
+_COLUMNS = ", ".join(_KEYS)
+
+
+class JobHistory:
+    """
+    以 SQLite 保存每一次下載的結果。
+    影片 ID、完成時間與狀態都有索引，標題則以 FTS5 trigram 全文索引（可搜尋任意位置的中文字串），
+    數十萬筆紀錄時查詢仍在毫秒內完成。紀錄在完成時寫入，id 即為時間順序；
+    分頁以上一頁最後一筆的 id 為起點，不使用 OFFSET，翻到很後面的頁數也一樣快。
+    少於三個字元的關鍵字（或 SQLite 不支援 trigram 時）改為由新到舊逐筆比對，取滿一頁即停止。
+    """
+
+    def __init__(self, db_path=DEFAULT_HISTORY_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                video_id TEXT,
+                title TEXT COLLATE NOCASE,
+                url TEXT,
+                kind TEXT,
+                quality TEXT,
+                status TEXT NOT NULL,
+                error TEXT,
+                started REAL,
+                finished REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_video ON jobs (video_id, finished);
+            CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+        """)
+        self.fulltext = self._create_fulltext()
+        self._conn.commit()
+
+    def _create_fulltext(self):
+        """建立標題的 trigram 全文索引（以觸發器與 jobs 同步）；SQLite 不支援時回傳 False"""
+        try:
+            self._conn.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS jobs_fts USING fts5(
+                    title, content='jobs', content_rowid='id', tokenize='trigram'
+                );
+                CREATE TRIGGER IF NOT EXISTS jobs_fts_insert AFTER INSERT ON jobs BEGIN
+                    INSERT INTO jobs_fts (rowid, title) VALUES (new.id, new.title);
+                END;
+                CREATE TRIGGER IF NOT EXISTS jobs_fts_delete AFTER DELETE ON jobs BEGIN
+                    INSERT INTO jobs_fts (jobs_fts, rowid, title) VALUES ('delete', old.id, old.title);
+                END;
+            """)
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    def record(self, video_id, title, url, kind, quality, status, started=None, error=None):
+        """寫入一筆下載結果，回傳紀錄 id"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (video_id, title, url, kind, quality, status, error, started, finished) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (video_id, title, url, kind, quality, status, error, started, time.time())
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def last_success(self, video_id):
+        """影片最近一次成功下載（或從儲存庫取得）的紀錄；沒有時回傳 None"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE video_id = ? AND status IN (?, ?) "
+                "ORDER BY finished DESC LIMIT 1",
+                (video_id, STATUS_DONE, STATUS_CACHED)
+            ).fetchone()
+        return dict(zip(_KEYS, row)) if row else None
+
+    def search(self, query=None, status=None, video_id=None, before=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        依寫入順序由新到舊列出紀錄。
+        query 比對標題，video_id 精確比對影片 ID，status 篩選結果；
+        before 為上一頁最後一筆的 id，取得下一頁。
+        """
+        clauses = []
+        params = []
+        source = "jobs"
+        order = "jobs.id"
+        if query and self.fulltext and len(query) >= 3:
+            # 全文索引依 rowid 由大到小產生結果，取滿一頁即停止，常見字詞也不必列出所有符合項目
+            source = "jobs_fts JOIN jobs ON jobs.id = jobs_fts.rowid"
+            order = "jobs_fts.rowid"
+            clauses.append("jobs_fts MATCH ?")
+            params.append('"' + query.replace('"', '""') + '"')
+        elif query:
+            clauses.append("title LIKE ? ESCAPE '\\'")
+            params.append('%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        if video_id:
+            clauses.append("video_id = ?")
+            params.append(video_id)
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        if before:
+            clauses.append(f"{order} < ?")
+            params.append(before)
+
+        columns = ", ".join(f"jobs.{column}" for column in _KEYS)
+        sql = f"SELECT {columns} FROM {source}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += f" ORDER BY {order} DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(zip(_KEYS, row)) for row in rows]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,238 @@
+import importlib.util
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# HTTP/2 為選用功能：安裝 httpx[http2] 後自動使用，否則使用 requests（HTTP/1.1 keep-alive）
+try:
+    import httpx
+except ImportError:
+    httpx = None
+# 只有 httpx 沒有 h2 時 http2=True 無法使用，明確改用 requests，建立用戶端時說明原因
+_fallback_reason = None
+if httpx is not None and importlib.util.find_spec("h2") is None:
+    httpx = None
+    _fallback_reason = "已安裝 httpx 但缺少 h2 套件，改用 requests（HTTP/1.1）；安裝 httpx[http2] 即可使用 HTTP/2"
+
+DEFAULT_TIMEOUT = 10
+# 縮圖、清單等輔助請求集中在少數主機（i.ytimg.com、github.com 等），
+# 每個主機保留的連線數要能容納所有轉檔執行緒同時加入封面，否則多出來的連線用完即關閉
+POOL_HOSTS = 8
+POOL_SIZE = max(16, (os.cpu_count() or 4) * 2)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# 平行範圍下載：每段大小、同時下載的段數、每段在原地重試的次數
+PARALLEL_CHUNK_SIZE = 8 * 1024 * 1024
+PARALLEL_WORKERS = 4
+RANGE_RETRIES = 3
+USER_AGENT = "Mozilla/5.0 (compatible; youtube_download)"
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class _RequestsClient:
+    """requests.Session：每個主機一個連線池，連線在請求之間保持開啟"""
+
+    def __init__(self):
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET', 'HEAD']))
+        adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def fetch(self, url, timeout):
+        response = self.session.get(url, timeout=timeout)
+        response.raise_for_status()
+        return response.content
+
+    def stream(self, url, timeout, headers=None):
+        response = self.session.get(url, timeout=timeout, stream=True, headers=headers)
+        try:
+            response.raise_for_status()
+            yield response.status_code, response.headers
+            yield from response.iter_content(DOWNLOAD_CHUNK_SIZE)
+        finally:
+            response.close()
+
+    def close(self):
+        self.session.close()
+
+
+class _HttpxClient:
+    """httpx.Client：可用時以 HTTP/2 在單一連線上多工處理同一主機的請求"""
+
+    def __init__(self):
+        # 指定 transport 時連線池設定要放在 transport 上
+        transport = httpx.HTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_connections=POOL_HOSTS * POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+        )
+        self.client = httpx.Client(transport=transport, follow_redirects=True, headers={'User-Agent': USER_AGENT})
+
+    def fetch(self, url, timeout):
+        response = self.client.get(url, timeout=timeout)
+        response.raise_for_status()
+        return response.content
+
+    def stream(self, url, timeout, headers=None):
+        with self.client.stream('GET', url, timeout=timeout, headers=headers) as response:
+            response.raise_for_status()
+            yield response.status_code, response.headers
+            yield from response.iter_bytes(DOWNLOAD_CHUNK_SIZE)
+
+    def close(self):
+        self.client.close()
+
+
+def get_client():
+    """取得共用的 HTTP 用戶端（第一次使用時建立，所有執行緒共用同一組連線池）"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            if _fallback_reason:
+                print(f"⚠ {_fallback_reason}")
+            _client = _HttpxClient() if httpx is not None else _RequestsClient()
+        return _client
+
+
+def close():
+    """關閉共用用戶端的所有連線"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def fetch(url, timeout=DEFAULT_TIMEOUT):
+    """以共用連線取得小型資源（縮圖等）的完整內容；HTTP 錯誤時拋出例外"""
+    return get_client().fetch(url, timeout)
+
+
+def download(url, path, reporthook=None, timeout=DEFAULT_TIMEOUT * 3):
+    """
+    以共用連線下載大型檔案，先寫入 path.part，完成後才改名。
+    reporthook 與 urllib.request.urlretrieve 相同：(區塊編號, 區塊大小, 總大小)，總大小未知時為 -1。
+    """
+    temp_path = path + ".part"
+    chunks = get_client().stream(url, timeout)
+    _, headers = next(chunks)
+    total = int(headers.get('Content-Length') or -1)
+    try:
+        with open(temp_path, 'wb') as f:
+            if reporthook:
+                reporthook(0, DOWNLOAD_CHUNK_SIZE, total)
+            for block_num, chunk in enumerate(chunks, 1):
+                f.write(chunk)
+                if reporthook:
+                    reporthook(block_num, DOWNLOAD_CHUNK_SIZE, total)
+        os.replace(temp_path, path)
+    except BaseException:
+        chunks.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return path
+
+
+def probe(url, timeout=DEFAULT_TIMEOUT):
+    """以 Range: bytes=0-0 請求取得 (檔案大小, 是否支援範圍請求)，不下載內容；大小未知時為 -1"""
+    chunks = get_client().stream(url, timeout, {'Range': 'bytes=0-0'})
+    status, headers = next(chunks)
+    chunks.close()
+    if status == 206:
+        match = re.match(r'bytes 0-0/(\d+)', headers.get('Content-Range', ''))
+        if match:
+            return int(match.group(1)), True
+    length = headers.get('Content-Length')
+    return (int(length) if status == 200 and length else -1), False
+
+
+def fetch_range(url, start, end, f, timeout=DEFAULT_TIMEOUT * 3):
+    """下載 start..end（含兩端）的位元組，寫入檔案物件 f 的相同位置"""
+    chunks = get_client().stream(url, timeout, {'Range': f"bytes={start}-{end}"})
+    status, _ = next(chunks)
+    if status != 206:
+        chunks.close()
+        raise OSError(f"伺服器未回傳指定範圍 (HTTP {status})")
+    f.seek(start)
+    written = 0
+    for chunk in chunks:
+        f.write(chunk)
+        written += len(chunk)
+    if written != end - start + 1:
+        raise OSError(f"範圍 {start}-{end} 下載不完整")
+
+
+def _load_state(state_path):
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def download_parallel(url, path, workers=PARALLEL_WORKERS, chunk_size=PARALLEL_CHUNK_SIZE,
+                      reporthook=None, timeout=DEFAULT_TIMEOUT * 3):
+    """
+    以多條連線平行下載大型檔案的各個範圍，寫入預先配置好大小的 path.part。
+    已完成的段落記錄在 path.part.json，中斷後再次呼叫時只下載缺少的段落。
+    伺服器不支援範圍請求或沒有回傳大小時，改用單一連線下載。
+    reporthook 與 download() 相同，區塊大小為 chunk_size。
+    """
+    size, ranges = probe(url, timeout)
+    if not ranges or size <= 0:
+        return download(url, path, reporthook, timeout)
+
+    temp_path = path + ".part"
+    state_path = temp_path + ".json"
+    state = _load_state(state_path)
+    if (state.get('url') != url or state.get('size') != size or state.get('chunk_size') != chunk_size
+            or not os.path.exists(temp_path)):
+        state = {'url': url, 'size': size, 'chunk_size': chunk_size, 'done': []}
+        with open(temp_path, 'wb') as f:
+            f.truncate(size)
+    done = set(state['done'])
+    count = (size + chunk_size - 1) // chunk_size
+    lock = threading.Lock()
+
+    def fetch_chunk(index):
+        start = index * chunk_size
+        end = min(start + chunk_size, size) - 1
+        for attempt in range(RANGE_RETRIES + 1):
+            try:
+                with open(temp_path, 'r+b') as f:
+                    fetch_range(url, start, end, f, timeout)
+                break
+            except Exception:
+                if attempt == RANGE_RETRIES:
+                    raise
+        with lock:
+            done.add(index)
+            state['done'] = sorted(done)
+            temp_state = f"{state_path}.{threading.get_ident()}.tmp"
+            with open(temp_state, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(temp_state, state_path)
+            if reporthook:
+                reporthook(len(done), chunk_size, size)
+
+    if reporthook:
+        reporthook(len(done), chunk_size, size)
+    pending = [index for index in range(count) if index not in done]
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="range") as executor:
+        for _ in executor.map(fetch_chunk, pending):
+            pass
+
+    os.replace(temp_path, path)
+    os.remove(state_path)
+    return path
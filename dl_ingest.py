@@ -0,0 +1,158 @@
+import base64
+import re
+import sys
+from collections import OrderedDict
+
+# 單一預先編譯的樣式，涵蓋 watch?v=、youtu.be、shorts、embed、live 與播放清單網址
+_YOUTUBE_URL_RE = re.compile(r'''
+    ^(?:https?://)?(?:(?:www|m|music)\.)?
+    (?:
+        youtu\.be/(?P<short>[0-9A-Za-z_-]{11})
+      | youtube(?:-nocookie)?\.com/
+        (?:
+            (?:shorts|embed|live|v)/(?P<path>[0-9A-Za-z_-]{11})
+          | watch/?\?(?:[^#\s]*?&)?v=(?P<query>[0-9A-Za-z_-]{11})
+          | playlist\?(?:[^#\s]*?&)?list=(?P<list>[0-9A-Za-z_-]+)
+        )
+    )
+    (?![0-9A-Za-z_-])
+''', re.VERBOSE)
+
+KIND_VIDEO = "video"
+KIND_PLAYLIST = "playlist"
+
+# 低記憶體模式的去重視窗：只記住最近這麼多個不重複的網址
+DEDUP_WINDOW = 10000
+
+
+def parse_youtube_url(url):
+    """解析 YouTube 網址，回傳 (類型, ID)；無法辨識時回傳 None"""
+    match = _YOUTUBE_URL_RE.match(url.strip())
+    if not match:
+        return None
+    video_id = match.group('short') or match.group('path') or match.group('query')
+    if video_id:
+        return KIND_VIDEO, video_id
+    return KIND_PLAYLIST, match.group('list')
+
+
+def extract_video_id(url):
+    """取得影片 ID；播放清單或無效網址回傳 None"""
+    parsed = parse_youtube_url(url)
+    if parsed and parsed[0] == KIND_VIDEO:
+        return parsed[1]
+    return None
+
+
+def canonical_url(kind, item_id):
+    """將 (類型, ID) 轉回標準網址"""
+    if kind == KIND_PLAYLIST:
+        return f"https://www.youtube.com/playlist?list={item_id}"
+    return f"https://www.youtube.com/watch?v={item_id}"
+
+
+def _video_key(video_id):
+    """
+    將 11 字元的影片 ID 無損轉成整數作為去重鍵（補一個字元湊滿 9 bytes），
+    整數比字串佔用更少記憶體。
+    """
+    return int.from_bytes(base64.urlsafe_b64decode(video_id + 'A'), 'big')
+
+
+def iter_lines(source):
+    """
+    逐行讀取網址來源，不會一次載入整個檔案。
+    source 為檔案路徑，或 '-' 代表標準輸入；略過空行與 # 註解。
+    """
+    if source == '-':
+        stream = sys.stdin
+        close = False
+    else:
+        stream = open(source, 'r', encoding='utf-8')
+        close = True
+
+    try:
+        for line in stream:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    finally:
+        if close:
+            stream.close()
+
+
+class _RecentKeys:
+    """只記住最近 size 個鍵的集合，記憶體用量固定"""
+
+    def __init__(self, size):
+        self.size = size
+        self._keys = OrderedDict()
+
+    def __contains__(self, key):
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return True
+        return False
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key):
+        self._keys[key] = None
+        if len(self._keys) > self.size:
+            self._keys.popitem(last=False)
+
+
+class UrlIngester:
+    """
+    串流解析網址並在任何網路請求之前去除重複項目。
+    指定 window 時只對最近 window 個不重複的網址去重，記憶體用量固定；
+    較早出現過的重複項目會由媒體儲存庫命中，不會重新下載。
+    """
+
+    def __init__(self, on_invalid=None, window=None):
+        self.on_invalid = on_invalid
+        self.total = 0
+        self.invalid = 0
+        self.duplicates = 0
+        self.accepted = 0
+        if window:
+            self._seen_videos = _RecentKeys(window)
+            self._seen_playlists = _RecentKeys(window)
+        else:
+            self._seen_videos = set()
+            self._seen_playlists = set()
+
+    def ingest(self, lines):
+        """產生標準化、不重複的網址"""
+        for line in lines:
+            self.total += 1
+            parsed = parse_youtube_url(line)
+            if parsed is None:
+                self.invalid += 1
+                if self.on_invalid:
+                    self.on_invalid(line)
+                continue
+
+            kind, item_id = parsed
+            if kind == KIND_VIDEO:
+                key = _video_key(item_id)
+                seen = self._seen_videos
+            else:
+                key = item_id
+                seen = self._seen_playlists
+
+            if key in seen:
+                self.duplicates += 1
+                continue
+            seen.add(key)
+            self.accepted += 1
+            yield canonical_url(kind, item_id)
+
+    def ingest_source(self, source):
+        """從檔案路徑或 '-'（標準輸入）讀取"""
+        return self.ingest(iter_lines(source))
+
+    @property
+    def unique(self):
+        return self.accepted
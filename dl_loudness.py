@@ -0,0 +1,119 @@
+import json
+import os
+import re
+import subprocess
+import threading
+
+# EBU R128 目標值：整合響度 (LUFS)、真峰值 (dBTP)、響度範圍 (LU)
+TARGET_I = -16.0
+TARGET_TP = -1.5
+TARGET_LRA = 11.0
+
+# loudnorm 內部會升頻到 192 kHz，輸出時改回一般的取樣率
+OUTPUT_SAMPLE_RATE = "44100"
+
+_MEASUREMENT_KEYS = ('input_i', 'input_tp', 'input_lra', 'input_thresh', 'target_offset')
+_JSON_BLOCK_RE = re.compile(r'\{[^{}]*"input_i"[^{}]*\}', re.S)
+
+
+def measure_command(ffmpeg_path, source):
+    """第一次（量測）的 FFmpeg 指令：只分析不輸出"""
+    return [
+        ffmpeg_path or "ffmpeg", "-hide_banner", "-nostdin",
+        "-i", source,
+        "-vn", "-map", "0:a:0",
+        "-af", f"loudnorm=I={TARGET_I}:TP={TARGET_TP}:LRA={TARGET_LRA}:print_format=json",
+        "-f", "null", "-",
+    ]
+
+
+def parse_measurement(stderr):
+    """從 FFmpeg 的輸出取出 loudnorm 量測結果"""
+    blocks = _JSON_BLOCK_RE.findall(stderr)
+    if not blocks:
+        raise RuntimeError("無法取得響度量測結果")
+    data = json.loads(blocks[-1])
+    return {key: data[key] for key in _MEASUREMENT_KEYS}
+
+
+def loudnorm_filter(measurement):
+    """第二次（套用）的濾鏡：以量測值做線性調整，整首歌的動態不會被壓縮"""
+    return (
+        f"loudnorm=I={TARGET_I}:TP={TARGET_TP}:LRA={TARGET_LRA}"
+        f":measured_I={measurement['input_i']}"
+        f":measured_TP={measurement['input_tp']}"
+        f":measured_LRA={measurement['input_lra']}"
+        f":measured_thresh={measurement['input_thresh']}"
+        f":offset={measurement['target_offset']}"
+        ":linear=true"
+    )
+
+
+class LoudnessCache:
+    """
+    以影片 ID 保存響度量測結果。
+    同一部影片之後以其他位元率重新轉檔時直接沿用，不需要再跑一次量測。
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def _path(self, video_id):
+        return os.path.join(self.root, video_id[:2], video_id + ".json")
+
+    def get(self, video_id):
+        with self._lock:
+            if video_id in self._memory:
+                self.hits += 1
+                return self._memory[video_id]
+        try:
+            with open(self._path(video_id), 'r', encoding='utf-8') as f:
+                measurement = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self._memory[video_id] = measurement
+            self.hits += 1
+        return measurement
+
+    def put(self, video_id, measurement):
+        with self._lock:
+            self._memory[video_id] = measurement
+        path = self._path(video_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(measurement, f)
+        os.replace(temp_path, path)
+
+
+class LoudnessNormalizer:
+    """兩階段 EBU R128 標準化：量測（有快取）後產生套用用的濾鏡"""
+
+    def __init__(self, cache, ffmpeg_path="ffmpeg"):
+        self.cache = cache
+        self.ffmpeg_path = ffmpeg_path or "ffmpeg"
+
+    def filter_for(self, video_id, source):
+        """
+        回傳 source 的標準化濾鏡；在轉檔執行緒中呼叫。
+        沒有影片 ID 時照常量測，只是不寫入快取。
+        """
+        measurement = self.cache.get(video_id) if video_id else None
+        if measurement is None:
+            result = subprocess.run(
+                measure_command(self.ffmpeg_path, source), capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                tail = result.stderr.strip().splitlines()[-1:] or ["未知錯誤"]
+                raise RuntimeError(f"FFmpeg 響度量測失敗: {tail[0]}")
+            measurement = parse_measurement(result.stderr)
+            if video_id:
+                self.cache.put(video_id, measurement)
+        return loudnorm_filter(measurement)
@@ -0,0 +1,197 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 9464
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    """只增不減的計數器"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    直方圖：observe 只找到對應的桶加一，累積計數在輸出時才計算，
+    讓熱路徑上的成本維持在一次二分搜尋。
+    """
+
+    def __init__(self, name, help_text, buckets, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = sorted(buckets)
+        self.labelnames = tuple(labelnames)
+        self._series = {}  # labels -> [各桶計數..., +Inf 計數, 總和]
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        names = self.labelnames + ("le",)
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, labels + (bound,))} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_format_labels(names, labels + ('+Inf',))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class DownloadTracker:
+    """
+    單次下載的進度追蹤。
+    'downloading' 回調只記下目前位元組數，計數與直方圖在完成或失敗時才更新一次。
+    downloaded_bytes 是單一檔案的累計值，影音分開下載時每個格式都從 0 開始，
+    因此依 (影片 ID, 格式 ID) 分別記錄，只把各自的增量加到計數器。
+    """
+
+    __slots__ = ('metrics', 'labels', 'downloaded', 'counted', 'started')
+
+    def __init__(self, metrics, labels):
+        self.metrics = metrics
+        self.labels = labels
+        self.downloaded = {}
+        self.counted = {}
+        self.started = time.monotonic()
+
+    def on_progress(self, d):
+        status = d.get('status')
+        info = d.get('info_dict') or {}
+        key = (info.get('id'), info.get('format_id'))
+        if status == 'downloading':
+            self.downloaded[key] = d.get('downloaded_bytes') or 0
+        elif status == 'finished':
+            downloaded = d.get('total_bytes') or d.get('downloaded_bytes') or self.downloaded.get(key, 0)
+            self.downloaded[key] = downloaded
+            speed = d.get('speed')
+            if not speed and d.get('elapsed'):
+                speed = downloaded / d['elapsed']
+            if speed:
+                self.metrics.download_speed.observe(speed, self.labels)
+            self.flush()
+        elif status == 'error':
+            self.flush()
+
+    def flush(self):
+        """把尚未計入的位元組數加到計數器（可重複呼叫）"""
+        delta = 0
+        for key, downloaded in self.downloaded.items():
+            counted = self.counted.get(key, 0)
+            if downloaded > counted:
+                delta += downloaded - counted
+                self.counted[key] = downloaded
+        if delta > 0:
+            self.metrics.downloaded_bytes.inc(delta, self.labels)
+
+
+class DownloadMetrics:
+    """下載與轉檔的營運指標"""
+
+    def __init__(self):
+        self.downloaded_bytes = Counter(
+            "ytdl_downloaded_bytes_total", "已下載的位元組數", ("format", "quality"))
+        self.download_speed = Histogram(
+            "ytdl_download_speed_bytes_per_second", "下載速度",
+            [64e3, 256e3, 1e6, 2e6, 5e6, 10e6, 25e6, 50e6, 100e6], ("format", "quality"))
+        self.downloads = Counter(
+            "ytdl_downloads_total", "完成的下載數", ("format", "quality", "status"))
+        self.extract_seconds = Histogram(
+            "ytdl_extract_seconds", "解析影片資訊的耗時",
+            [0.25, 0.5, 1, 2, 5, 10, 30, 60])
+        self.transcode_seconds = Histogram(
+            "ytdl_transcode_seconds", "轉檔耗時",
+            [1, 2, 5, 10, 20, 30, 60, 120, 300, 600], ("quality",))
+        self.retries = Counter(
+            "ytdl_retries_total", "重試次數", ("category",))
+        self.bot_check_failures = Counter(
+            "ytdl_bot_check_failures_total", "機器人驗證失敗次數")
+        self.verify_failures = Counter(
+            "ytdl_verify_failures_total", "輸出檔完整性檢查失敗次數")
+        self.cookie_lookups = Counter(
+            "ytdl_cookie_lookups_total", "瀏覽器 Cookies 快取查詢次數", ("result",))
+        self.cookie_extract_seconds = Histogram(
+            "ytdl_cookie_extract_seconds", "從瀏覽器擷取 Cookies 的耗時",
+            [0.1, 0.25, 0.5, 1, 2, 5, 10, 30])
+
+    def track_download(self, fmt, quality):
+        return DownloadTracker(self, (str(fmt), str(quality)))
+
+    def render(self):
+        lines = []
+        for metric in (self.downloaded_bytes, self.download_speed, self.downloads,
+                       self.extract_seconds, self.transcode_seconds, self.retries,
+                       self.bot_check_failures, self.verify_failures, self.cookie_lookups,
+                       self.cookie_extract_seconds):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# 全程式共用的指標
+METRICS = DownloadMetrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+            return
+        data = METRICS.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_metrics_server(port=DEFAULT_PORT, host="127.0.0.1"):
+    """在背景執行緒提供 /metrics，回傳伺服器物件"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,164 @@
+import threading
+
+from dl_disk import format_size
+
+# 還沒有量測值時假設的下載速度（保守估計）
+DEFAULT_THROUGHPUT = 1024 * 1024
+# 新量測值在移動平均中的權重
+SMOOTHING = 0.3
+# 太短的下載量測誤差大（連線建立時間佔比高），不列入平均
+MIN_SAMPLE_SECONDS = 1.0
+# 解析、合併、轉檔等與大小無關的固定時間（秒），計入完成時限
+FIXED_OVERHEAD = 10
+
+
+class ThroughputMeter:
+    """
+    以實際完成的下載估計連線頻寬（指數移動平均）。
+    on_progress 可直接加入 yt-dlp 的 progress_hooks，每個檔案下載完成時記錄一次。
+    """
+
+    def __init__(self, initial=None):
+        self._lock = threading.Lock()
+        self.bytes_per_second = initial
+        self.samples = 0
+
+    def on_progress(self, d):
+        if d.get('status') != 'finished':
+            return
+        elapsed = d.get('elapsed')
+        nbytes = d.get('total_bytes') or d.get('downloaded_bytes')
+        if elapsed and nbytes and elapsed >= MIN_SAMPLE_SECONDS:
+            self.observe(nbytes, elapsed)
+
+    def observe(self, nbytes, seconds):
+        sample = nbytes / seconds
+        with self._lock:
+            if self.bytes_per_second is None:
+                self.bytes_per_second = sample
+            else:
+                self.bytes_per_second = SMOOTHING * sample + (1 - SMOOTHING) * self.bytes_per_second
+            self.samples += 1
+
+    def estimate(self):
+        """目前的頻寬估計 (bytes/s)；還沒有量測值時回傳預設值"""
+        return self.bytes_per_second or DEFAULT_THROUGHPUT
+
+    def describe(self):
+        source = f"量測 {self.samples} 次" if self.samples else "預設值"
+        return f"{self.estimate() / 1024 / 1024:.2f} MB/s（{source}）"
+
+
+class FormatPlan:
+    """格式規劃的結果"""
+
+    def __init__(self, format_id, label, size, seconds, fits, formats):
+        self.format_id = format_id
+        self.label = label
+        self.size = size
+        self.seconds = seconds
+        self.fits = fits
+        # 選定的格式資訊（影音分開時為兩個）
+        self.formats = formats
+
+    def describe(self):
+        text = f"{self.label} ({self.format_id}) | 約 {self.size / 1024 / 1024:.1f} MB | 預估 {self.seconds:.0f} 秒"
+        if not self.fits:
+            text += " | ⚠ 沒有符合限制的格式，改用最小的格式"
+        return text
+
+
+def _has(codec):
+    return codec not in (None, 'none')
+
+
+class _Candidate:
+    def __init__(self, key, format_id, label, size, formats):
+        self.key = key
+        self.format_id = format_id
+        self.label = label
+        self.size = size
+        self.formats = formats
+
+
+def _audio_candidates(formats, duration):
+    candidates = []
+    for fmt in formats:
+        if _has(fmt.get('acodec')) and not _has(fmt.get('vcodec')):
+            bitrate = fmt.get('abr') or fmt.get('tbr') or 0
+            size = format_size(dict(fmt, duration=duration))
+            candidates.append(_Candidate((bitrate,), fmt['format_id'], f"{bitrate:.0f} kbps", size, [fmt]))
+    return candidates
+
+
+def _video_candidates(formats, duration, max_height=None):
+    audio = [c for c in _audio_candidates(formats, duration) if c.size]
+    # 合併為 MP4 時優先搭配 m4a 音訊，不必重新編碼
+    m4a = [c for c in audio if c.formats[0].get('ext') == 'm4a']
+    partner = max(m4a or audio, key=lambda c: c.key, default=None)
+
+    candidates = []
+    for fmt in formats:
+        height = fmt.get('height')
+        if not _has(fmt.get('vcodec')) or not height or (max_height and height > max_height):
+            continue
+        key = (height, fmt.get('fps') or 0, fmt.get('tbr') or 0)
+        size = format_size(dict(fmt, duration=duration))
+        if _has(fmt.get('acodec')):
+            candidates.append(_Candidate(key, fmt['format_id'], f"{height}p", size, [fmt]))
+        elif partner is not None and size:
+            candidates.append(_Candidate(key, f"{fmt['format_id']}+{partner.format_id}", f"{height}p",
+                                         size + partner.size, [fmt] + partner.formats))
+    return candidates
+
+
+class FormatPlanner:
+    """
+    依格式表（filesize／tbr）與量測到的頻寬選擇格式：
+    在「deadline 秒內完成」與「來源不超過 max_bytes」的限制內選擇品質最高的格式，
+    沒有任何格式符合時選擇最小的格式，讓批次的完成時間與磁碟用量可以預估。
+    兩個限制都未設定時只依品質選擇（等同 best）。
+    """
+
+    def __init__(self, deadline=None, max_bytes=None, meter=None, max_height=None):
+        self.deadline = deadline
+        self.max_bytes = max_bytes
+        self.meter = meter or ThroughputMeter()
+        self.max_height = max_height
+
+    def plan(self, info, video=False):
+        """回傳 FormatPlan；格式表中沒有可估計大小的格式時回傳 None（由呼叫端使用預設格式）"""
+        formats = info.get('formats') or []
+        duration = info.get('duration')
+        if video:
+            candidates = _video_candidates(formats, duration, self.max_height)
+        else:
+            candidates = _audio_candidates(formats, duration)
+        candidates = [c for c in candidates if c.size]
+        if not candidates:
+            return None
+
+        throughput = self.meter.estimate()
+        candidates.sort(key=lambda c: c.key, reverse=True)
+        fits = True
+        chosen = next((c for c in candidates if self._fits(c.size, c.size / throughput + FIXED_OVERHEAD)), None)
+        if chosen is None:
+            fits = False
+            chosen = min(candidates, key=lambda c: c.size)
+        seconds = chosen.size / throughput + FIXED_OVERHEAD
+        return FormatPlan(chosen.format_id, chosen.label, chosen.size, seconds, fits, chosen.formats)
+
+    def _fits(self, size, seconds):
+        if self.max_bytes is not None and size > self.max_bytes:
+            return False
+        if self.deadline is not None and seconds > self.deadline:
+            return False
+        return True
+
+    def describe(self):
+        limits = []
+        if self.deadline is not None:
+            limits.append(f"{self.deadline:.0f} 秒內完成")
+        if self.max_bytes is not None:
+            limits.append(f"每個不超過 {self.max_bytes / 1024 / 1024:.0f} MB")
+        return f"格式規劃: {'、'.join(limits) or '最佳品質'} | 頻寬 {self.meter.describe()}"
@@ -0,0 +1,135 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import yt_dlp
+
+from dl_retry import ERROR_BOT, ERROR_UNAVAILABLE, classify_error
+
+DEFAULT_PREFLIGHT_JOBS = 16
+
+# 檢查結果
+STATUS_OK = "ok"
+STATUS_UNAVAILABLE = "unavailable"  # 私人、已移除、地區限制、會員限定
+STATUS_NEEDS_AUTH = "needs_auth"    # 需要登入或機器人驗證
+STATUS_UPCOMING = "upcoming"        # 尚未開始的直播／首播
+STATUS_UNKNOWN = "unknown"          # 網路錯誤等暫時性問題，無法判斷（保留在清單中）
+
+STATUS_LABELS = {
+    STATUS_OK: "可下載",
+    STATUS_UNAVAILABLE: "影片無法取得",
+    STATUS_NEEDS_AUTH: "需要登入",
+    STATUS_UPCOMING: "尚未開播",
+    STATUS_UNKNOWN: "無法判斷",
+}
+
+# 這些狀態的項目會保留在過濾後的清單中
+_KEEP_STATUSES = (STATUS_OK, STATUS_UNKNOWN)
+
+# yt-dlp 的 availability 欄位
+_AVAILABILITY_STATUS = {
+    'private': STATUS_UNAVAILABLE,
+    'subscriber_only': STATUS_UNAVAILABLE,
+    'premium_only': STATUS_NEEDS_AUTH,
+    'needs_auth': STATUS_NEEDS_AUTH,
+}
+
+
+class _SilentLogger:
+    """檢查失敗是預期中的結果，不讓 yt-dlp 把錯誤印到終端機"""
+
+    def debug(self, msg):
+        pass
+
+    def info(self, msg):
+        pass
+
+    def warning(self, msg):
+        pass
+
+    def error(self, msg):
+        pass
+
+
+def check_url(url, ydl_opts=None):
+    """
+    只解析影片頁面（process=False，不選格式也不下載），回傳 (狀態, 說明)。
+    說明在可下載時為影片標題，其他狀態為錯誤訊息。
+    """
+    opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'logger': _SilentLogger(),
+    }
+    opts.update(ydl_opts or {})
+    try:
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            info = ydl.extract_info(url, download=False, process=False)
+    except Exception as e:
+        category = classify_error(e)
+        if category == ERROR_UNAVAILABLE:
+            return STATUS_UNAVAILABLE, str(e)
+        if category == ERROR_BOT:
+            return STATUS_NEEDS_AUTH, str(e)
+        return STATUS_UNKNOWN, str(e)
+
+    status = _AVAILABILITY_STATUS.get(info.get('availability'))
+    if status:
+        return status, info.get('availability')
+    if info.get('live_status') == 'is_upcoming':
+        return STATUS_UPCOMING, info.get('title') or ''
+    return STATUS_OK, info.get('title') or ''
+
+
+class Preflight:
+    """
+    批次下載前的可用性檢查：以 jobs 條執行緒同時檢查，
+    依原順序產生可下載的網址，無法下載的項目在開始下載前就被排除。
+    暫時性錯誤無法判斷可用性，這些項目會保留下來交給批次的重試機制。
+    report 為可寫入的檔案物件時，每個項目寫入一行「狀態<TAB>網址<TAB>說明」。
+    """
+
+    def __init__(self, jobs=DEFAULT_PREFLIGHT_JOBS, ydl_opts=None, report=None, log=print):
+        self.jobs = max(1, jobs)
+        self.ydl_opts = ydl_opts
+        self.report = report
+        self.log = log
+        self.counts = {status: 0 for status in STATUS_LABELS}
+
+    def filter(self, urls):
+        """
+        依原順序產生通過檢查的網址；urls 可為產生器。
+        同時檢查中的項目最多 jobs * 2 個，不會一次讀入整個來源。
+        """
+        window = deque()
+        with ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="preflight") as executor:
+            for url in urls:
+                window.append((url, executor.submit(check_url, url, self.ydl_opts)))
+                if len(window) >= self.jobs * 2:
+                    url, future = window.popleft()
+                    if self._settle(url, *future.result()):
+                        yield url
+            while window:
+                url, future = window.popleft()
+                if self._settle(url, *future.result()):
+                    yield url
+
+    def _settle(self, url, status, detail):
+        self.counts[status] += 1
+        if self.report:
+            detail = " ".join(str(detail).split())
+            self.report.write(f"{status}\t{url}\t{detail}\n")
+        if status not in _KEEP_STATUSES:
+            self.log(f"⊘ {STATUS_LABELS[status]}，略過: {url}")
+        return status in _KEEP_STATUSES
+
+    @property
+    def skipped(self):
+        return sum(count for status, count in self.counts.items() if status not in _KEEP_STATUSES)
+
+    def summary(self):
+        """各狀態的項目數（只列出有項目的狀態）"""
+        return {STATUS_LABELS[status]: count for status, count in self.counts.items() if count}
+
+    def describe(self):
+        checked = sum(self.counts.values())
+        return f"預先檢查 {checked} 個 | 可下載 {self.counts[STATUS_OK]} 個 | 略過 {self.skipped} 個"
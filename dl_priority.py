@@ -0,0 +1,195 @@
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from yt_dlp.utils import DownloadCancelled
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+    import fcntl
+
+# 優先順序（數字越小越優先）
+PRIORITY_INTERACTIVE = 0   # 使用者等著的單一下載（GUI 網址欄、quick 模式）
+PRIORITY_BULK = 1          # 批次、播放清單、同步
+
+PRIORITY_LABELS = {
+    PRIORITY_INTERACTIVE: "優先",
+    PRIORITY_BULK: "批次",
+}
+
+# 只有優先工作可以使用的額外名額
+DEFAULT_RESERVED_SLOTS = 1
+# 批次工作等待超過這個秒數後與優先工作同等排序，不會一直被插隊
+AGING_SECONDS = 120
+POLL_INTERVAL = 0.5
+# 其他程序（例如 quick 模式）進行優先下載時在這裡放置鎖定檔，批次程序看到時暫緩開始新的項目
+DEFAULT_BEACON_DIR = os.path.join(os.path.expanduser("~"), ".youtube_download", "interactive")
+
+_SLOT_GENERAL = "general"
+_SLOT_RESERVED = "reserved"
+
+
+def _try_lock(f):
+    """以不阻塞的方式鎖定檔案；已被其他程序鎖定時拋出 OSError"""
+    f.seek(0)
+    if msvcrt is not None:
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+class _Beacon:
+    """優先下載進行中的標記：持有檔案鎖，程序結束（包含當機）時鎖自動釋放"""
+
+    def __init__(self, directory, name):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, name)
+        self._file = open(self.path, 'a+b')
+        _try_lock(self._file)
+
+    def close(self):
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class _Waiter:
+    __slots__ = ('seq', 'priority', 'since')
+
+    def __init__(self, seq, priority, since):
+        self.seq = seq
+        self.priority = priority
+        self.since = since
+
+
+class PriorityScheduler:
+    """
+    下載名額的優先排程：同時進行的下載不超過 slots + reserved 個。
+    一般名額依優先順序分配（同順序先到先得），reserved 個額外名額只給優先工作，
+    批次佔滿一般名額時單一下載仍可立即開始。批次工作等待超過 aging 秒後與優先工作同等排序。
+    beacon_dir 指定時跨程序協調：優先工作持有鎖定檔，其他程序的批次工作在它存在時暫緩開始
+    （同樣受 aging 限制，不會無限等待）。
+    """
+
+    def __init__(self, slots=1, reserved=DEFAULT_RESERVED_SLOTS, aging=AGING_SECONDS, beacon_dir=None,
+                 log=print, clock=time.monotonic):
+        self.slots = max(1, slots)
+        self.reserved = max(0, reserved)
+        self.aging = aging
+        self.beacon_dir = beacon_dir
+        self.log = log
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiters = []
+        self._running = {_SLOT_GENERAL: 0, _SLOT_RESERVED: 0}
+        self._yielding = False
+
+    def set_reserved(self, reserved):
+        with self._cond:
+            self.reserved = max(0, reserved)
+            self._cond.notify_all()
+
+    def _urgent(self, waiter, now):
+        return waiter.priority == PRIORITY_INTERACTIVE or now - waiter.since >= self.aging
+
+    def _external_interactive(self):
+        """其他程序是否有進行中的優先下載；鎖已釋放的標記（程序已結束）順便清除"""
+        if not self.beacon_dir:
+            return False
+        try:
+            names = os.listdir(self.beacon_dir)
+        except OSError:
+            return False
+        own = f"{os.getpid()}-"
+        for name in names:
+            if name.startswith(own) or not name.endswith(".lock"):
+                continue
+            path = os.path.join(self.beacon_dir, name)
+            try:
+                with open(path, 'a+b') as f:
+                    _try_lock(f)
+            except OSError:
+                return True
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return False
+
+    def _grant(self, waiter):
+        """呼叫時持有鎖；可以開始時回傳名額種類，否則回傳 None"""
+        now = self.clock()
+        ordered = sorted(self._waiters, key=lambda w: (0 if self._urgent(w, now) else 1, w.seq))
+        self._yielding = False
+        if waiter is ordered[0] and self._running[_SLOT_GENERAL] < self.slots:
+            if self._urgent(waiter, now) or not self._external_interactive():
+                return _SLOT_GENERAL
+            self._yielding = True
+        if waiter.priority == PRIORITY_INTERACTIVE and self._running[_SLOT_RESERVED] < self.reserved:
+            first = next(w for w in ordered if w.priority == PRIORITY_INTERACTIVE)
+            if waiter is first:
+                return _SLOT_RESERVED
+        return None
+
+    def acquire(self, priority, cancelled=None):
+        """
+        等到可以開始為止，回傳之後交給 release() 的名額。
+        cancelled() 回傳 True 時放棄等待並拋出 DownloadCancelled。
+        """
+        with self._cond:
+            waiter = _Waiter(next(self._seq), priority, self.clock())
+            self._waiters.append(waiter)
+            notified = False
+            try:
+                while True:
+                    if cancelled and cancelled():
+                        raise DownloadCancelled("下載已取消")
+                    kind = self._grant(waiter)
+                    if kind is not None:
+                        break
+                    if self._yielding and not notified:
+                        self.log(f"⏸ 其他程式正在進行單一下載，批次暫緩開始新的項目（最多 {self.aging} 秒）")
+                        notified = True
+                    self._cond.wait(POLL_INTERVAL)
+            finally:
+                self._waiters.remove(waiter)
+                self._cond.notify_all()
+            self._running[kind] += 1
+
+        beacon = None
+        if priority == PRIORITY_INTERACTIVE and self.beacon_dir:
+            try:
+                beacon = _Beacon(self.beacon_dir, f"{os.getpid()}-{waiter.seq}.lock")
+            except OSError:
+                beacon = None
+        return kind, beacon
+
+    def release(self, slot):
+        kind, beacon = slot
+        if beacon is not None:
+            beacon.close()
+        with self._cond:
+            self._running[kind] -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority, cancelled=None):
+        slot = self.acquire(priority, cancelled)
+        try:
+            yield
+        finally:
+            self.release(slot)
+
+    def describe(self):
+        with self._cond:
+            waiting = {p: sum(1 for w in self._waiters if w.priority == p) for p in PRIORITY_LABELS}
+            return (f"下載名額: 使用中 {self._running[_SLOT_GENERAL]}/{self.slots} "
+                    f"+ 保留 {self._running[_SLOT_RESERVED]}/{self.reserved} | "
+                    f"等待 優先 {waiting[PRIORITY_INTERACTIVE]}、批次 {waiting[PRIORITY_BULK]}")
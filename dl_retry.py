@@ -0,0 +1,268 @@
+import random
+import threading
+import time
+from collections import deque
+
+from yt_dlp.utils import DownloadCancelled
+
+from dl_disk import DiskTooSmallError
+from dl_metrics import METRICS
+from dl_verify import IntegrityError
+
+# 錯誤分類
+ERROR_NETWORK = "network"          # 連線中斷、逾時、DNS 失敗等暫時性錯誤
+ERROR_THROTTLE = "throttle"        # HTTP 429 / 限速
+ERROR_BOT = "bot"                  # 機器人驗證（需要 Cookies，重試無效）
+ERROR_UNAVAILABLE = "unavailable"  # 私人、已移除、地區限制等（重試無效）
+ERROR_FFMPEG = "ffmpeg"            # 轉換失敗
+ERROR_DISK = "disk"                # 磁碟空間不足（等其他工作釋放空間後重試）
+ERROR_INTEGRITY = "integrity"      # 輸出檔不完整或長度不符（重新下載）
+ERROR_CANCELLED = "cancelled"      # 使用者取消（不重試）
+ERROR_UNKNOWN = "unknown"
+
+# 依序比對，越前面的規則優先
+_ERROR_PATTERNS = [
+    (ERROR_BOT, ("not a bot", "sign in to confirm", "confirm your age")),
+    (ERROR_UNAVAILABLE, (
+        "video unavailable", "private video", "has been removed", "account associated",
+        "members-only", "join this channel", "not available in your country",
+        "geo restrict", "copyright", "http error 404", "http error 410",
+        "is not a valid url", "unsupported url", "超過磁碟容量",
+    )),
+    (ERROR_THROTTLE, ("http error 429", "too many requests", "rate limit", "throttl")),
+    (ERROR_NETWORK, (
+        "timed out", "timeout", "connection reset", "connection aborted", "connection refused",
+        "remote end closed", "temporary failure in name resolution", "name or service not known",
+        "network is unreachable", "incompleteread", "incomplete read", "unable to download",
+        "http error 500", "http error 502", "http error 503", "http error 504",
+        "eof occurred", "got error",
+    )),
+    (ERROR_DISK, ("no space left", "errno 28", "disk full", "disk quota exceeded")),
+    (ERROR_INTEGRITY, ("完整性檢查失敗",)),
+    (ERROR_FFMPEG, ("ffmpeg", "ffprobe", "postprocessing", "conversion failed")),
+]
+
+_EXHAUSTED = object()
+
+ERROR_LABELS = {
+    ERROR_NETWORK: "網路錯誤",
+    ERROR_THROTTLE: "被限速",
+    ERROR_BOT: "機器人驗證",
+    ERROR_UNAVAILABLE: "影片無法取得",
+    ERROR_FFMPEG: "FFmpeg 錯誤",
+    ERROR_DISK: "磁碟空間不足",
+    ERROR_INTEGRITY: "檔案不完整",
+    ERROR_CANCELLED: "已取消",
+    ERROR_UNKNOWN: "未知錯誤",
+}
+
+
+def classify_error(error):
+    """將例外或錯誤訊息分類"""
+    if error is None:
+        return ERROR_UNKNOWN
+    if isinstance(error, DownloadCancelled):
+        return ERROR_CANCELLED
+    if isinstance(error, IntegrityError):
+        return ERROR_INTEGRITY
+    if isinstance(error, DiskTooSmallError):
+        # 磁碟再怎麼清空也放不下，不重試
+        return ERROR_UNAVAILABLE
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return ERROR_NETWORK
+    if isinstance(error, OSError) and error.errno == 28:
+        return ERROR_DISK
+
+    message = str(error).lower()
+    for category, needles in _ERROR_PATTERNS:
+        if any(needle in message for needle in needles):
+            return category
+    return ERROR_UNKNOWN
+
+
+def record_failure(category):
+    """更新失敗相關的指標"""
+    if category == ERROR_BOT:
+        METRICS.bot_check_failures.inc()
+
+
+class RetryPolicy:
+    """每種錯誤的最大嘗試次數與退避時間"""
+
+    def __init__(self, max_attempts=None, base_delay=2.0, max_delay=120.0):
+        # 含第一次嘗試在內的總次數；0 或 1 表示不重試
+        self.max_attempts = {
+            ERROR_NETWORK: 5,
+            ERROR_THROTTLE: 5,
+            ERROR_FFMPEG: 2,
+            ERROR_DISK: 5,
+            ERROR_INTEGRITY: 3,
+            ERROR_UNKNOWN: 2,
+            ERROR_BOT: 1,
+            ERROR_UNAVAILABLE: 1,
+            ERROR_CANCELLED: 1,
+        }
+        if max_attempts:
+            self.max_attempts.update(max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, category, attempt):
+        """attempt 為已完成的嘗試次數"""
+        return attempt < self.max_attempts.get(category, 1)
+
+    def delay(self, category, attempt):
+        """指數退避加上隨機抖動（限速與磁碟空間不足等待較久）"""
+        base = self.base_delay * (4 if category in (ERROR_THROTTLE, ERROR_DISK) else 1)
+        ceiling = min(self.max_delay, base * (2 ** (attempt - 1)))
+        # 保留一半固定等待，另一半隨機，避免多個項目同時重試
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+class _PendingRetry:
+    """等待重試的項目"""
+
+    __slots__ = ('item', 'attempt', 'not_before')
+
+    def __init__(self, item, attempt, not_before):
+        self.item = item
+        self.attempt = attempt
+        self.not_before = not_before
+
+
+class RetryBatch:
+    """
+    批次執行器：失敗的項目重新排到佇列尾端，不阻塞其他項目。
+    keep_results=False 時只保留計數，不保存每個項目的結果；
+    max_pending 限制等待重試的項目數，超過時先處理重試再讀取新項目。
+    兩者一起使用時記憶體用量與項目總數無關。
+    cancelled() 回傳 True 後不再開始任何項目（包含等待重試的項目）。
+    attempt_fn 可以呼叫 defer(item) 把結果延後到背景工作（例如轉檔後的完整性檢查）完成時才決定。
+    """
+
+    def __init__(self, policy=None, log=print, sleep=time.sleep, clock=time.monotonic,
+                 keep_results=True, max_pending=None, cancelled=None):
+        self.policy = policy or RetryPolicy()
+        self.log = log
+        self.sleep = sleep
+        self.clock = clock
+        self.keep_results = keep_results
+        self.max_pending = max_pending
+        self.cancelled = cancelled
+        self.poll_interval = 0.5
+        self.succeeded = []
+        self.failed = []  # (item, category, error)
+        self.succeeded_count = 0
+        self.failed_count = 0
+        self._failure_counts = {}
+        self._done = 0
+        # 延後決定結果的項目：項目 -> 嘗試次數；背景工作完成後的結果 (item, attempt, error)
+        self._attempt = 0
+        self._deferred = {}
+        self._unsettled = 0
+        self._settled = deque()
+        self._settle_lock = threading.Lock()
+
+    def defer(self, item):
+        """
+        在 attempt_fn 中呼叫：這次嘗試的結果由背景工作決定，回傳 settle(error=None)。
+        settle 可從任何執行緒呼叫一次；error 不為 None 時依分類重試或放棄。
+        批次在所有延後的項目都有結果後才結束。
+        """
+        attempt = self._attempt
+        self._deferred[item] = attempt
+        with self._settle_lock:
+            self._unsettled += 1
+
+        def settle(error=None):
+            with self._settle_lock:
+                self._unsettled -= 1
+                self._settled.append((item, attempt, error))
+
+        return settle
+
+    def run(self, items, attempt_fn, on_done=None):
+        """
+        逐一執行 attempt_fn(item)：成功回傳 None，失敗回傳例外物件。
+        items 可以是產生器，會邊讀邊處理；需要重試的項目在新項目處理完後才執行。
+        on_done(item, success, done_count) 在項目最終完成（成功或放棄）時呼叫。
+        """
+        fresh = iter(items)
+        retries = deque()
+
+        while True:
+            if self.cancelled and self.cancelled():
+                break
+            self._collect_settled(retries, on_done)
+            if self.max_pending and len(retries) >= self.max_pending:
+                item = _EXHAUSTED
+            else:
+                item = next(fresh, _EXHAUSTED)
+            if item is not _EXHAUSTED:
+                attempt = 1
+            elif retries:
+                pending = retries.popleft()
+                item, attempt = pending.item, pending.attempt
+                wait = pending.not_before - self.clock()
+                if wait > 0:
+                    self.sleep(wait)
+                    if self.cancelled and self.cancelled():
+                        break
+            elif self._unsettled or self._settled:
+                # 只剩背景工作尚未完成的項目
+                self.sleep(self.poll_interval)
+                continue
+            else:
+                break
+
+            self._attempt = attempt
+            error = attempt_fn(item)
+            if self._deferred.pop(item, None) is not None and error is None:
+                continue
+            self._finish(item, attempt, error, retries, on_done)
+
+        return self.succeeded, self.failed
+
+    def _collect_settled(self, retries, on_done):
+        while True:
+            with self._settle_lock:
+                if not self._settled:
+                    return
+                item, attempt, error = self._settled.popleft()
+            self._finish(item, attempt, error, retries, on_done)
+
+    def _finish(self, item, attempt, error, retries, on_done):
+        """記錄一次嘗試的結果：成功、排入重試或放棄"""
+        if error is None:
+            self.succeeded_count += 1
+            if self.keep_results:
+                self.succeeded.append(item)
+            self._done += 1
+            if on_done:
+                on_done(item, True, self._done)
+            return
+
+        category = classify_error(error)
+        label = ERROR_LABELS[category]
+        record_failure(category)
+        if self.policy.should_retry(category, attempt):
+            METRICS.retries.inc(labels=(category,))
+            delay = self.policy.delay(category, attempt)
+            self.log(f"⟳ {label}，{delay:.1f} 秒後重試 (第 {attempt + 1} 次): {item}")
+            retries.append(_PendingRetry(item, attempt + 1, self.clock() + delay))
+        else:
+            if attempt > 1:
+                self.log(f"✗ {label}，已嘗試 {attempt} 次，放棄: {item}")
+            else:
+                self.log(f"✗ {label}，不重試: {item}")
+            self.failed_count += 1
+            self._failure_counts[category] = self._failure_counts.get(category, 0) + 1
+            if self.keep_results:
+                self.failed.append((item, category, error))
+            self._done += 1
+            if on_done:
+                on_done(item, False, self._done)
+
+    def summary(self):
+        """依錯誤分類統計失敗項目"""
+        return {ERROR_LABELS[category]: count for category, count in self._failure_counts.items()}
@@ -0,0 +1,188 @@
+import queue
+import threading
+
+import yt_dlp
+
+from dl_ingest import KIND_VIDEO, canonical_url, extract_video_id
+from dl_retry import RetryBatch
+
+# 每個分片的項目數；YouTube 扁平列表每頁約 100 項，取其一半讓工作量分散得較平均
+DEFAULT_SHARD_SIZE = 50
+DEFAULT_SHARD_WORKERS = 4
+
+
+def shard_ranges(total, shard_size=DEFAULT_SHARD_SIZE):
+    """把清單索引 1..total 切成連續範圍 [(start, end), ...]（含兩端）"""
+    shard_size = max(1, shard_size)
+    return [(start, min(start + shard_size - 1, total)) for start in range(1, total + 1, shard_size)]
+
+
+def index_width(total):
+    """編號的位數，讓檔名依字母排序時與清單順序一致"""
+    return max(2, len(str(total)))
+
+
+def numbered_prefix(index, width):
+    """輸出檔名的編號前綴，例如 '007 - '"""
+    return f"{index:0{width}d} - "
+
+
+def playlist_length(url):
+    """只讀取清單首頁，回傳 (標題, 項目數)；首頁沒有項目數時才翻完整份扁平列表計算"""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False, process=False)
+        title = info.get('title') or url
+        total = info.get('playlist_count')
+        if total is None:
+            total = sum(1 for _ in info.get('entries') or [])
+    return title, total
+
+
+def fetch_shard(url, start, end):
+    """
+    以 playlist_items 只取得 start..end 範圍的扁平列表，回傳 [(清單索引, 影片 ID)]。
+    索引取自 yt-dlp 的 requested_entries，範圍內有已刪除的影片時編號也不會錯位。
+    """
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+        'playlist_items': f"{start}-{end}",
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    entries = info.get('entries') or []
+    indices = info.get('requested_entries') or range(start, start + len(entries))
+    items = []
+    for index, entry in zip(indices, entries):
+        if entry and entry.get('id'):
+            items.append((index, entry['id']))
+    return items
+
+
+def run_sharded(shards, process_shard, workers=DEFAULT_SHARD_WORKERS, log=print):
+    """
+    以 workers 條執行緒處理各分片。分片放在共用佇列中，
+    先做完的執行緒接著取下一個分片，不會因為某段特別慢而讓其他執行緒閒置。
+    """
+    pending = queue.Queue()
+    for shard in shards:
+        pending.put(shard)
+
+    def worker():
+        while True:
+            try:
+                shard = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                process_shard(shard)
+            except Exception as e:
+                log(f"✗ 分片 {shard[0]}-{shard[1]} 處理失敗: {str(e)}")
+
+    threads = [
+        threading.Thread(target=worker, name=f"shard-{i + 1}", daemon=True)
+        for i in range(max(1, min(workers, len(shards))))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class ShardedPlaylist:
+    """
+    大型播放清單（或頻道）的平行下載：依索引切成多個範圍，
+    每個工作執行緒以自己的下載器取得範圍內的列表並逐一下載。
+    輸出檔名加上清單中的編號，不論哪個分片先完成，依檔名排序都與原清單順序一致。
+    make_downloader() 每條執行緒呼叫一次，下載器之間應共用轉檔池與磁碟預算。
+    """
+
+    def __init__(self, make_downloader, quality='192', workers=DEFAULT_SHARD_WORKERS,
+                 shard_size=DEFAULT_SHARD_SIZE, numbered=True, log=print):
+        self.make_downloader = make_downloader
+        self.quality = quality
+        self.workers = workers
+        self.shard_size = shard_size
+        self.numbered = numbered
+        self.log = log
+        self.listed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self._failure_counts = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _downloader(self):
+        downloader = getattr(self._local, 'downloader', None)
+        if downloader is None:
+            downloader = self._local.downloader = self.make_downloader()
+        return downloader
+
+    def run(self, url):
+        title, total = playlist_length(url)
+        if not total:
+            self.log(f"播放清單沒有任何項目: {title}")
+            return False
+
+        shards = shard_ranges(total, self.shard_size)
+        self.log(f"\n{'='*50}")
+        self.log(f"播放清單: {title}（共 {total} 個，分成 {len(shards)} 段，"
+                 f"{min(self.workers, len(shards))} 個工作執行緒）")
+        self.log(f"{'='*50}")
+        width = index_width(total)
+        run_sharded(shards, lambda shard: self._process_shard(url, shard, width), self.workers, self.log)
+        return self.failed == 0
+
+    def _process_shard(self, url, shard, width):
+        start, end = shard
+        downloader = self._downloader()
+        items = fetch_shard(url, start, end)
+        with self._lock:
+            self.listed += len(items)
+        self.log(f"▶ 第 {start}-{end} 項: {len(items)} 個影片")
+
+        prefixes = {}
+        for index, video_id in items:
+            prefixes[video_id] = numbered_prefix(index, width) if self.numbered else ''
+
+        def attempt(video_id):
+            # 不等待轉檔，同一條執行緒的下一個下載可以和轉檔同時進行
+            if downloader.download_with_format(canonical_url(KIND_VIDEO, video_id), quality=self.quality,
+                                               wait=False, name_prefix=prefixes[video_id]):
+                return None
+            return downloader.last_error or Exception("下載失敗")
+
+        def on_done(video_id, success, done):
+            with self._lock:
+                if success:
+                    self.succeeded += 1
+                else:
+                    self.failed += 1
+            if not success:
+                downloader.discard_partials(canonical_url(KIND_VIDEO, video_id))
+            self.log(f"分片 {start}-{end}: {done}/{len(items)} | {self.describe()}")
+
+        batch = RetryBatch(downloader.retry_policy, log=self.log, keep_results=False)
+        # 轉檔與完整性檢查完成後才算完成，失敗時重新排入這一段
+        downloader.defer_result = lambda url: batch.defer(extract_video_id(url))
+        try:
+            batch.run((video_id for _, video_id in items), attempt, on_done)
+        finally:
+            downloader.defer_result = None
+        with self._lock:
+            for label, count in batch.summary().items():
+                self._failure_counts[label] = self._failure_counts.get(label, 0) + count
+
+    def summary(self):
+        """依錯誤分類統計所有分片的失敗項目"""
+        return dict(self._failure_counts)
+
+    def describe(self):
+        return f"已列出 {self.listed} 個 | 成功 {self.succeeded} 個 | 失敗 {self.failed} 個"
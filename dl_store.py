@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import platform
+import shutil
+
+# Linux 的 FICLONE ioctl（btrfs、XFS 等支援 reflink 的檔案系統）
+_FICLONE = 0x40049409
+
+
+def _reflink(source, dest):
+    """嘗試以 reflink（寫入時複製）建立檔案；不支援時拋出 OSError"""
+    if platform.system() != "Linux":
+        raise OSError("reflink 僅支援 Linux")
+    import fcntl
+    with open(source, 'rb') as src, open(dest, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(dest)
+            raise
+
+
+class MediaStore:
+    """
+    以「影片 ID + 格式 + 品質」為鍵的本機媒體儲存庫。
+    同一份媒體只存一次，每次請求的輸出路徑以 reflink 或硬連結產生，
+    重複的請求不需要網路也不佔用額外磁碟空間。
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(video_id, fmt, quality):
+        raw = f"{video_id}|{fmt}|{quality}".encode('utf-8')
+        return hashlib.sha256(raw).hexdigest()
+
+    def _object_base(self, key):
+        return os.path.join(self.root, "objects", key[:2], key)
+
+    def lookup(self, video_id, fmt, quality):
+        """查詢儲存庫，回傳 {'path', 'title', ...}；沒有時回傳 None"""
+        base = self._object_base(self.make_key(video_id, fmt, quality))
+        try:
+            with open(base + ".json", 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        entry['path'] = base + "." + entry.get('ext', 'mp3')
+        if not os.path.exists(entry['path']):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, path, video_id, fmt, quality, title):
+        """
+        將已完成的檔案收進儲存庫，原路徑改為指向儲存庫的連結。
+        回傳原路徑的建立方式（'reflink'、'hardlink' 或 'copy'）。
+        """
+        key = self.make_key(video_id, fmt, quality)
+        base = self._object_base(key)
+        ext = os.path.splitext(path)[1].lstrip('.') or 'bin'
+        object_path = base + "." + ext
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+
+        try:
+            os.replace(path, object_path)
+        except OSError:
+            # 跨檔案系統時無法直接搬移
+            shutil.copy2(path, object_path)
+            os.remove(path)
+
+        entry = {
+            'video_id': video_id,
+            'format': fmt,
+            'quality': quality,
+            'title': title,
+            'ext': ext,
+        }
+        temp_meta = base + ".json.tmp"
+        with open(temp_meta, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(temp_meta, base + ".json")
+
+        return self.materialize(object_path, path)
+
+    def materialize(self, object_path, dest):
+        """
+        在 dest 建立儲存庫檔案的副本：優先 reflink，其次硬連結，最後才複製。
+        回傳使用的方式；dest 已經是同一個檔案時回傳 'exists'。
+        """
+        if os.path.exists(dest) and os.path.samefile(object_path, dest):
+            return 'exists'
+
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        temp_dest = dest + ".link.tmp"
+        if os.path.exists(temp_dest):
+            os.remove(temp_dest)
+
+        try:
+            _reflink(object_path, temp_dest)
+            method = 'reflink'
+        except OSError:
+            try:
+                os.link(object_path, temp_dest)
+                method = 'hardlink'
+            except OSError:
+                shutil.copy2(object_path, temp_dest)
+                method = 'copy'
+
+        os.replace(temp_dest, dest)
+        return method
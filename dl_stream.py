@@ -0,0 +1,144 @@
+import collections
+import os
+import re
+import subprocess
+import threading
+import time
+
+from yt_dlp.networking import Request
+from yt_dlp.networking.exceptions import HTTPError, TransportError
+
+from dl_transcode import build_mp3_command
+
+# 每次範圍請求的大小，與 yt-dlp 對 YouTube 使用的 http_chunk_size 相同，避免單一大範圍請求被限速
+STREAM_CHUNK_SIZE = 10 * 1024 * 1024
+READ_SIZE = 64 * 1024
+# 同一個位置連線中斷時的重試次數（FFmpeg 仍在等待輸入，從中斷的位元組接著送）
+STREAM_RETRIES = 3
+
+
+class _ShortRead(ConnectionError):
+    """連線在範圍結束前關閉（read() 回傳空位元組，不會拋出 IncompleteRead）"""
+
+
+def _content_range_total(headers):
+    """從 Content-Range: bytes a-b/總大小 取得檔案的實際大小；沒有時回傳 None"""
+    match = re.match(r'bytes \d+-\d+/(\d+)', headers.get('Content-Range') or '')
+    return int(match.group(1)) if match else None
+
+
+def streamable(info):
+    """選定的格式是否為單一 HTTP 檔案；影音分開、DASH 分段、HLS 等無法直接串流"""
+    if not info or info.get('requested_formats'):
+        return False
+    return info.get('protocol') in ('http', 'https') and bool(info.get('url'))
+
+
+def _drain(stream, tail):
+    """持續讀取 FFmpeg 的 stderr（只保留最後幾行），避免管線塞滿讓 FFmpeg 卡住"""
+    for line in iter(stream.readline, b''):
+        tail.append(line.decode('utf-8', 'replace').rstrip())
+    stream.close()
+
+
+def stream_to_mp3(ydl, info, targets, ffmpeg_path, encoder, audio_filter=None, progress_hooks=(),
+                  chunk_size=STREAM_CHUNK_SIZE):
+    """
+    邊下載邊轉檔：以 ydl 的連線（含 Cookies、代理設定）分段讀取選定格式，
+    收到的資料直接寫入 FFmpeg 的標準輸入，不在磁碟上留下來源檔。
+    最後一個位元組送出後 FFmpeg 只需處理緩衝區中剩下的資料，MP3 幾乎立即完成。
+    targets 為 [(輸出路徑, 位元率), ...]；先寫到暫存檔，成功後才改名。
+    progress_hooks 會收到與 yt-dlp 相同格式的 'downloading'／'finished' 進度資料。
+    """
+    temp_targets = [(output + ".part.mp3", quality) for output, quality in targets]
+    for output, _ in targets:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    cmd = build_mp3_command(ffmpeg_path, "pipe:0", temp_targets, audio_filter=audio_filter, encoder=encoder)
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    tail = collections.deque(maxlen=20)
+    drainer = threading.Thread(target=_drain, args=(proc.stderr, tail), daemon=True)
+    drainer.start()
+
+    # size 為確定的檔案大小（格式表的 filesize 或伺服器回傳的 Content-Range），用來判斷是否收齊；
+    # total 只用於進度顯示，可能是估計值
+    size = info.get('filesize')
+    total = size or info.get('filesize_approx')
+    headers = dict(info.get('http_headers') or {})
+    downloaded = 0
+    started = time.monotonic()
+
+    def report(status):
+        elapsed = time.monotonic() - started
+        speed = downloaded / elapsed if elapsed > 0 else None
+        d = {
+            'status': status,
+            'downloaded_bytes': downloaded,
+            'total_bytes': total,
+            'speed': speed,
+            'eta': int((total - downloaded) / speed) if total and speed else None,
+            'elapsed': elapsed,
+            'info_dict': info,
+            # 串流模式下 MP3 與下載同時產生，不需要另外的轉換監控
+            'streamed': True,
+        }
+        for hook in progress_hooks:
+            hook(d)
+
+    try:
+        while True:
+            if size and downloaded >= size:
+                break
+            chunk_start = downloaded
+            chunk_end = chunk_start + chunk_size - 1
+            for attempt in range(STREAM_RETRIES + 1):
+                headers['Range'] = f"bytes={downloaded}-{chunk_end}"
+                try:
+                    with ydl.urlopen(Request(info['url'], headers=headers)) as response:
+                        size = _content_range_total(response.headers) or size
+                        total = size or total
+                        while True:
+                            block = response.read(READ_SIZE)
+                            if not block:
+                                break
+                            proc.stdin.write(block)
+                            downloaded += len(block)
+                            report('downloading')
+                    # 大小已知時確認這一段收齊，否則從已收到的位置重新請求（與 yt-dlp 的 ContentTooShortError 相同）
+                    expected = min(chunk_end + 1, size) if size else None
+                    if expected is not None and downloaded < expected:
+                        raise _ShortRead(f"串流中斷: 收到 {downloaded} 位元組，預期 {expected} 位元組")
+                    break
+                except BrokenPipeError:
+                    # FFmpeg 已提前結束，回報它自己的錯誤訊息
+                    proc.wait()
+                    drainer.join()
+                    raise RuntimeError(f"FFmpeg 轉檔失敗: {tail[-1] if tail else '未知錯誤'}")
+                except HTTPError as e:
+                    # 起點已超過檔案結尾（檔案大小剛好是分段大小的倍數）
+                    if e.status == 416 and downloaded > 0:
+                        break
+                    raise
+                except (TransportError, ConnectionError, TimeoutError):
+                    if attempt == STREAM_RETRIES:
+                        raise
+            # 大小未知時，這一段沒有讀滿代表已到檔案結尾
+            if not size and downloaded - chunk_start < chunk_size:
+                break
+
+        proc.stdin.close()
+        returncode = proc.wait()
+        drainer.join()
+        if returncode != 0:
+            raise RuntimeError(f"FFmpeg 轉檔失敗: {tail[-1] if tail else '未知錯誤'}")
+        report('finished')
+        for (temp_output, _), (output, _) in zip(temp_targets, targets):
+            os.replace(temp_output, output)
+        return downloaded
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        for temp_output, _ in temp_targets:
+            if os.path.exists(temp_output):
+                os.remove(temp_output)
+        raise
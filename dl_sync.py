@@ -0,0 +1,235 @@
+import sqlite3
+import threading
+import time
+
+import yt_dlp
+
+from dl_ingest import KIND_PLAYLIST, KIND_VIDEO, canonical_url, parse_youtube_url
+from dl_retry import ERROR_BOT, ERROR_LABELS, ERROR_UNAVAILABLE, RetryBatch, classify_error
+
+# 重試也不會成功的錯誤：記錄為已處理，不因此保留清單的重新列出
+PERMANENT_ERRORS = (ERROR_UNAVAILABLE, ERROR_BOT)
+
+
+class SyncState:
+    """
+    以 SQLite 保存每個播放清單上次同步時看到的影片 ID，
+    以及清單的指紋（最後更新日期 + 影片數），用來判斷清單是否有變動。
+    無法下載的影片也會記錄（reason 為錯誤分類），之後的同步不再嘗試。
+    """
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS playlists (
+                id TEXT PRIMARY KEY,
+                title TEXT,
+                fingerprint TEXT,
+                synced REAL
+            );
+            CREATE TABLE IF NOT EXISTS entries (
+                playlist_id TEXT NOT NULL,
+                video_id TEXT NOT NULL,
+                added REAL,
+                reason TEXT,
+                PRIMARY KEY (playlist_id, video_id)
+            ) WITHOUT ROWID;
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(entries)")}
+        if 'reason' not in columns:
+            # 舊版建立的資料庫沒有 reason 欄位
+            self._conn.execute("ALTER TABLE entries ADD COLUMN reason TEXT")
+        self._conn.commit()
+
+    def fingerprint(self, playlist_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint FROM playlists WHERE id = ?", (playlist_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def seen(self, playlist_id):
+        """上次同步時已下載或確定無法下載的影片 ID"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT video_id FROM entries WHERE playlist_id = ?", (playlist_id,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def mark_downloaded(self, playlist_id, video_id):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO entries (playlist_id, video_id, added) VALUES (?, ?, ?)",
+                (playlist_id, video_id, time.time())
+            )
+            self._conn.commit()
+
+    def mark_unavailable(self, playlist_id, video_id, category):
+        """記錄無法下載的影片，之後的同步不再嘗試"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO entries (playlist_id, video_id, added, reason) VALUES (?, ?, ?, ?)",
+                (playlist_id, video_id, time.time(), category)
+            )
+            self._conn.commit()
+
+    def forget(self, playlist_id, video_ids):
+        """移除已從播放清單中刪除的項目（不會刪除已下載的檔案）"""
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM entries WHERE playlist_id = ? AND video_id = ?",
+                [(playlist_id, video_id) for video_id in video_ids]
+            )
+            self._conn.commit()
+
+    def finish(self, playlist_id, title, fingerprint):
+        """
+        記錄同步完成；有項目可重試的失敗時 fingerprint 傳 None，
+        下次同步就不會因為指紋相同而略過這個清單。
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO playlists (id, title, fingerprint, synced) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET title = excluded.title, "
+                "fingerprint = excluded.fingerprint, synced = excluded.synced",
+                (playlist_id, title, fingerprint, time.time())
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _fingerprint(info):
+    """
+    播放清單的最後更新日期與影片數；兩者都取不到時回傳 None（無法判斷，一律重新列出）。
+    日期只精確到日，同一天內新增與刪除數量相同時要到隔天才會被偵測到。
+    """
+    modified = info.get('modified_date')
+    count = info.get('playlist_count')
+    if modified is None and count is None:
+        return None
+    return f"{modified}|{count}"
+
+
+def fetch_listing(playlist_id, known_fingerprint=None):
+    """
+    取得播放清單的扁平列表（只有影片 ID，不解析各影片）。
+    回傳 (標題, 指紋, 影片 ID 清單)；指紋與上次相同時影片清單為 None，
+    此時只發出了讀取清單首頁的一個請求，不會繼續翻頁。
+    """
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(canonical_url(KIND_PLAYLIST, playlist_id), download=False, process=False)
+        title = info.get('title') or playlist_id
+        fingerprint = _fingerprint(info)
+        if fingerprint is not None and fingerprint == known_fingerprint:
+            return title, fingerprint, None
+
+        # entries 是產生器，翻頁請求在讀取時才發出，必須在 YoutubeDL 關閉前讀完
+        video_ids = []
+        for entry in info.get('entries') or []:
+            if not entry:
+                continue
+            video_id = entry.get('id')
+            if not video_id:
+                parsed = parse_youtube_url(entry.get('url') or '')
+                video_id = parsed[1] if parsed and parsed[0] == KIND_VIDEO else None
+            if video_id:
+                video_ids.append(video_id)
+    return title, fingerprint, video_ids
+
+
+class PlaylistSync:
+    """增量同步播放清單：只下載上次同步之後新增的影片"""
+
+    def __init__(self, downloader, state, quality='192', log=print):
+        self.downloader = downloader
+        self.state = state
+        self.quality = quality
+        self.log = log
+        self.unchanged = 0
+        self.added = 0
+        self.removed = 0
+        self.failed = 0
+        self.unavailable = 0
+
+    def sync(self, playlist_url):
+        parsed = parse_youtube_url(playlist_url)
+        if not parsed or parsed[0] != KIND_PLAYLIST:
+            self.log(f"不是播放清單網址: {playlist_url}")
+            return False
+        playlist_id = parsed[1]
+
+        title, fingerprint, video_ids = fetch_listing(playlist_id, self.state.fingerprint(playlist_id))
+        if video_ids is None:
+            self.unchanged += 1
+            self.log(f"＝ 沒有變動: {title}")
+            return True
+
+        seen = self.state.seen(playlist_id)
+        current = set(video_ids)
+        added = [video_id for video_id in dict.fromkeys(video_ids) if video_id not in seen]
+        removed = seen - current
+        self.log(f"\n{'='*50}")
+        self.log(f"播放清單: {title}（共 {len(current)} 個，新增 {len(added)} 個，移除 {len(removed)} 個）")
+        self.log(f"{'='*50}")
+
+        if removed:
+            # 只更新同步紀錄，已下載的檔案保留
+            self.state.forget(playlist_id, removed)
+            self.removed += len(removed)
+
+        downloader = self.downloader
+        # 每個影片最後一次失敗的錯誤，項目放棄時用來判斷是否值得下次再試
+        last_errors = {}
+        retryable = 0
+
+        def attempt(video_id):
+            # 等轉檔完成才算成功，確定檔案已產生後才記錄為已同步
+            if downloader.download_with_format(canonical_url(KIND_VIDEO, video_id), quality=self.quality):
+                return None
+            error = downloader.last_error or Exception("下載失敗")
+            last_errors[video_id] = error
+            return error
+
+        def on_done(video_id, success, done):
+            nonlocal retryable
+            error = last_errors.pop(video_id, None)
+            if success:
+                # 每完成一個就記錄，中途中斷時下次同步不會重複下載
+                self.state.mark_downloaded(playlist_id, video_id)
+                self.added += 1
+            else:
+                downloader.discard_partials(canonical_url(KIND_VIDEO, video_id))
+                category = classify_error(error) if error is not None else None
+                if category in PERMANENT_ERRORS:
+                    # 私人、已移除或需要驗證的影片重試也不會成功，記錄下來以免清單一直無法略過
+                    self.state.mark_unavailable(playlist_id, video_id, category)
+                    self.unavailable += 1
+                    self.log(f"略過（{ERROR_LABELS[category]}）: {video_id}")
+                else:
+                    self.failed += 1
+                    retryable += 1
+            self.log(f"同步進度: {done}/{len(added)}")
+
+        batch = RetryBatch(downloader.retry_policy, log=self.log, keep_results=False)
+        batch.run(added, attempt, on_done)
+        for label, count in batch.summary().items():
+            self.log(f"  {label}: {count}")
+
+        # 有可重試的失敗時不保存指紋，下次同步會重新列出並補下載
+        complete = retryable == 0
+        self.state.finish(playlist_id, title, fingerprint if complete else None)
+        return complete
+
+    def describe(self):
+        return (f"沒有變動 {self.unchanged} 個清單 | 新下載 {self.added} 個 | "
+                f"移除 {self.removed} 個 | 無法取得 {self.unavailable} 個 | 失敗 {self.failed} 個")
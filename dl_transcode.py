@@ -0,0 +1,226 @@
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dl_ffmpeg import get_capabilities
+from dl_loudness import OUTPUT_SAMPLE_RATE
+from dl_metrics import METRICS
+from dl_verify import IntegrityError
+
+DEFAULT_MP3_ENCODER = "libmp3lame"
+# 低記憶體模式下等待轉檔（與等待重試）的項目數上限
+PENDING_LIMIT = 64
+
+
+def default_worker_count():
+    """預設轉檔工作數：每個 CPU 核心一個 FFmpeg 程序"""
+    return os.cpu_count() or 1
+
+
+def parse_qualities(value):
+    """
+    將 '128,192,320' 或清單轉為位元率清單。
+    只接受固定位元率（kbps）；'V0' 之類的 VBR 等級會拋出 ValueError，
+    否則要到轉檔或估計磁碟用量時才失敗。
+    """
+    if isinstance(value, (list, tuple)):
+        items = value
+    else:
+        items = str(value).split(",")
+    qualities = []
+    for item in items:
+        item = str(item).strip().lower().rstrip("k")
+        if not item:
+            continue
+        if not item.isdigit() or int(item) <= 0:
+            raise ValueError(f"不支援的 MP3 音質: {item}（請指定位元率，例如 128、192、320）")
+        if item not in qualities:
+            qualities.append(item)
+    return qualities
+
+
+def quality_outputs(output_dir, title, qualities):
+    """
+    依位元率決定輸出路徑：單一位元率直接放在輸出目錄，
+    多位元率時每個位元率各自一個子目錄（例如 downloads/320k/標題.mp3）。
+    """
+    if len(qualities) == 1:
+        return [(os.path.join(output_dir, f"{title}.mp3"), qualities[0])]
+    return [(os.path.join(output_dir, f"{q}k", f"{title}.mp3"), q) for q in qualities]
+
+
+def mp3_encoder_for(ffmpeg_path):
+    """依 FFmpeg 的能力（有磁碟快取）選擇 MP3 編碼器；無法檢查時使用 libmp3lame"""
+    capabilities = get_capabilities(ffmpeg_path)
+    return (capabilities and capabilities.best_encoder('mp3')) or DEFAULT_MP3_ENCODER
+
+
+def build_mp3_command(ffmpeg_path, source, targets, threads=1, audio_filter=None, encoder=DEFAULT_MP3_ENCODER):
+    """
+    組出轉換為 MP3 的 FFmpeg 指令。
+    targets 為 [(輸出路徑, 位元率), ...]；多個輸出共用同一次解碼。
+    audio_filter 為套用到每個輸出的音訊濾鏡（例如響度標準化）。
+    """
+    cmd = [
+        ffmpeg_path or "ffmpeg", "-hide_banner", "-nostdin", "-y",
+        "-threads", str(threads),
+        "-i", source,
+    ]
+    for output, quality in targets:
+        cmd += [
+            "-vn", "-map", "0:a:0",
+            "-threads", str(threads),
+        ]
+        if audio_filter:
+            cmd += ["-af", audio_filter, "-ar", OUTPUT_SAMPLE_RATE]
+        cmd += [
+            "-c:a", encoder, "-b:a", f"{quality}k",
+            output,
+        ]
+    return cmd
+
+
+class TranscodePool:
+    """
+    專用的 FFmpeg 轉檔池。
+    每個工作都是獨立的 FFmpeg 子程序，池中的執行緒只負責啟動並等待它結束，
+    因此轉檔可以同時用滿所有核心，而不受下載執行緒數量限制。
+    max_pending 限制尚未完成的工作數，達到上限時 submit 會等待，
+    避免下載遠快於轉檔時佇列（與待轉檔的暫存檔）無限增長。
+    encoder 未指定時依 FFmpeg 的能力自動選擇 MP3 編碼器。
+    """
+
+    def __init__(self, ffmpeg_path="ffmpeg", workers=None, threads_per_job=None, log=print,
+                 max_pending=None, encoder=None):
+        self.ffmpeg_path = ffmpeg_path or "ffmpeg"
+        self.workers = workers or default_worker_count()
+        capabilities = get_capabilities(self.ffmpeg_path)
+        self.encoder = encoder or mp3_encoder_for(self.ffmpeg_path)
+        # 明確指定每個 FFmpeg 可用的執行緒數，避免多個程序互相搶核心；不支援多執行緒的組建固定為 1
+        if capabilities and not capabilities.threads:
+            threads_per_job = 1
+        self.threads_per_job = threads_per_job or max(1, (os.cpu_count() or 1) // self.workers)
+        self.log = log
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="transcode")
+        self._lock = threading.Lock()
+        self._futures = set()
+        self._slots = threading.BoundedSemaphore(max_pending) if max_pending else None
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    def build_command(self, source, targets, audio_filter=None):
+        """組出轉換為 MP3 的 FFmpeg 指令"""
+        return build_mp3_command(self.ffmpeg_path, source, targets, self.threads_per_job, audio_filter, self.encoder)
+
+    def submit(self, source, output, quality="192", delete_source=True, on_done=None, audio_filter=None,
+               verify=None):
+        """
+        加入轉檔工作，回傳 Future（結果為輸出檔路徑清單）。
+        on_done(output, error) 會在轉檔執行緒中呼叫，error 為 None 代表成功。
+        audio_filter(source) 回傳要套用的音訊濾鏡，同樣在轉檔執行緒中呼叫（可以執行量測等耗時工作）。
+        verify(path) 在轉檔執行緒中檢查每個輸出檔，拋出 IntegrityError 時視為轉檔失敗，
+        輸出檔與來源檔都會刪除（來源檔可能就是被截斷的下載，重試時必須重新下載）。
+        """
+        return self.submit_multi(source, [(output, quality)], delete_source, on_done, audio_filter, verify)
+
+    def submit_multi(self, source, targets, delete_source=True, on_done=None, audio_filter=None, verify=None):
+        """一次解碼、同時輸出多個位元率；on_done 會對每個輸出檔各呼叫一次"""
+        if self._slots:
+            self._slots.acquire()
+        with self._lock:
+            self.queued += 1
+        future = self._executor.submit(self._run, source, list(targets), delete_source, on_done, audio_filter,
+                                       verify)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+        return future
+
+    def _forget(self, future):
+        with self._lock:
+            self._futures.discard(future)
+        if self._slots:
+            self._slots.release()
+
+    def _run(self, source, targets, delete_source, on_done, audio_filter, verify):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+
+        # 先寫到暫存檔再改名，中途失敗不會留下半成品
+        temp_targets = [(output + ".part.mp3", quality) for output, quality in targets]
+        error = None
+        try:
+            for output, _ in targets:
+                os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+            cmd = self.build_command(source, temp_targets, audio_filter(source) if audio_filter else None)
+            started = time.monotonic()
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            METRICS.transcode_seconds.observe(
+                time.monotonic() - started, (",".join(q for _, q in targets),)
+            )
+            if result.returncode != 0:
+                tail = result.stderr.strip().splitlines()[-1:] or ["未知錯誤"]
+                raise RuntimeError(f"FFmpeg 轉檔失敗: {tail[0]}")
+            if verify:
+                for temp_output, _ in temp_targets:
+                    verify(temp_output)
+            for (temp_output, _), (output, _) in zip(temp_targets, targets):
+                os.replace(temp_output, output)
+            outputs = {os.path.abspath(output) for output, _ in targets}
+            if delete_source and os.path.abspath(source) not in outputs:
+                os.remove(source)
+        except Exception as e:
+            error = e
+            for temp_output, _ in temp_targets:
+                if os.path.exists(temp_output):
+                    os.remove(temp_output)
+            if isinstance(e, IntegrityError) and delete_source and os.path.exists(source):
+                os.remove(source)
+
+        with self._lock:
+            self.running -= 1
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+        if on_done:
+            for output, _ in targets:
+                on_done(output, error)
+        if error is not None:
+            raise error
+        return [output for output, _ in targets]
+
+    def stats(self):
+        """目前的佇列深度與統計"""
+        with self._lock:
+            return {
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "workers": self.workers,
+            }
+
+    def describe(self):
+        s = self.stats()
+        return (f"轉檔佇列: 等待 {s['queued']} | 執行中 {s['running']}/{s['workers']} | "
+                f"完成 {s['completed']} | 失敗 {s['failed']}")
+
+    def wait(self):
+        """等待所有已提交的工作完成"""
+        with self._lock:
+            pending = list(self._futures)
+        for future in pending:
+            try:
+                future.result()
+            except Exception:
+                pass
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
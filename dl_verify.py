@@ -0,0 +1,65 @@
+import os
+import subprocess
+
+from dl_metrics import METRICS
+
+# 實際長度與影片資訊的 duration 可接受的差距：比例或固定秒數，取較大者
+# （編碼器延遲、最後一個不完整的影格、YouTube 回報的長度為整數秒）
+DURATION_TOLERANCE = 0.02
+MIN_TOLERANCE_SECONDS = 2.0
+# 掃描封包只讀取檔案，數小時的檔案也只需要數秒；逾時視為檔案異常
+VERIFY_TIMEOUT = 120
+
+
+class IntegrityError(Exception):
+    """輸出檔不完整或無法解析（下載被截斷、轉檔中斷等），重新下載通常可以解決"""
+
+
+def scan_duration(path, ffmpeg_path=None):
+    """
+    以 FFmpeg 讀取容器標頭並逐一掃描音訊封包（-c copy 輸出到 null，不解碼），回傳實際長度（秒）。
+    無法開啟、找不到音訊或讀取中發生錯誤時拋出 IntegrityError。
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        raise IntegrityError(f"完整性檢查失敗: 檔案不存在或是空的 ({os.path.basename(path)})")
+    cmd = [
+        ffmpeg_path or "ffmpeg", "-hide_banner", "-nostdin", "-v", "error",
+        "-i", path,
+        "-map", "0:a:0", "-c", "copy", "-f", "null",
+        "-progress", "pipe:1", "-nostats", "-",
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, errors='replace', timeout=VERIFY_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        raise IntegrityError(f"完整性檢查失敗: 掃描逾時 ({os.path.basename(path)})")
+
+    errors = result.stderr.strip().splitlines()
+    out_time = None
+    for line in result.stdout.splitlines():
+        if line.startswith("out_time_us="):
+            value = line.split("=", 1)[1].strip()
+            if value.lstrip("-").isdigit():
+                out_time = int(value) / 1_000_000
+    if result.returncode != 0 or out_time is None or out_time <= 0:
+        reason = errors[-1] if errors else "沒有可讀取的音訊"
+        raise IntegrityError(f"完整性檢查失敗: {reason} ({os.path.basename(path)})")
+    return out_time
+
+
+def verify_media(path, expected_duration=None, ffmpeg_path=None):
+    """
+    檢查輸出檔：容器與封包可以完整讀取，且長度與影片資訊的 duration 相符（未知時只檢查容器）。
+    通過時回傳實際長度，否則拋出 IntegrityError。
+    """
+    try:
+        duration = scan_duration(path, ffmpeg_path)
+        if expected_duration:
+            tolerance = max(MIN_TOLERANCE_SECONDS, expected_duration * DURATION_TOLERANCE)
+            if abs(duration - expected_duration) > tolerance:
+                raise IntegrityError(
+                    f"完整性檢查失敗: 長度 {duration:.1f} 秒，預期 {expected_duration:.0f} 秒 ({os.path.basename(path)})"
+                )
+    except IntegrityError:
+        METRICS.verify_failures.inc()
+        raise
+    return duration